@@ -0,0 +1,296 @@
+"""Sliding-window profiles of the codon usage of original and harmonized sequences"""
+try:
+    import numpy
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+from .. import IO
+from ..Codons import CODON_INDEX, N_UNAMBIGUOUS, encode_codons
+
+# Differences in codon usage above which codons are counted as badly harmonized, for fractions and frequencies/1000
+DIFFERENCE_THRESHOLDS = {False: 0.2, True: 5}
+# Number of codons per window of the profiles; Clarke & Clark (2008) use windows of 18 codons for %MinMax
+DEFAULT_WINDOW = 18
+# Relative adaptiveness used for codons that are never used by an organism, as their logarithm is undefined
+MIN_ADAPTIVENESS = 0.01
+# Columns of the profiles
+PROFILE_COLUMNS = ('start', 'end', 'minmax_origin', 'minmax_host', 'cai_origin', 'cai_host', 'mean_initial_df',
+                   'mean_final_df', 'max_final_df', 'above_threshold')
+
+
+def window_starts(length, window, step=None):
+    """
+    Return the first codons (0-based) of the windows of a sequence
+    :param length:  Integer; Number of codons of the sequence
+    :param window:  Integer; Number of codons per window; limited to the length of the sequence
+    :param step:    Integer; Distance between the starts of two windows; defaults to window (non-overlapping windows).
+                    The last window always ends with the last codon.
+    :return:        Tuple of the array of starts and the window size actually used
+    """
+    window = max(1, min(int(window), length))
+    if step is None:
+        step = window
+    starts = numpy.arange(0, max(length - window, 0) + 1, max(1, int(step)))
+    if not length:
+        starts = starts[:0]
+    elif starts[-1] + window < length:
+        # the last window ends with the last codon
+        starts = numpy.append(starts, length - window)
+    return starts, window
+
+
+def window_sums(values, starts, window):
+    """
+    Sum values in windows using prefix sums, so the cost does not depend on the window size. NaN values are ignored.
+    :param values:  numpy array with one value per codon
+    :param starts:  Array of the first codons of the windows (see window_starts())
+    :param window:  Integer; Number of codons per window
+    :return:        Tuple of the arrays of sums and of the numbers of values that are not NaN
+    """
+    values = numpy.asarray(values, dtype=float)
+    valid = ~numpy.isnan(values)
+    sums = numpy.concatenate(([0.0], numpy.cumsum(numpy.where(valid, values, 0.0))))
+    counts = numpy.concatenate(([0], numpy.cumsum(valid)))
+    return sums[starts + window] - sums[starts], counts[starts + window] - counts[starts]
+
+
+def rolling_max(values, window):
+    """
+    Return the maximum of every window of values starting at 0 ... len(values) - window. The maxima are computed from
+    the running maxima within blocks of the window size (van Herk/Gil-Werman), so the cost does not depend on the
+    window size.
+    :param values:  numpy array
+    :param window:  Integer; Number of values per window
+    :return:        numpy array
+    """
+    values = numpy.asarray(values, dtype=float)
+    window = int(window)
+    if window < 1 or window > len(values):
+        raise ValueError('Windows of {} values do not fit into {} values'.format(window, len(values)))
+    padded = numpy.full(-(-len(values) // window) * window, -numpy.inf)
+    padded[:len(values)] = values
+    blocks = padded.reshape(-1, window)
+    prefix = numpy.maximum.accumulate(blocks, axis=1).ravel()
+    suffix = numpy.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    n_windows = len(values) - window + 1
+    return numpy.maximum(suffix[:n_windows], prefix[window - 1:window - 1 + n_windows])
+
+
+def window_statistics(values, window, threshold, step=None):
+    """
+    Aggregate per-codon values in sliding windows. Windows are computed from prefix sums and block maxima, so the
+    cost does not depend on the window size. NaN values (e.g. of unresolved ambiguous codons) are ignored.
+
+    :param values:      numpy array with one value per codon
+    :param window:      number of codons per window
+    :param threshold:   values above threshold are counted
+    :param step:        distance between the starts of two windows; defaults to window (non-overlapping windows).
+                        The last window always ends with the last codon.
+    :return statistics: dict of numpy arrays with one entry per window: 'start' (first codon, 0-based), 'mean',
+                        'max' and 'above' (fraction of codons above threshold)
+    """
+    values = numpy.asarray(values, dtype=float)
+    starts, window = window_starts(len(values), window, step)
+    sums, n_valid = window_sums(values, starts, window)
+    above = window_sums(numpy.where(numpy.isnan(values), numpy.nan, values > threshold), starts, window)[0]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / n_valid
+        fraction_above = above / n_valid
+
+    maxima = numpy.full(len(starts), numpy.nan)
+    if len(starts):
+        maxima = rolling_max(numpy.where(numpy.isnan(values), -numpy.inf, values), window)[starts]
+        maxima[n_valid == 0] = numpy.nan
+
+    return {'start': starts, 'mean': mean, 'max': maxima, 'above': fraction_above}
+
+
+def usage_values(table):
+    """
+    Return the codon usage of a codon usage table as arrays indexed by codon index (see LibCharm.Codons.CODONS).
+    Codons missing from the table are NaN.
+    :param table:   CodonUsageTable object; fractions or frequencies/1000, as loaded
+    :return:        Dictionary of numpy arrays:
+                    usage        - usage of the codon
+                    minimum      - lowest usage of the codons of the same amino acid
+                    maximum      - highest usage of the codons of the same amino acid
+                    average      - mean usage of the codons of the same amino acid
+                    adaptiveness - relative adaptiveness w (usage / maximum) of Sharp & Li (1987); NaN for stop
+                                   codons and amino acids with a single codon, which do not count in the CAI
+    """
+    values = {name: numpy.full(N_UNAMBIGUOUS, numpy.nan) for name in ('usage', 'minimum', 'maximum', 'average',
+                                                                      'adaptiveness')}
+    for aa, codons in table.usage_table.items():
+        indices = [CODON_INDEX[codon] for codon in codons]
+        usage = numpy.array([codon['f'] for codon in codons.values()], dtype=float)
+        values['usage'][indices] = usage
+        values['minimum'][indices] = usage.min()
+        values['maximum'][indices] = usage.max()
+        values['average'][indices] = usage.mean()
+        if aa != '*' and len(indices) > 1 and usage.max() > 0:
+            values['adaptiveness'][indices] = numpy.maximum(usage / usage.max(), MIN_ADAPTIVENESS)
+    return values
+
+
+def _lookup(values, indices):
+    # ambiguous codons are not part of the codon usage tables
+    indices = numpy.asarray(indices)
+    unambiguous = indices < N_UNAMBIGUOUS
+    return numpy.where(unambiguous, values[numpy.where(unambiguous, indices, 0)], numpy.nan)
+
+
+def minmax_profile(indices, values, starts, window):
+    """
+    Return %MinMax (Clarke & Clark, 2008) of windows of codons: 100% if every codon of a window is the most used codon
+    of its amino acid, -100% if it is the least used and 0% if the usage matches the mean of the synonymous codons.
+    :param indices: Array of codon indices
+    :param values:  Codon usage of the organism as returned by usage_values()
+    :param starts:  Array of the first codons of the windows (see window_starts())
+    :param window:  Integer; Number of codons per window
+    :return:        numpy array; NaN for windows without any codon of the codon usage table
+    """
+    usage, n_valid = window_sums(_lookup(values['usage'], indices), starts, window)
+    minimum = window_sums(_lookup(values['minimum'], indices), starts, window)[0]
+    maximum = window_sums(_lookup(values['maximum'], indices), starts, window)[0]
+    average = window_sums(_lookup(values['average'], indices), starts, window)[0]
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        minmax = numpy.where(usage >= average, (usage - average) / (maximum - average),
+                             -(average - usage) / (average - minimum)) * 100
+    # windows of amino acids with a single codon have no range
+    minmax[(maximum == minimum) & (n_valid > 0)] = 0.0
+    minmax[n_valid == 0] = numpy.nan
+    return minmax
+
+
+def cai_profile(indices, values, starts, window):
+    """
+    Return the codon adaptation index (Sharp & Li, 1987) of windows of codons, the geometric mean of the relative
+    adaptiveness of the codons. The whole codon usage table is used as reference.
+    :param indices: Array of codon indices
+    :param values:  Codon usage of the organism as returned by usage_values()
+    :param starts:  Array of the first codons of the windows (see window_starts())
+    :param window:  Integer; Number of codons per window
+    :return:        numpy array; NaN for windows without any codon counting in the CAI
+    """
+    sums, n_valid = window_sums(numpy.log(_lookup(values['adaptiveness'], indices)), starts, window)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.exp(sums / n_valid)
+
+
+def usage_profiles(original, new, usage_origin, usage_host, window=DEFAULT_WINDOW, step=1, initial_df=None,
+                   final_df=None, use_frequency=False):
+    """
+    Compute sliding-window profiles of an original and a harmonized sequence: %MinMax and CAI of the original codons
+    in the origin organism and of the new codons in the target host, and the mean and maximum difference in codon
+    usage of the windows. All profiles are computed from prefix sums, so the cost grows with the length of the
+    sequence, not with the window size.
+
+    :param original:        Array of the indices of the original codons
+    :param new:             Array of the indices of the harmonized codons
+    :param usage_origin:    CodonUsageTable of the origin organism or the values returned by usage_values()
+    :param usage_host:      CodonUsageTable of the target host or the values returned by usage_values()
+    :param window:          Integer; Number of codons per window
+    :param step:            Integer; Distance between the starts of two windows (see window_starts())
+    :param initial_df:      Array of the differences in usage of the original codons in origin and host; computed from
+                            the tables if not given (LibCharm.Codons.CodonRecord.initial_df also covers ambiguous
+                            codons)
+    :param final_df:        Array of the differences in usage of the original and the harmonized codons; computed
+                            from the tables if not given
+    :param use_frequency:   Boolean; The tables hold frequencies/1000, which selects the threshold of
+                            'above_threshold' (see DIFFERENCE_THRESHOLDS)
+    :return:                Dictionary of numpy arrays with one entry per window and the keys in PROFILE_COLUMNS;
+                            'start' is the first codon (0-based) and 'end' the codon after the window
+    """
+    if not isinstance(usage_origin, dict):
+        usage_origin = usage_values(usage_origin)
+    if not isinstance(usage_host, dict):
+        usage_host = usage_values(usage_host)
+    original = numpy.asarray(original)
+    new = numpy.asarray(new)
+    origin_f = _lookup(usage_origin['usage'], original)
+    if initial_df is None:
+        initial_df = numpy.abs(origin_f - _lookup(usage_host['usage'], original))
+    if final_df is None:
+        final_df = numpy.abs(origin_f - _lookup(usage_host['usage'], new))
+
+    starts, window = window_starts(len(original), window, step)
+    differences = window_statistics(final_df, window, DIFFERENCE_THRESHOLDS[bool(use_frequency)], step)
+    return {'start': starts,
+            'end': starts + window,
+            'minmax_origin': minmax_profile(original, usage_origin, starts, window),
+            'minmax_host': minmax_profile(new, usage_host, starts, window),
+            'cai_origin': cai_profile(original, usage_origin, starts, window),
+            'cai_host': cai_profile(new, usage_host, starts, window),
+            'mean_initial_df': window_statistics(initial_df, window, 0, step)['mean'],
+            'mean_final_df': differences['mean'],
+            'max_final_df': differences['max'],
+            'above_threshold': differences['above']}
+
+
+def sequence_profiles(sequence, window=DEFAULT_WINDOW, step=1):
+    """
+    Compute the profiles of a harmonized sequence (see usage_profiles())
+    :param sequence:    LibCharm.Sequence.Sequence object
+    :param window:      Integer; Number of codons per window
+    :param step:        Integer; Distance between the starts of two windows
+    :return:            Dictionary of numpy arrays with the keys in PROFILE_COLUMNS
+    """
+    codons = sequence.codons
+    return usage_profiles(codons.original, codons.new, sequence.usage_origin, sequence.usage_host, window, step,
+                          initial_df=codons.initial_df, final_df=codons.final_df,
+                          use_frequency=sequence.use_frequency)
+
+
+def gene_profiles(records, harmonized_records, genes, usage_origin, usage_host, window=DEFAULT_WINDOW, step=1,
+                  use_frequency=False):
+    """
+    Compute the profiles of all genes harmonized by LibCharm.Genome.harmonize_genome(). The codons are read from the
+    CDS features of the original and the harmonized records. The codon usage tables are converted only once.
+    :param records:             List of the original Bio.SeqRecord objects
+    :param harmonized_records:  List of the harmonized records returned by harmonize_genome()
+    :param genes:               List of the per-gene summaries returned by harmonize_genome()
+    :param usage_origin:        CodonUsageTable of the origin organism
+    :param usage_host:          CodonUsageTable of the target host
+    :param window:              Integer; Number of codons per window
+    :param step:                Integer; Distance between the starts of two windows
+    :param use_frequency:       Boolean; The tables hold frequencies/1000
+    :return:                    Generator of tuples of the summary and the profiles of every harmonized gene
+    """
+    usage_origin = usage_values(usage_origin)
+    usage_host = usage_values(usage_host)
+    genes = iter(genes)
+    for record, harmonized in zip(records, harmonized_records):
+        for feature in record.features:
+            if feature.type != 'CDS':
+                continue
+            gene = next(genes)
+            if gene['error']:
+                continue
+            original = encode_codons(str(feature.extract(record.seq)).upper())
+            new = encode_codons(str(feature.extract(harmonized.seq)).upper())
+            yield gene, usage_profiles(original, new, usage_origin, usage_host, window, step,
+                                       use_frequency=use_frequency)
+
+
+def write_profiles(profiles, filename, names=None):
+    """
+    Write profiles to a tab separated file. Codons are counted from 1 in the file; 'end' is the last codon of a window.
+    Values are written with 10 significant digits; undefined values are empty fields. Windows are formatted in chunks
+    (see LibCharm.IO.write_results).
+    :param profiles:    Iterable of dictionaries of numpy arrays with the keys in PROFILE_COLUMNS
+    :param filename:    String; Path of the output file
+    :param names:       Iterable of the names of the sequences, written in the additional first column 'gene'
+    """
+    columns = PROFILE_COLUMNS if names is None else ('gene',) + PROFILE_COLUMNS
+    formats = ['%d', '%d'] + ['%.10g'] * (len(PROFILE_COLUMNS) - 2)
+    with open(filename, 'w') as profile_file:
+        profile_file.write('\t'.join(columns) + '\n')
+        for index, profile in enumerate(profiles):
+            values = [profile['start'] + 1, profile['end']] + [profile[column] for column in PROFILE_COLUMNS[2:]]
+            prefix = '' if names is None else '{}\t'.format(names[index])
+            for start in range(0, len(values[0]), IO.CHUNK_SIZE):
+                chunk = [['' if value is None else field_format % value
+                          for value in IO.column_values(column[start:start + IO.CHUNK_SIZE])]
+                         for field_format, column in zip(formats, values)]
+                profile_file.write(''.join(prefix + '\t'.join(row) + '\n' for row in zip(*chunk)))
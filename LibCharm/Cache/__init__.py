@@ -0,0 +1,122 @@
+"""Persistent on-disk cache for codon usage tables obtained from http://www.kazusa.or.jp/codon"""
+import json
+import os
+import threading
+import time
+
+# Default location of the cache; can be overridden by passing a directory to TableCache
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'charm')
+
+
+class CacheMissError(LookupError):
+    """
+    Raised if a codon usage table is requested in offline mode, but is not present in the cache
+    """
+    pass
+
+
+class TableCache():
+    """
+    Stores parsed codon usage tables as JSON files in a local directory. Tables are keyed by species id, genetic
+    code and whether fractions or frequencies/1000 are used.
+    directory   - String; Directory the cache files are stored in. Defaults to '~/.cache/charm'
+    ttl         - Float; Time in seconds after which a cached table is considered stale and is fetched again.
+                  Defaults to 'None' (cached tables never expire)
+    """
+
+    def __init__(self, directory=None, ttl=None):
+        if directory:
+            self.directory = directory
+        else:
+            self.directory = DEFAULT_CACHE_DIR
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(species, translation_table, use_frequency=False):
+        """
+        Generate the cache key of a codon usage table
+        :param species:             Species id as used by http://www.kazusa.or.jp/codon
+        :param translation_table:   Integer; Genetic code the table was generated for
+        :param use_frequency:       Boolean; Whether the table holds frequencies/1000 instead of fractions
+        :return key:                Tuple of (species, translation_table, 'frequency' or 'fraction')
+        """
+        if use_frequency:
+            value = 'frequency'
+        else:
+            value = 'fraction'
+        return str(species), int(translation_table), value
+
+    def path(self, key):
+        """
+        Return the path of the file a table is stored in
+        :param key: Cache key as generated by TableCache.key()
+        """
+        return os.path.join(self.directory, '{}_{}_{}.json'.format(*key))
+
+    def age(self, key):
+        """
+        Return the age of a cached table in seconds or 'None' if the table is not cached
+        :param key: Cache key as generated by TableCache.key()
+        """
+        try:
+            return max(time.time() - os.path.getmtime(self.path(key)), 0.0)
+        except OSError:
+            return None
+
+    def load(self, key, ignore_ttl=False):
+        """
+        Load a table from the cache. Stale tables are treated as missing unless ignore_ttl is 'True'.
+        :param key:         Cache key as generated by TableCache.key()
+        :param ignore_ttl:  Boolean; Return the table even if it is older than the ttl (e.g. in offline mode)
+        :return:            Tuple of (usage_table, age in seconds) or 'None' if the table is not (validly) cached
+        """
+        age = self.age(key)
+        if age is None or (not ignore_ttl and self.ttl is not None and age > self.ttl):
+            self.misses += 1
+            return None
+
+        try:
+            with open(self.path(key), 'r') as cache_file:
+                usage_table = json.load(cache_file)
+        except (OSError, ValueError):
+            # unreadable or corrupt files are handled like missing ones and will be overwritten
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return usage_table, age
+
+    def store(self, key, usage_table):
+        """
+        Write a table to the cache. The file is replaced atomically, so concurrent readers never see partial files.
+        :param key:          Cache key as generated by TableCache.key()
+        :param usage_table:  Usage table as provided by CodonUsageTable.usage_table
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        # every thread writes its own temporary file
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as cache_file:
+            json.dump(usage_table, cache_file)
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        """
+        Remove all cached tables
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.json'):
+                os.remove(os.path.join(self.directory, filename))
+
+    def statistics(self):
+        """
+        Return hits, misses and number of stored tables as dict
+        """
+        entries = 0
+        if os.path.isdir(self.directory):
+            entries = len([f for f in os.listdir(self.directory) if f.endswith('.json')])
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries}
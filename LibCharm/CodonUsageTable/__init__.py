@@ -1,28 +1,407 @@
 """Provides methods to generate and use codon usage tables from http://www.kazusa.or.jp/codon"""
-from urllib.request import Request, urlopen
-from urllib.error import URLError
+import io
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
 
 try:
-    # BeautifulSoup is used for parsing the HTML formatted codon usage tables on 'http://www.kazusa.or.jp/codon/'
-    from bs4 import BeautifulSoup
+    from Bio.Data import CodonTable
 except ImportError as e:
     print('ERROR: {}'.format(e.msg))
     exit(1)
 
+from ..Cache import TableCache, CacheMissError
+from ..Codons import AmbiguityIndex
+from ..Fetcher import default_fetcher
+from ..Metrics import Metrics
+
+# URL template of the codon usage tables; formatted with species id and genetic code
+KAZUSA_URL = 'http://www.kazusa.or.jp/codon/cgi-bin/showcodon.cgi?species={}&aa={}&style=N'
+
+# Start and end of the <pre></pre> section containing the usage table in the HTML pages
+_PRE_START = re.compile(rb'<pre[^>]*>', re.IGNORECASE)
+_PRE_END = re.compile(rb'</pre\s*>', re.IGNORECASE)
+# A single entry of a Kazusa table: codon, optionally amino acid and fraction, frequency/1000 and number of codons.
+# 'UUU F 0.57 19.7 (   101)' with style=N, 'UUU 19.7(   101)' in the standard format
+_KAZUSA_ENTRY = re.compile(r'([ACGTU]{3})\s+(?:([A-Z*])\s+(\d+(?:\.\d*)?)\s+)?(\d+(?:\.\d*)?)\s*\(\s*(\d+)\s*\)')
+
+# Order of the 64 codon counts in the CUTG species summary (.spsum) format
+SPSUM_CODONS = ('CGA', 'CGC', 'CGG', 'CGT', 'AGA', 'AGG', 'CTA', 'CTC', 'CTG', 'CTT', 'TTA', 'TTG', 'TCA', 'TCC',
+                'TCG', 'TCT', 'AGC', 'AGT', 'ACA', 'ACC', 'ACG', 'ACT', 'CCA', 'CCC', 'CCG', 'CCT', 'GCA', 'GCC',
+                'GCG', 'GCT', 'GGA', 'GGC', 'GGG', 'GGT', 'GTA', 'GTC', 'GTG', 'GTT', 'AAA', 'AAG', 'AAC', 'AAT',
+                'CAA', 'CAG', 'CAC', 'CAT', 'GAA', 'GAG', 'GAC', 'GAT', 'TAC', 'TAT', 'TGC', 'TGT', 'TTC', 'TTT',
+                'ATA', 'ATC', 'ATT', 'ATG', 'TGG', 'TAA', 'TAG', 'TGA')
+
+
+class TableParseError(ValueError):
+    """
+    Raised if no codon usage table can be found in a page or file
+    """
+    pass
+
+
+def extract_table(stream, chunk_size=8192):
+    """
+    Read a HTML page from a binary stream (e.g. a HTTP response) up to the end of its first <pre></pre> section and
+    return the content of that section. Reading stops as soon as the section is complete. If the page does not
+    contain a <pre> section, the whole content is returned, so plain text tables are handled as well.
+
+    :param stream:      File-like object opened in binary mode
+    :param chunk_size:  Integer; Number of bytes read at once
+    :return:            Content of the <pre> section as string
+    """
+    data = b''
+    start = None
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        # search from slightly before the new chunk, in case a tag is split between two chunks
+        offset = max(len(data) - 16, 0)
+        data += chunk
+        if start is None:
+            match = _PRE_START.search(data, offset)
+            if match:
+                start = match.end()
+                offset = start
+        if start is not None:
+            match = _PRE_END.search(data, max(offset, start))
+            if match:
+                return data[start:match.start()].decode('latin-1')
+
+    if start is not None:
+        return data[start:].decode('latin-1')
+    return data.decode('latin-1')
+
+
+def genetic_code(translation_table=1):
+    """
+    Return a dict mapping all 64 codons to their amino acid ('*' for stop codons) in a genetic code
+
+    :param translation_table:  Integer; NCBI translation table id
+    """
+    table = CodonTable.unambiguous_dna_by_id[int(translation_table)]
+    code = dict(table.forward_table)
+    for codon in table.stop_codons:
+        code[codon] = '*'
+    return code
+
+
+def parse_kazusa_table(text, translation_table=1):
+    """
+    Parse a codon usage table in Kazusa format (the content of the <pre> section, as returned by extract_table).
+    Entries are split into tokens instead of being cut at fixed positions, so values of any width are read correctly.
+    Tables in the standard format without amino acids and fractions are completed using the genetic code.
+
+    :param text:                String; Codon usage table
+    :param translation_table:   Integer; Genetic code used to complete tables in the standard format
+    :return:                    List of (codon, aa, fraction, frequency/1000, number) tuples
+    """
+    entries = []
+    for codon, aa, fraction, frequency, number in _KAZUSA_ENTRY.findall(text):
+        entries.append([codon.replace('U', 'T'), aa, fraction, float(frequency), int(number)])
+
+    if not entries:
+        raise TableParseError('No codon usage table found')
+
+    if any(not entry[1] for entry in entries):
+        # standard format; amino acids and fractions are derived from the genetic code and the number of codons
+        return complete_entries([(entry[0], entry[4]) for entry in entries], translation_table,
+                                [entry[3] for entry in entries])
+    return [(codon, aa, float(fraction), frequency, number) for codon, aa, fraction, frequency, number in entries]
+
+
+def parse_spsum(text, species=None, translation_table=1):
+    """
+    Parse a codon usage table from a CUTG species summary (.spsum) file. These files consist of pairs of lines: a
+    header ('<species id>:<name>: <number of CDS>') and 64 codon counts. Fractions and frequencies are rounded like
+    the values on http://www.kazusa.or.jp/codon.
+
+    :param text:               String; Content of the .spsum file
+    :param species:            Species id or name of the entry to be used. Defaults to the first entry
+    :param translation_table:  Integer; Genetic code of the species
+    :return:                   List of (codon, aa, fraction, frequency/1000, number) tuples
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    for header, counts in zip(lines[::2], lines[1::2]):
+        fields = [field.strip() for field in header.split(':')]
+        if species is not None and str(species) not in fields[:-1]:
+            continue
+        counts = counts.split()
+        if len(counts) != 64:
+            raise TableParseError('Expected 64 codon counts for \'{}\', found {}'.format(header, len(counts)))
+        return complete_entries(zip(SPSUM_CODONS, (int(count) for count in counts)), translation_table)
+
+    raise TableParseError('Species {} not found'.format(species))
+
+
+def complete_entries(counts, translation_table=1, frequencies=None):
+    """
+    Generate table entries out of codon counts
+
+    :param counts:             Iterable of (codon, number) tuples
+    :param translation_table:  Integer; Genetic code used to assign the amino acids
+    :param frequencies:        List of frequencies/1000; computed from the counts if not provided
+    :return:                   List of (codon, aa, fraction, frequency/1000, number) tuples
+    """
+    code = genetic_code(translation_table)
+    counts = list(counts)
+    total = sum(number for codon, number in counts)
+    aa_totals = {}
+    for codon, number in counts:
+        aa_totals[code[codon]] = aa_totals.get(code[codon], 0) + number
+
+    entries = []
+    for i, (codon, number) in enumerate(counts):
+        aa = code[codon]
+        fraction = round(number / aa_totals[aa], 2) if aa_totals[aa] else 0.0
+        if frequencies is None:
+            frequency = round(number / total * 1000, 1) if total else 0.0
+        else:
+            frequency = frequencies[i]
+        entries.append((codon, aa, fraction, frequency, number))
+    return entries
+
+
+def fetch_entries(url, translation_table=1, fetcher=None, metrics=None):
+    """
+    Fetch and parse a codon usage table page from http://www.kazusa.or.jp/codon
+    :param url:                 String; URL of the page
+    :param translation_table:   Integer; Genetic code of the table
+    :param fetcher:             LibCharm.Fetcher.TableFetcher or 'None' for the process-wide fetcher
+    :param metrics:             LibCharm.Metrics.Metrics; Records the time spent on 'fetch' and 'parse'
+    :return:                    List of (codon, aa, fraction, frequency/1000, number) tuples
+    """
+    if fetcher is None:
+        fetcher = default_fetcher
+    if metrics is None:
+        metrics = Metrics()
+    with metrics.timer('fetch'):
+        page = fetcher.fetch(url)
+
+    # extract the <pre></pre> section containing the usage table and parse it
+    with metrics.timer('parse'):
+        return parse_kazusa_table(extract_table(io.BytesIO(page)), translation_table)
+
+
+class ReadOnlyDict(dict):
+    """
+    Dictionary that cannot be modified after its creation. Used for the usage tables of frozen CodonUsageTable objects
+    that are shared between several Sequence objects or threads.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Codon usage table is read-only')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        # the default pickle protocol for dict subclasses would call __setitem__
+        return self.__class__, (dict(self),)
+
 
 class CodonUsageTable():
     """
     Provides a representation of a specific codon usage table
     url             - String; URL from which the usage table can be obtained.
                       Usually http://www.kazusa.or.jp/codon/cgi-bin/showcodon.cgi?species=<id>&aa=<num>&style=N
+                      If 'None', an empty table is created (see CodonUsageTable.from_file)
     use_frequency   - Boolean; Defines whether usage frequencies/1000 are used instead of fractions. Defaults to 'False'
+    cache           - LibCharm.Cache.TableCache; If provided, tables are loaded from and stored in this cache. Only
+                      URLs containing species id and genetic code ('species=' and 'aa=') can be cached.
+    offline         - Boolean; Never access the network. Tables have to be present in the cache (regardless of their
+                      age), otherwise LibCharm.Cache.CacheMissError is raised. Defaults to 'False'
+    fetcher         - LibCharm.Fetcher.TableFetcher used to fetch the table. Defaults to the process-wide fetcher
+    If the table cannot be fetched, a LibCharm.Fetcher.FetchError is raised. The time spent on loading the table and
+    cache hits and misses are recorded in the LibCharm.Metrics.Metrics object 'metrics'.
     """
 
-    def __init__(self, url, use_frequency=False):
+    def __init__(self, url=None, use_frequency=False, cache=None, offline=False, fetcher=None):
         self.url = url
         self.usage_table = {}
         self.use_frequency = use_frequency
-        self.fetch_codon_usage_table()
+        self.cache = cache
+        self.offline = offline
+        # age of the table in seconds if it was loaded from the cache, 'None' if it was fetched from the server
+        self.cache_age = None
+        self.from_cache = False
+        self.frozen = False
+        self._ambiguity_index = None
+        self.metrics = Metrics('codon usage table')
+
+        # extract species id and genetic code from the URL; both are needed to generate the cache key
+        query = parse_qs(urlparse(url).query) if url else {}
+        self.species = query['species'][0] if 'species' in query else None
+        self.translation_table = int(query['aa'][0]) if 'aa' in query else None
+
+        if url:
+            self.load_codon_usage_table(fetcher)
+
+    @classmethod
+    def from_kazusa(cls, species, translation_table=1, use_frequency=False, cache=None, offline=False, fetcher=None):
+        """
+        Generate the codon usage table of a species listed on http://www.kazusa.or.jp/codon
+        :param species:            Species id (e.g. 83333 for E. coli K12)
+        :param translation_table:  Integer; Genetic code used by the species. Defaults to 1 (standard code)
+        :param use_frequency:      Boolean; Use frequencies/1000 instead of fractions
+        :param cache:              LibCharm.Cache.TableCache or 'None'
+        :param offline:            Boolean; Only load the table from the cache
+        :param fetcher:            LibCharm.Fetcher.TableFetcher or 'None' for the process-wide fetcher
+        :return:                   CodonUsageTable object
+        """
+        return cls(KAZUSA_URL.format(species, translation_table), use_frequency, cache=cache, offline=offline,
+                   fetcher=fetcher)
+
+    @classmethod
+    def from_store(cls, store, species, translation_table=1, use_frequency=False):
+        """
+        Load a codon usage table from a local store created by charm-mirror.py
+        :param store:              LibCharm.Mirror.TableStore object
+        :param species:            Species id (e.g. 83333 for E. coli K12)
+        :param translation_table:  Integer; Genetic code used by the species. Defaults to 1 (standard code)
+        :param use_frequency:      Boolean; Use frequencies/1000 instead of fractions
+        :return:                   CodonUsageTable object
+        """
+        table = cls(None, use_frequency)
+        with table.metrics.timer('store'):
+            stored = store.get(species, translation_table)
+        if stored is None:
+            raise CacheMissError('Codon usage table of species {} (genetic code {}) is not in the store {}'.format(
+                species, translation_table, store.path))
+        table.url = KAZUSA_URL.format(species, translation_table)
+        table.species = str(species)
+        table.translation_table = int(translation_table)
+        table.add_entries(stored[0])
+        return table
+
+    @classmethod
+    def from_database(cls, database, species, translation_table=1, use_frequency=False):
+        """
+        Construct a codon usage table from a row of a memory-mapped codon usage database
+        :param database:           LibCharm.Database.CodonUsageDatabase object
+        :param species:            Species id (e.g. 83333 for E. coli K12)
+        :param translation_table:  Integer; Genetic code used by the species. Defaults to 1 (standard code)
+        :param use_frequency:      Boolean; Use frequencies/1000 instead of fractions
+        :return:                   CodonUsageTable object
+        """
+        if (species, translation_table) not in database:
+            raise CacheMissError('Codon usage table of species {} (genetic code {}) is not in the database {}'.format(
+                species, translation_table, database.filename))
+        table = cls(None, use_frequency)
+        table.url = KAZUSA_URL.format(species, translation_table)
+        table.species = str(species)
+        table.translation_table = int(translation_table)
+        with table.metrics.timer('database'):
+            table.usage_table = database.usage_table(species, translation_table, use_frequency)
+        return table
+
+    @classmethod
+    def from_file(cls, filename, use_frequency=False, translation_table=1, file_format='kazusa', species=None):
+        """
+        Load a codon usage table from a local file
+        :param filename:           String; Path of the file
+        :param use_frequency:      Boolean; Use frequencies/1000 instead of fractions
+        :param translation_table:  Integer; Genetic code of the species. Defaults to 1 (standard code)
+        :param file_format:        String; 'kazusa' for pages or plain text tables from http://www.kazusa.or.jp/codon
+                                   or 'spsum' for CUTG species summary files. Defaults to 'kazusa'
+        :param species:            Species id or name of the entry to be used in 'spsum' files
+        :return:                   CodonUsageTable object
+        """
+        table = cls(None, use_frequency)
+        table.translation_table = int(translation_table)
+        with table.metrics.timer('parse'), open(filename, 'rb') as table_file:
+            if file_format == 'kazusa':
+                entries = parse_kazusa_table(extract_table(table_file), translation_table)
+            elif file_format == 'spsum':
+                entries = parse_spsum(table_file.read().decode('latin-1'), species, translation_table)
+                table.species = species
+            else:
+                raise ValueError('Unknown file format \'{}\''.format(file_format))
+        table.add_entries(entries)
+        return table
+
+    def add_entries(self, entries):
+        """
+        Add parsed entries to the table
+        :param entries:  Iterable of (codon, aa, fraction, frequency/1000, number) tuples
+        """
+        for codon, aa, fraction, frequency, number in entries:
+            # add either frequency or fraction to the codon table
+            if self.use_frequency:
+                self.add_to_table(codon, aa, frequency)
+            else:
+                self.add_to_table(codon, aa, fraction)
+
+    @property
+    def cache_key(self):
+        """
+        Cache key of the table or 'None' if the table cannot be cached
+        """
+        if self.species is None or self.translation_table is None:
+            return None
+        return TableCache.key(self.species, self.translation_table, self.use_frequency)
+
+    def cache_statistics(self):
+        """
+        Return cache statistics as dict: hits and misses of the underlying cache, age of this table in seconds and
+        whether this table was loaded from the cache.
+        """
+        statistics = {'hits': 0, 'misses': 0, 'age': self.cache_age, 'from_cache': self.from_cache}
+        if self.cache:
+            statistics['hits'] = self.cache.hits
+            statistics['misses'] = self.cache.misses
+        return statistics
+
+    def load_codon_usage_table(self, fetcher=None):
+        """
+        Load the codon usage table from the cache if possible, otherwise fetch it from the server
+        and store it in the cache.
+        :param fetcher:     LibCharm.Fetcher.TableFetcher or 'None' for the process-wide fetcher
+        """
+        key = None
+        if self.cache:
+            key = self.cache_key
+
+        if key:
+            with self.metrics.timer('cache'):
+                cached = self.cache.load(key, ignore_ttl=self.offline)
+            if cached:
+                self.usage_table, self.cache_age = cached
+                self.from_cache = True
+                self.metrics.count('cache_hits')
+                return
+            self.metrics.count('cache_misses')
+
+        if self.offline:
+            raise CacheMissError('Codon usage table {} is not available in offline mode'.format(self.url))
+
+        self.fetch_codon_usage_table(fetcher)
+        if key:
+            self.cache.store(key, self.usage_table)
+
+    def freeze(self):
+        """
+        Make the usage table read-only, so it can safely be shared. Returns the table itself.
+        """
+        if not self.frozen:
+            self.usage_table = ReadOnlyDict((aa, ReadOnlyDict((codon, ReadOnlyDict(value))
+                                                              for codon, value in codons.items()))
+                                            for aa, codons in self.usage_table.items())
+            self.frozen = True
+        return self
+
+    def ambiguity_index(self):
+        """
+        Return the LibCharm.Codons.AmbiguityIndex resolving ambiguous codons with this table. The index of a frozen
+        table is built only once.
+        """
+        if not self.frozen:
+            return AmbiguityIndex(self.usage_table)
+        if getattr(self, '_ambiguity_index', None) is None:
+            self._ambiguity_index = AmbiguityIndex(self.usage_table)
+        return self._ambiguity_index
 
     def add_to_table(self, codon, aa, frequency):
         """
@@ -31,6 +410,8 @@ class CodonUsageTable():
         :param aa:         String; Corresponding amino acid (e.g. 'M')
         :param frequency:  Float: Usage fraction or frequency/1000
         """
+        if self.frozen:
+            raise TypeError('Codon usage table is read-only')
 
         if aa in self.usage_table:
         # If the aa is already present in the table, just add the new codon
@@ -40,51 +421,152 @@ class CodonUsageTable():
             self.usage_table[aa] = {}
             self.usage_table[aa][codon] = {'f': frequency}
 
-    def fetch_codon_usage_table(self):
+    def fetch_codon_usage_table(self, fetcher=None):
         """
         Fetch the codon table from http://www.kazusa.or.jp/codon
+        :param fetcher:     LibCharm.Fetcher.TableFetcher or 'None' for the process-wide fetcher
+        """
+        self.add_entries(fetch_entries(self.url, self.translation_table or 1, fetcher, self.metrics))
+
+
+class TableRegistry():
+    """
+    Thread-safe in-memory registry handing out shared, read-only CodonUsageTable objects. Tables are kept in least
+    recently used order; if more than max_size tables are registered, the least recently used one is dropped.
+    max_size    - Integer; Maximum number of tables kept in memory. Defaults to 64
+    fetcher     - LibCharm.Fetcher.TableFetcher used to fetch tables. Defaults to the process-wide fetcher
+    store       - LibCharm.Mirror.TableStore; Tables present in the store are loaded from it instead of being fetched
+    database    - LibCharm.Database.CodonUsageDatabase; Tables present in the database are loaded from it first
+    """
+
+    def __init__(self, max_size=64, fetcher=None, store=None, database=None):
+        self.max_size = max_size
+        self.fetcher = fetcher if fetcher is not None else default_fetcher
+        self.store = store
+        self.database = database
+        self.hits = 0
+        self.misses = 0
+        self._tables = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(species, translation_table=1, use_frequency=False):
+        """
+        Generate the registry key of a codon usage table
+        :param species:             Species id as used by http://www.kazusa.or.jp/codon
+        :param translation_table:   Integer; Genetic code of the table
+        :param use_frequency:       Boolean; Whether the table holds frequencies/1000 instead of fractions
+        """
+        return str(species), int(translation_table), bool(use_frequency)
+
+    def _lookup(self, key):
+        # must be called with self._lock held
+        table = self._tables.get(key)
+        if table is not None:
+            self._tables.move_to_end(key)
+            self.hits += 1
+        return table
+
+    def get(self, species, translation_table=1, use_frequency=False, cache=None, offline=False):
+        """
+        Return the shared codon usage table of a species. If the table is not registered yet, it is loaded from the
+        store or by CodonUsageTable.from_kazusa(). Concurrent requests for the same table only load it once.
+        :param species:            Species id (e.g. 83333 for E. coli K12)
+        :param translation_table:  Integer; Genetic code used by the species. Defaults to 1 (standard code)
+        :param use_frequency:      Boolean; Use frequencies/1000 instead of fractions
+        :param cache:              LibCharm.Cache.TableCache used if the table has to be loaded
+        :param offline:            Boolean; Only load the table from the cache if it has to be loaded
+        :return:                   Frozen CodonUsageTable object
+        """
+        key = self.key(species, translation_table, use_frequency)
+        with self._lock:
+            table = self._lookup(key)
+            if table is not None:
+                return table
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            try:
+                with self._lock:
+                    # another thread might have loaded the table in the meantime
+                    table = self._lookup(key)
+                    if table is not None:
+                        return table
+
+                if self.database is not None and (species, translation_table) in self.database:
+                    table = CodonUsageTable.from_database(self.database, species, translation_table, use_frequency)
+                elif self.store is not None and (species, translation_table) in self.store:
+                    table = CodonUsageTable.from_store(self.store, species, translation_table, use_frequency)
+                else:
+                    table = CodonUsageTable.from_kazusa(species, translation_table, use_frequency,
+                                                        cache=cache, offline=offline, fetcher=self.fetcher)
+                self.add(table, key)
+                with self._lock:
+                    self.misses += 1
+            finally:
+                # the lock is dropped after failed loads as well
+                with self._lock:
+                    if self._loading.get(key) is key_lock:
+                        del self._loading[key]
+        return table
+
+    def get_many(self, requests, cache=None, offline=False):
+        """
+        Return several shared codon usage tables. Tables that are not registered yet are loaded concurrently.
+        :param requests:    Iterable of (species, translation_table, use_frequency) tuples
+        :param cache:       LibCharm.Cache.TableCache used if tables have to be loaded
+        :param offline:     Boolean; Only load tables from the cache
+        :return:            List of frozen CodonUsageTable objects in the order of requests
+        """
+        requests = list(requests)
+        with self._lock:
+            missing = len([request for request in requests if self.key(*request) not in self._tables])
+        if missing < 2:
+            return [self.get(*request, cache=cache, offline=offline) for request in requests]
+
+        with ThreadPoolExecutor(max_workers=min(self.fetcher.max_workers, len(requests))) as executor:
+            futures = [executor.submit(self.get, *request, cache=cache, offline=offline) for request in requests]
+            return [future.result() for future in futures]
+
+    def add(self, table, key=None):
         """
+        Register a codon usage table. The table is frozen.
+        :param table:   CodonUsageTable object
+        :param key:     Registry key; generated from species, genetic code and use_frequency of the table by default
+        """
+        if key is None:
+            if table.species is None or table.translation_table is None:
+                raise ValueError('Species and genetic code of the table are unknown; a key has to be provided')
+            key = self.key(table.species, table.translation_table, table.use_frequency)
+        table.freeze()
+        with self._lock:
+            self._tables[key] = table
+            self._tables.move_to_end(key)
+            while len(self._tables) > self.max_size:
+                self._tables.popitem(last=False)
+
+    def invalidate(self, species=None, translation_table=None, use_frequency=None):
+        """
+        Drop tables from the registry. Without arguments, all tables are dropped, otherwise only the tables
+        matching all given arguments.
+        """
+        with self._lock:
+            for key in list(self._tables):
+                if species is not None and key[0] != str(species):
+                    continue
+                if translation_table is not None and key[1] != int(translation_table):
+                    continue
+                if use_frequency is not None and key[2] != bool(use_frequency):
+                    continue
+                del self._tables[key]
+
+    def __len__(self):
+        return len(self._tables)
+
+    def __contains__(self, key):
+        return key in self._tables
+
 
-        request = Request(self.url)
-        try:
-            # attempt to recieve the html file from the server
-            opener = urlopen(request)
-        except URLError as error:
-            # if this fails, print an error and exit
-            if hasattr(error, 'reason'):
-                print('Failed to reach server: %s' % error.reason)
-            if hasattr(error, 'code'):
-                print('Server responded with HTTP error code: %s' % error.code)
-            exit(1)
-            # otherwise read the file and hand over to BeautifulSoup for parsing
-
-        response = opener.read()
-        soup = BeautifulSoup(response, 'html5lib')
-
-        # Parse the HTML response and look for a <pre></pre> section containing the usage table
-        table_string = str(soup.pre)
-
-        table_string = table_string.replace('<pre>\n', '')  # remove <pre> and </pre> tags
-        table_string = table_string.replace('<pre>', '')    # unfortunately, they are not formatted consequently
-        table_string = table_string.replace('\n</pre>', '')
-        table_string = table_string.replace('</pre>', '')
-
-        table_lines = table_string.split('\n')  # Split in lines at the linebreak '\n'
-        for line in table_lines:  # Iterate over the lines
-            lines = line.split(')')  # Splitting the lines at ")" will result in substrings representing a
-            # a single codon each
-            for codon_raw in lines:
-                codon_raw = codon_raw.strip()  # strip whitespace characters from the substring
-
-                codon = codon_raw[:3].strip().replace('U', 'T')  # The first three characters are the codon
-                if codon:
-                    aa = codon_raw[4:5].strip()  # Position 5 is the aa in one letter code
-                    fraction = float(codon_raw[6:10].strip())  # position 6 to 10 is the fraction;
-
-                    frequency = float(codon_raw[11:15].strip())  # position 11 to 14 is the usage frequency/1000
-                    # convert to float
-                    if self.use_frequency:
-                        # add either frequency or fraction to the codon table
-                        self.add_to_table(codon, aa, frequency)
-                    else:
-                        self.add_to_table(codon, aa, fraction)
+# Process-wide registry used by LibCharm.Sequence.Sequence
+registry = TableRegistry()
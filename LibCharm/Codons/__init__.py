@@ -0,0 +1,409 @@
+"""Integer encoding of codons used for vectorized lookups"""
+import threading
+from collections.abc import Mapping
+from itertools import product
+
+try:
+    import numpy
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+try:
+    from Bio.Data import CodonTable
+    from Bio.Data import IUPACData
+    from Bio.Seq import translate
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+# Unambiguous DNA letters in the order used by the NCBI genetic code tables
+UNAMBIGUOUS_LETTERS = 'TCAG'
+# All IUPAC DNA letters; the ambiguous ones follow the unambiguous ones
+IUPAC_LETTERS = UNAMBIGUOUS_LETTERS + 'RYWSMKHBVDN'
+
+# All IUPAC codons. The 64 unambiguous codons come first (indices 0 ... 63), followed by all codons containing at
+# least one ambiguous letter (indices 64 ... 3374).
+CODONS = tuple(''.join(codon) for codon in product(UNAMBIGUOUS_LETTERS, repeat=3)) + \
+         tuple(''.join(codon) for codon in product(IUPAC_LETTERS, repeat=3)
+               if not set(codon) <= set(UNAMBIGUOUS_LETTERS))
+N_UNAMBIGUOUS = 64
+N_CODONS = len(CODONS)
+CODON_INDEX = {codon: index for index, codon in enumerate(CODONS)}
+# Sentinel for 'no codon' (e.g. a codon that has not been harmonized yet)
+NO_CODON = numpy.iinfo(numpy.uint16).max
+
+# Codons as array of strings and as (N_CODONS, 3) byte matrix for vectorized decoding
+CODON_ARRAY = numpy.array(CODONS)
+CODON_BYTES = numpy.frombuffer(''.join(CODONS).encode('ascii'), dtype=numpy.uint8).reshape(-1, 3)
+
+# Maps ASCII characters to the position of the letter in IUPAC_LETTERS; 255 marks invalid characters.
+# RNA is handled by mapping U to T.
+_LETTER_CODES = numpy.full(256, 255, dtype=numpy.uint8)
+for _code, _letter in enumerate(IUPAC_LETTERS):
+    _LETTER_CODES[ord(_letter)] = _LETTER_CODES[ord(_letter.lower())] = _code
+_LETTER_CODES[ord('U')] = _LETTER_CODES[ord('u')] = _LETTER_CODES[ord('T')]
+
+# Maps the base-15 number of a triplet of letter codes to the codon index
+_TRIPLET_INDEX = numpy.empty(len(IUPAC_LETTERS) ** 3, dtype=numpy.uint16)
+for _triplet in product(range(len(IUPAC_LETTERS)), repeat=3):
+    _TRIPLET_INDEX[_triplet[0] * 225 + _triplet[1] * 15 + _triplet[2]] = \
+        CODON_INDEX[''.join(IUPAC_LETTERS[i] for i in _triplet)]
+
+
+# Unambiguous codons every codon stands for, as codon indices in the order of IUPACData.ambiguous_dna_values
+EXPANSIONS = tuple(tuple(CODON_INDEX[''.join(letters)] for letters in
+                         product(*(IUPACData.ambiguous_dna_values[letter] for letter in codon)))
+                   for codon in CODONS)
+# EXPANSIONS as (N_CODONS, 64) matrix; rows are padded with N_UNAMBIGUOUS
+EXPANSION_MATRIX = numpy.full((N_CODONS, N_UNAMBIGUOUS), N_UNAMBIGUOUS, dtype=numpy.uint8)
+for _index, _expansion in enumerate(EXPANSIONS):
+    EXPANSION_MATRIX[_index, :len(_expansion)] = _expansion
+
+
+def encode_codons(sequence):
+    """
+    Encode a DNA or RNA sequence as array of codon indices (see CODONS)
+
+    :param sequence:    Sequence as Bio.Seq object or string; the length has to be a multiple of three
+    :return indices:    numpy.ndarray of uint16 codon indices
+    """
+    try:
+        data = numpy.frombuffer(str(sequence).encode('ascii'), dtype=numpy.uint8)
+    except UnicodeEncodeError:
+        raise ValueError('Sequence contains non-ASCII characters')
+    if len(data) % 3:
+        raise ValueError('Length of the sequence ({}) is not a multiple of three'.format(len(data)))
+
+    letters = _LETTER_CODES[data]
+    invalid = numpy.flatnonzero(letters == 255)
+    if len(invalid):
+        raise ValueError('Invalid letter \'{}\' at position {}'.format(chr(data[invalid[0]]), invalid[0] + 1))
+
+    letters = letters.reshape(-1, 3).astype(numpy.uint16)
+    return _TRIPLET_INDEX[letters[:, 0] * 225 + letters[:, 1] * 15 + letters[:, 2]]
+
+
+def decode_codons(indices):
+    """
+    Decode an array of codon indices into a DNA sequence string
+
+    :param indices:     Array of codon indices
+    :return sequence:   DNA sequence as string
+    """
+    return CODON_BYTES[numpy.asarray(indices)].tobytes().decode('ascii')
+
+
+class GeneticCode():
+    """
+    Lookup arrays of an NCBI genetic code indexed by codon index (see CODONS):
+    amino_acids - ASCII code of the translation of every codon as returned by Biopython ('*' for stop codons, 'X' for
+                  ambiguous codons that might be stop codons)
+    start       - whether the codon is a start codon
+    stop        - whether the codon is a stop codon
+    Use genetic_code() to obtain the shared instance of a genetic code.
+    """
+
+    def __init__(self, translation_table):
+        if isinstance(translation_table, CodonTable.CodonTable):
+            translation_table = translation_table.id
+        self.id = int(translation_table)
+        table = CodonTable.ambiguous_dna_by_id[self.id]
+        self.amino_acids = numpy.frombuffer(''.join(translate(codon, table=table) for codon in CODONS).encode('ascii'),
+                                            dtype=numpy.uint8)
+        self.start = numpy.array([codon in table.start_codons for codon in CODONS])
+        self.stop = numpy.array([codon in table.stop_codons for codon in CODONS])
+
+
+_genetic_codes = {}
+_genetic_codes_lock = threading.Lock()
+
+
+def genetic_code(translation_table):
+    """
+    Return the lookup arrays of a genetic code. They are compiled once per process.
+
+    :param translation_table:   NCBI translation table id or Bio.Data.CodonTable object
+    :return:                    GeneticCode object
+    """
+    if isinstance(translation_table, CodonTable.CodonTable):
+        translation_table = translation_table.id
+    translation_table = int(translation_table)
+    with _genetic_codes_lock:
+        if translation_table not in _genetic_codes:
+            _genetic_codes[translation_table] = GeneticCode(translation_table)
+        return _genetic_codes[translation_table]
+
+
+def translate_codons(indices, translation_table, cds=True, to_stop=False):
+    """
+    Translate an array of codon indices. Follows the semantics of Bio.Seq.translate for sequences whose length is a
+    multiple of three.
+
+    :param indices:             Array of codon indices
+    :param translation_table:   NCBI translation table id or Bio.Data.CodonTable object
+    :param cds:                 Check for start and stop codon and translate the start codon as 'M'; the stop codon
+                                is not translated. Raises Bio.Data.CodonTable.TranslationError if the checks fail
+    :param to_stop:             Only translate up to the first stop codon
+    :return:                    Translation as string
+    """
+    code = genetic_code(translation_table)
+    indices = numpy.asarray(indices)
+    if cds:
+        if not len(indices) or not code.start[indices[0]]:
+            raise CodonTable.TranslationError('First codon \'{}\' is not a start codon'.format(
+                CODONS[indices[0]] if len(indices) else ''))
+        if not code.stop[indices[-1]]:
+            raise CodonTable.TranslationError('Final codon \'{}\' is not a stop codon'.format(CODONS[indices[-1]]))
+        inner = indices[1:-1]
+        if code.stop[inner].any():
+            raise CodonTable.TranslationError('Extra in frame stop codon found.')
+        return 'M' + code.amino_acids[inner].tobytes().decode('ascii')
+    if to_stop:
+        stops = numpy.flatnonzero(code.stop[indices])
+        if len(stops):
+            indices = indices[:stops[0]]
+    return code.amino_acids[indices].tobytes().decode('ascii')
+
+
+def synonymous_codons(original, new, translation_table_origin, translation_table_host=None, cds=False):
+    """
+    Compare the amino acids coded by two arrays of codon indices codon by codon. This gives the result of comparing
+    the translations of both sequences without translating them and tells which codons differ.
+
+    :param original:                    Array of codon indices
+    :param new:                         Array of codon indices; NO_CODON is never synonymous
+    :param translation_table_origin:    NCBI translation table id or Bio.Data.CodonTable object of the original codons
+    :param translation_table_host:      NCBI translation table id or Bio.Data.CodonTable object of the new codons;
+                                        defaults to translation_table_origin
+    :param cds:                         The first codons are start codons; if the original codon is a start codon,
+                                        the new codon is synonymous only if it is a start codon as well, as both are
+                                        translated as 'M'
+    :return:                            Boolean array
+    """
+    if translation_table_host is None:
+        translation_table_host = translation_table_origin
+    origin = genetic_code(translation_table_origin)
+    host = genetic_code(translation_table_host)
+    original = numpy.asarray(original)
+    new = numpy.asarray(new)
+    valid = new != NO_CODON
+    new_aa = numpy.where(valid, host.amino_acids[numpy.where(valid, new, 0)], 0)
+    synonymous = valid & (origin.amino_acids[original] == new_aa)
+    if cds and len(original) and origin.start[original[0]]:
+        synonymous[0] = valid[0] and host.start[new[0]]
+    return synonymous
+
+
+class AmbiguityIndex():
+    """
+    Resolves IUPAC-ambiguous codons to unambiguous codons of a codon usage table by lookup. For every codon index
+    (see CODONS) the index holds:
+    amino_acids - ASCII code of the amino acid all expanded codons code for in the usage table or 0 if they code for
+                  different amino acids or are missing from the table
+    highest     - index of the expanded codon with the highest usage frequency/fraction or NO_CODON
+    lowest      - index of the expanded codon with the lowest usage frequency/fraction or NO_CODON
+    If several codons share the highest or lowest value, the first one in the order of EXPANSIONS is chosen.
+    usage_table - Usage table as provided by LibCharm.CodonUsageTable.CodonUsageTable.usage_table
+    """
+
+    def __init__(self, usage_table):
+        # usage frequencies/fractions and amino acids of the unambiguous codons; the extra entry serves as padding
+        self.f = numpy.full(N_UNAMBIGUOUS + 1, numpy.nan)
+        codon_aa = numpy.zeros(N_UNAMBIGUOUS + 1, dtype=numpy.uint8)
+        for aa, codons in usage_table.items():
+            for codon, value in codons.items():
+                index = CODON_INDEX.get(codon)
+                if index is not None and index < N_UNAMBIGUOUS:
+                    self.f[index] = value['f']
+                    codon_aa[index] = ord(aa)
+
+        valid = EXPANSION_MATRIX != N_UNAMBIGUOUS
+        expanded_aa = codon_aa[EXPANSION_MATRIX]
+        first_aa = expanded_aa[:, 0]
+        resolvable = ((expanded_aa == first_aa[:, None]) | ~valid).all(axis=1) & (first_aa != 0)
+        self.amino_acids = numpy.where(resolvable, first_aa, 0).astype(numpy.uint8)
+
+        expanded_f = self.f[EXPANSION_MATRIX]
+        rows = numpy.arange(N_CODONS)
+        highest = EXPANSION_MATRIX[rows, numpy.where(valid, expanded_f, -numpy.inf).argmax(axis=1)]
+        lowest = EXPANSION_MATRIX[rows, numpy.where(valid, expanded_f, numpy.inf).argmin(axis=1)]
+        self.highest = numpy.full(N_CODONS, NO_CODON, dtype=numpy.uint16)
+        self.highest[resolvable] = highest[resolvable]
+        self.lowest = numpy.full(N_CODONS, NO_CODON, dtype=numpy.uint16)
+        self.lowest[resolvable] = lowest[resolvable]
+
+    def resolve(self, codon, highest_f=True):
+        """
+        Return the unambiguous codon chosen for a codon or 'None' if the codon cannot be resolved
+
+        :param codon:       Codon as string or codon index
+        :param highest_f:   Choose the expanded codon with the highest instead of the lowest usage frequency
+        :return:            Tuple of (codon index, usage frequency/fraction) or 'None'
+        """
+        if isinstance(codon, str):
+            codon = CODON_INDEX[codon.upper()]
+        chosen = self.highest[codon] if highest_f else self.lowest[codon]
+        if chosen == NO_CODON:
+            return None
+        return int(chosen), float(self.f[chosen])
+
+
+class CodonRecord():
+    """
+    Columnar storage of the codons of a sequence. Every field is kept in a numpy array with one entry per codon:
+    position   - position of codon in the sequence (1 ... end)
+    original   - index of the original codon (see CODONS)
+    ambiguous  - whether the original codon is ambiguous
+    new        - index of the new codon after harmonization or NO_CODON
+    origin_f   - usage frequency/fraction of the original codon in the origin organism
+    target_f   - usage frequency/fraction of the new codon in the target host
+    initial_df - difference in usage frequency/fraction of the original codon between origin organism and target host
+    final_df   - difference in usage frequency/fraction of the original codon in the origin organism and the new
+                 codon after harmonization in the target host
+    aa         - amino acid coded by the codon as ASCII code
+    Unset floating point values are NaN. Indexing the record returns CodonView objects, which behave like the
+    dictionaries that were used to represent codons before.
+    """
+
+    FIELDS = ('position', 'original', 'ambiguous', 'new', 'origin_f', 'target_f', 'initial_df', 'final_df', 'aa')
+    FLOAT_FIELDS = ('origin_f', 'target_f', 'initial_df', 'final_df')
+
+    def __init__(self, original, aa, position=None):
+        """
+        Initialize the record with unharmonized codons
+        original  - Array of codon indices
+        aa        - Amino acids as string or array of ASCII codes
+        position  - Array of codon positions; defaults to 1 ... len(original)
+        """
+        self.original = numpy.asarray(original, dtype=numpy.uint16)
+        if isinstance(aa, str):
+            aa = numpy.frombuffer(aa.encode('ascii'), dtype=numpy.uint8)
+        self.aa = numpy.asarray(aa, dtype=numpy.uint8)
+        if position is None:
+            position = numpy.arange(1, len(self.original) + 1)
+        self.position = numpy.asarray(position, dtype=numpy.int64)
+        if not len(self.original) == len(self.aa) == len(self.position):
+            raise ValueError('All columns of a codon record need to have the same length')
+
+        self.ambiguous = numpy.zeros(len(self.original), dtype=bool)
+        self.new = numpy.full(len(self.original), NO_CODON, dtype=numpy.uint16)
+        for field in self.FLOAT_FIELDS:
+            setattr(self, field, numpy.full(len(self.original), numpy.nan))
+
+    def __len__(self):
+        return len(self.original)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.select(numpy.arange(len(self))[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('codon index out of range')
+        return CodonView(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield CodonView(self, index)
+
+    def select(self, selection):
+        """
+        Return a new record containing a copy of the selected codons
+
+        :param selection:   Boolean mask or array of codon indices within this record
+        """
+        record = CodonRecord.__new__(CodonRecord)
+        for field in self.FIELDS:
+            setattr(record, field, getattr(self, field)[selection])
+        return record
+
+    def splice(self, start, end, record):
+        """
+        Return a new record in which the codons start ... end - 1 are replaced by the codons of another record.
+        Positions are numbered anew.
+
+        :param start:   Index of the first replaced codon
+        :param end:     Index after the last replaced codon; equal to start to insert codons
+        :param record:  CodonRecord with the inserted codons; may be empty to delete codons
+        """
+        spliced = CodonRecord.__new__(CodonRecord)
+        for field in self.FIELDS:
+            if field != 'position':
+                values = getattr(self, field)
+                setattr(spliced, field, numpy.concatenate((values[:start], getattr(record, field), values[end:])))
+        spliced.position = numpy.arange(1, len(spliced.original) + 1, dtype=numpy.int64)
+        return spliced
+
+    def original_codons(self):
+        """
+        Return the original codons as numpy array of strings
+        """
+        return CODON_ARRAY[self.original]
+
+    def new_codons(self):
+        """
+        Return the new codons as numpy array of strings. Codons that have not been harmonized are empty strings.
+        """
+        codons = numpy.full(len(self), '', dtype=CODON_ARRAY.dtype)
+        harmonized = self.new != NO_CODON
+        codons[harmonized] = CODON_ARRAY[self.new[harmonized]]
+        return codons
+
+    def amino_acids(self):
+        """
+        Return the amino acids of all codons as string
+        """
+        return self.aa.tobytes().decode('ascii')
+
+    def changed(self):
+        """
+        Return a boolean mask of all codons that were replaced during harmonization or are ambiguous
+        """
+        return (self.original != self.new) | self.ambiguous
+
+
+class CodonView(Mapping):
+    """
+    Dictionary-like view of a single codon of a CodonRecord. Values are converted from and to the representation
+    used by the record on access, e.g. codons are returned as strings and NaN as 'None'.
+    """
+
+    __slots__ = ('record', 'index')
+
+    def __init__(self, record, index):
+        self.record = record
+        self.index = index
+
+    def __getitem__(self, key):
+        if key not in CodonRecord.FIELDS:
+            raise KeyError(key)
+        value = getattr(self.record, key)[self.index]
+        if key in ('original', 'new'):
+            return None if value == NO_CODON else CODONS[value]
+        elif key == 'aa':
+            return chr(value)
+        elif key == 'ambiguous':
+            return bool(value)
+        elif key == 'position':
+            return int(value)
+        return None if numpy.isnan(value) else float(value)
+
+    def __setitem__(self, key, value):
+        if key not in CodonRecord.FIELDS:
+            raise KeyError(key)
+        if key in ('original', 'new'):
+            value = NO_CODON if value is None else CODON_INDEX[str(value).upper()]
+        elif key == 'aa':
+            value = ord(value)
+        elif key in CodonRecord.FLOAT_FIELDS and value is None:
+            value = numpy.nan
+        getattr(self.record, key)[self.index] = value
+
+    def __iter__(self):
+        return iter(CodonRecord.FIELDS)
+
+    def __len__(self):
+        return len(CodonRecord.FIELDS)
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,179 @@
+"""Compact memory-mapped binary database of codon usage tables for many species"""
+import json
+import os
+import struct
+import threading
+
+try:
+    import numpy
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+from ..Codons import CODONS, CODON_INDEX, N_UNAMBIGUOUS, UNAMBIGUOUS_LETTERS
+
+MAGIC = b'CHARMCU1'
+# Sections are aligned to this many bytes, so vectors can be read straight from the mapping
+ALIGNMENT = 64
+
+# Order in which codons appear in the tables of http://www.kazusa.or.jp/codon (first, third, second letter)
+KAZUSA_ORDER = tuple(CODON_INDEX[first + second + third] for first in UNAMBIGUOUS_LETTERS
+                     for third in UNAMBIGUOUS_LETTERS for second in UNAMBIGUOUS_LETTERS)
+
+
+def _key(species, translation_table):
+    return '{}/{}'.format(species, int(translation_table)).encode('ascii')
+
+
+def write_database(filename, tables):
+    """
+    Write a codon usage database. Every row holds the fractions and frequencies/1000 of the 64 codons (in the order
+    of LibCharm.Codons.CODONS, NaN for codons missing from the table) of one species and genetic code. The amino
+    acids coded by the codons are stored once per genetic code.
+
+    :param filename:    String; Path of the database file
+    :param tables:      Iterable of (species, translation_table, entries) tuples; entries are (codon, aa, fraction,
+                        frequency/1000, number) tuples as returned by LibCharm.CodonUsageTable.parse_kazusa_table
+    :return:            Number of rows written
+    """
+    rows = {}
+    codes = {}
+    for species, translation_table, entries in tables:
+        fraction = numpy.full(N_UNAMBIGUOUS, numpy.nan)
+        frequency = numpy.full(N_UNAMBIGUOUS, numpy.nan)
+        amino_acids = codes.setdefault(int(translation_table), numpy.zeros(N_UNAMBIGUOUS, dtype=numpy.uint8))
+        for codon, aa, codon_fraction, codon_frequency, number in entries:
+            index = CODON_INDEX[codon]
+            if amino_acids[index] and amino_acids[index] != ord(aa):
+                raise ValueError('Codon {} codes for different amino acids in tables using genetic code {}'.format(
+                    codon, translation_table))
+            amino_acids[index] = ord(aa)
+            fraction[index] = codon_fraction
+            frequency[index] = codon_frequency
+        rows[_key(species, translation_table)] = (fraction, frequency)
+
+    keys = sorted(rows)
+    width = max([len(key) for key in keys] + [1])
+    sections = [
+        ('keys', numpy.array(keys, dtype='S{}'.format(width))),
+        ('fraction', numpy.array([rows[key][0] for key in keys]).reshape(-1, N_UNAMBIGUOUS)),
+        ('frequency', numpy.array([rows[key][1] for key in keys]).reshape(-1, N_UNAMBIGUOUS)),
+        ('codes', numpy.array(sorted(codes), dtype=numpy.uint8)),
+        ('amino_acids', numpy.array([codes[code] for code in sorted(codes)],
+                                    dtype=numpy.uint8).reshape(-1, N_UNAMBIGUOUS)),
+    ]
+
+    # the header lists dtype, shape and offset of every section
+    layout = {}
+    offset = 0
+    for name, array in sections:
+        layout[name] = {'dtype': array.dtype.str, 'shape': array.shape, 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({'rows': len(keys), 'sections': layout}).encode('ascii')
+    start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+    # every thread writes its own temporary file
+    tmp_filename = '{}.{}.{}.tmp'.format(filename, os.getpid(), threading.get_ident())
+    with open(tmp_filename, 'wb') as database_file:
+        database_file.write(MAGIC + struct.pack('<Q', start) + header)
+        for name, array in sections:
+            database_file.seek(start + layout[name]['offset'])
+            database_file.write(array.tobytes())
+        database_file.truncate(start + offset)
+    os.replace(tmp_filename, filename)
+    return len(keys)
+
+
+class CodonUsageDatabase():
+    """
+    Read-only codon usage database written by write_database(). The file is memory-mapped: opening it only reads the
+    header, rows are located by binary search over the sorted keys and vectors are read from the mapping on access.
+    Pickled databases are reopened by path, so worker processes share the mapped pages instead of copying them.
+    filename    - String; Path of the database file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as database_file:
+            magic = database_file.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError('{} is not a codon usage database'.format(filename))
+            start = struct.unpack('<Q', database_file.read(8))[0]
+            header = json.loads(database_file.read(start - len(MAGIC) - 8).rstrip(b'\0').decode('ascii'))
+
+        self._mapping = numpy.memmap(filename, dtype=numpy.uint8, mode='r')
+        for name, section in header['sections'].items():
+            dtype = numpy.dtype(section['dtype'])
+            shape = tuple(section['shape'])
+            count = int(numpy.prod(shape))
+            begin = start + section['offset']
+            array = self._mapping[begin:begin + count * dtype.itemsize].view(dtype).reshape(shape)
+            setattr(self, name, array)
+        self._codes = {int(code): index for index, code in enumerate(self.codes)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return self.row(*key) is not None
+
+    def __reduce__(self):
+        return self.__class__, (self.filename,)
+
+    def row(self, species, translation_table=1):
+        """
+        Return the row of a table or 'None' if the table is not in the database
+        :param species:             Species id as used by http://www.kazusa.or.jp/codon
+        :param translation_table:   Integer; Genetic code of the table
+        """
+        key = _key(species, translation_table)
+        index = int(numpy.searchsorted(self.keys, key))
+        if index < len(self.keys) and self.keys[index] == key:
+            return index
+        return None
+
+    def entries(self):
+        """
+        Return the (species, translation_table) keys of all tables
+        """
+        return [(species, int(translation_table)) for species, translation_table in
+                (key.decode('ascii').rsplit('/', 1) for key in self.keys)]
+
+    def vector(self, species, translation_table=1, use_frequency=False):
+        """
+        Return the 64 fractions or frequencies/1000 of a table as read-only array in the order of
+        LibCharm.Codons.CODONS
+        :param species:             Species id
+        :param translation_table:   Integer; Genetic code of the table
+        :param use_frequency:       Boolean; Return frequencies/1000 instead of fractions
+        """
+        row = self.row(species, translation_table)
+        if row is None:
+            raise KeyError('Species {} (genetic code {}) is not in the database'.format(species, translation_table))
+        if use_frequency:
+            return self.frequency[row]
+        return self.fraction[row]
+
+    def amino_acid_codes(self, translation_table=1):
+        """
+        Return the amino acids coded by the 64 codons in a genetic code as array of ASCII codes
+        :param translation_table:   Integer; Genetic code
+        """
+        return self.amino_acids[self._codes[int(translation_table)]]
+
+    def usage_table(self, species, translation_table=1, use_frequency=False):
+        """
+        Return a table as nested dictionary in the format of LibCharm.CodonUsageTable.CodonUsageTable.usage_table
+        :param species:             Species id
+        :param translation_table:   Integer; Genetic code of the table
+        :param use_frequency:       Boolean; Use frequencies/1000 instead of fractions
+        """
+        values = self.vector(species, translation_table, use_frequency).tolist()
+        amino_acids = self.amino_acid_codes(translation_table).tolist()
+        usage_table = {}
+        for index in KAZUSA_ORDER:
+            # NaN marks codons missing from the table
+            if values[index] != values[index]:
+                continue
+            usage_table.setdefault(chr(amino_acids[index]), {})[CODONS[index]] = {'f': values[index]}
+        return usage_table
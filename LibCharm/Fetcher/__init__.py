@@ -0,0 +1,253 @@
+"""Fetching codon usage tables over HTTP with connection reuse, retries and rate limiting"""
+import http.client
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+from urllib.request import getproxies, proxy_bypass, urlopen
+from urllib.error import HTTPError, URLError
+
+# Maximum number of redirects followed per request
+MAX_REDIRECTS = 5
+# HTTP status codes of redirects that are followed
+REDIRECT_STATUS = (301, 302, 303, 307, 308)
+
+
+class FetchError(Exception):
+    """
+    Raised if a codon usage table cannot be fetched
+    url     - String; URL that was requested
+    """
+
+    def __init__(self, message, url=None):
+        super().__init__(message)
+        self.url = url
+
+
+class ServerUnreachableError(FetchError):
+    """
+    Raised if the server cannot be reached or does not answer in time, even after retrying
+    """
+    pass
+
+
+class HTTPStatusError(FetchError):
+    """
+    Raised if the server answers with an HTTP error code
+    status  - Integer; HTTP status code
+    """
+
+    def __init__(self, message, url=None, status=None):
+        super().__init__(message, url)
+        self.status = status
+
+
+class RateLimiter():
+    """
+    Limits the number of requests per second sent to each host. Thread-safe.
+    rate    - Float; Maximum number of requests per second and host. 'None' disables the limit
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        """
+        Block until the next request to host may be sent
+        :param host:    String; Host name
+        """
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot.get(host, now), now)
+            self._next_slot[host] = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ConnectionPool():
+    """
+    Keeps idle keep-alive HTTP(S) connections for reuse. Thread-safe.
+    timeout - Float; Socket timeout in seconds
+    """
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self.created = 0
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, scheme, netloc, reuse=True):
+        """
+        Return an idle connection to netloc or open a new one
+        :param scheme:  String; 'http' or 'https'
+        :param netloc:  String; Host and optionally port
+        :param reuse:   Boolean; Use an idle connection if available
+        :return:        Tuple of (connection, whether the connection is reused)
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle and reuse:
+                return idle.pop(), True
+            self.created += 1
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout), False
+        return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def release(self, scheme, netloc, connection):
+        """
+        Return a connection to the pool after its response has been read completely
+        """
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(connection)
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle = {}
+
+
+class TableFetcher():
+    """
+    Fetches pages over keep-alive connections. Failed requests (connection errors, timeouts and HTTP 5xx responses)
+    are retried with exponential backoff; other HTTP errors are raised immediately as HTTPStatusError. Redirects are
+    followed up to MAX_REDIRECTS times. If a proxy is configured for a URL (http_proxy, https_proxy and no_proxy
+    environment variables), the page is fetched with urlopen instead, which does not keep connections alive.
+    max_workers - Integer; Maximum number of concurrent requests of fetch_many(). Defaults to 4
+    timeout     - Float; Socket timeout in seconds. Defaults to 30
+    retries     - Integer; Number of retries after the first failed attempt. Defaults to 3
+    backoff     - Float; Delay in seconds before the first retry; doubled for every further retry. Defaults to 0.5
+    rate_limit  - Float; Maximum number of requests per second and host. Defaults to 'None' (no limit)
+    """
+
+    def __init__(self, max_workers=4, timeout=30, retries=3, backoff=0.5, rate_limit=None):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limiter = RateLimiter(rate_limit)
+        self.pool = ConnectionPool(timeout)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def fetch(self, url):
+        """
+        Fetch a page and return its content
+        :param url:     String; URL of the page. URLs other than http(s) (e.g. file://) and URLs requested through a
+                        proxy are opened with urlopen
+        :return:        Content of the page as bytes
+        """
+        parsed = urlparse(url)
+        if parsed.scheme not in ('http', 'https'):
+            try:
+                with urlopen(url, timeout=self.pool.timeout) as response:
+                    return response.read()
+            except (URLError, OSError) as error:
+                raise ServerUnreachableError('Failed to open {}: {}'.format(url, error), url)
+
+        attempt = 0
+        while True:
+            self.rate_limiter.wait(parsed.hostname)
+            try:
+                if self.proxied(url):
+                    return self._open(url)
+                return self._follow(url)
+            except HTTPStatusError as error:
+                if error.status < 500 or attempt >= self.retries:
+                    raise
+            except (OSError, http.client.HTTPException) as error:
+                if attempt >= self.retries:
+                    raise ServerUnreachableError('Failed to reach server: {}'.format(error), url)
+            time.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    @staticmethod
+    def proxied(url):
+        """
+        Return whether a URL is requested through a proxy configured in the environment
+        :param url:     String; http(s) URL
+        """
+        parsed = urlparse(url)
+        return parsed.scheme in getproxies() and not proxy_bypass(parsed.hostname or '')
+
+    def _open(self, url):
+        # urlopen handles proxies and redirects itself
+        with self._lock:
+            self.requests += 1
+        try:
+            with urlopen(url, timeout=self.pool.timeout) as response:
+                return response.read()
+        except HTTPError as error:
+            raise HTTPStatusError('Server responded with HTTP error code: {}'.format(error.code), url, error.code)
+
+    def _follow(self, url):
+        for _ in range(MAX_REDIRECTS + 1):
+            parsed = urlparse(url)
+            if parsed.scheme not in ('http', 'https'):
+                raise FetchError('Redirected to unsupported URL {}'.format(url), url)
+            path = parsed.path or '/'
+            if parsed.query:
+                path += '?' + parsed.query
+            status, location, body = self._request(parsed.scheme, parsed.netloc, path, url)
+            if status not in REDIRECT_STATUS or not location:
+                return body
+            url = urljoin(url, location)
+        raise HTTPStatusError('More than {} redirects'.format(MAX_REDIRECTS), url, status)
+
+    def _request(self, scheme, netloc, path, url):
+        connection, reused = self.pool.acquire(scheme, netloc)
+        while True:
+            with self._lock:
+                self.requests += 1
+            try:
+                connection.request('GET', path, headers={'Connection': 'keep-alive'})
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if not reused:
+                    raise
+                # the server closed the idle connection in the meantime; retry once with a new connection
+                connection, reused = self.pool.acquire(scheme, netloc, reuse=False)
+            except Exception:
+                connection.close()
+                raise
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.release(scheme, netloc, connection)
+
+        if response.status >= 400:
+            raise HTTPStatusError('Server responded with HTTP error code: {}'.format(response.status), url,
+                                  response.status)
+        return response.status, response.getheader('Location'), body
+
+    def fetch_many(self, urls):
+        """
+        Fetch several pages concurrently
+        :param urls:    Iterable of URLs
+        :return:        List of page contents as bytes in the order of urls
+        """
+        urls = list(urls)
+        if len(urls) < 2:
+            return [self.fetch(url) for url in urls]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as executor:
+            return list(executor.map(self.fetch, urls))
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        self.pool.close()
+
+
+# Fetcher shared by all codon usage tables of the process
+default_fetcher = TableFetcher()
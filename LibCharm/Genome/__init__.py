@@ -0,0 +1,260 @@
+"""Harmonization of all coding sequences annotated in GenBank or EMBL records"""
+from copy import copy
+from multiprocessing import Pool
+
+try:
+    import numpy
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+try:
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+from ..Codons import N_CODONS, decode_codons, encode_codons, synonymous_codons
+from ..CodonUsageTable import CodonUsageTable, registry as default_registry
+from ..Sequence import Sequence
+
+# Columns of the per-gene summary
+SUMMARY_COLUMNS = ('record', 'gene', 'start', 'end', 'strand', 'codons', 'harmonized_codons',
+                   'kept_overlapping_codons', 'ambiguous_codons', 'mean_initial_df', 'mean_final_df', 'error')
+
+_COMPLEMENT = bytes.maketrans(b'ACGTRYKMBVDHNacgtrykmbvdhn', b'TGCAYRMKVBHDNtgcayrmkvbhdn')
+
+
+def gene_name(feature, default=None):
+    """
+    Return the name of a CDS feature: its locus tag, gene name or protein id, whichever is annotated first
+    :param feature:     Bio.SeqFeature.SeqFeature object
+    :param default:     Name returned if none of the qualifiers is annotated
+    """
+    for qualifier in ('locus_tag', 'gene', 'protein_id'):
+        if qualifier in feature.qualifiers:
+            return feature.qualifiers[qualifier][0]
+    return default
+
+
+def cds_positions(feature):
+    """
+    Return the positions of the bases of a CDS feature in its record and whether they are read from the reverse
+    strand. Joins are followed in the order of their parts.
+    :param feature:     Bio.SeqFeature.SeqFeature object
+    :return:            Tuple of an array of 0-based positions in the order of the coding sequence and a boolean array
+    """
+    positions = []
+    reverse = []
+    for part in feature.location.parts:
+        start, end = int(part.start), int(part.end)
+        if part.strand == -1:
+            positions.append(numpy.arange(end - 1, start - 1, -1, dtype=numpy.int64))
+        else:
+            positions.append(numpy.arange(start, end, dtype=numpy.int64))
+        reverse.append(numpy.full(end - start, part.strand == -1, dtype=bool))
+    if not positions:
+        return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=bool)
+    return numpy.concatenate(positions), numpy.concatenate(reverse)
+
+
+def shared_replacement_map(indices, usage_origin, usage_host, **options):
+    """
+    Compile a replacement table covering all codons of many sequences (see Sequence.compile_replacement_table)
+    :param indices:         Iterable of arrays of codon indices (see LibCharm.Codons.CODONS)
+    :param usage_origin:    CodonUsageTable of the origin organism
+    :param usage_host:      CodonUsageTable of the host organism
+    :param options:         Options passed on to Sequence (e.g. lower_threshold)
+    :return:                Dict of arrays indexed by codon index
+    """
+    present = numpy.zeros(N_CODONS, dtype=bool)
+    for codons in indices:
+        present[codons] = True
+    template = Sequence(decode_codons(numpy.flatnonzero(present)), usage_origin, usage_host, **options)
+    return template.compile_replacement_table(template.compute_replacement_table())
+
+
+# Codon usage tables and options of the genes harmonized by a worker process of harmonize_genome()
+_worker_state = {}
+
+
+def _initialize_worker(usage_origin, usage_host, options):
+    _worker_state['usage_origin'] = usage_origin
+    _worker_state['usage_host'] = usage_host
+    _worker_state['options'] = options
+
+
+def _harmonize_gene(coding_sequence, usage_origin, usage_host, options):
+    # only the codon record is returned, so the tables and the shared replacement map are not sent back with every gene
+    return Sequence(coding_sequence, usage_origin, usage_host, **options).codons
+
+
+def _harmonize_gene_in_worker(coding_sequence):
+    return _harmonize_gene(coding_sequence, _worker_state['usage_origin'], _worker_state['usage_host'],
+                           _worker_state['options'])
+
+
+def harmonize_coding_sequences(coding_sequences, usage_origin, usage_host, processes=None, **options):
+    """
+    Harmonize many coding sequences with the same codon usage tables and options, in the order of the input
+    :param coding_sequences:    List of DNA sequences as strings
+    :param usage_origin:        CodonUsageTable of the origin organism
+    :param usage_host:          CodonUsageTable of the host organism
+    :param processes:           Integer; Number of worker processes. If 'None' or 1, the sequences are harmonized in
+                                the calling process.
+    :param options:             Options passed on to Sequence (e.g. lower_threshold)
+    :return:                    Generator of the harmonized LibCharm.Codons.CodonRecord objects
+    """
+    if not processes or processes == 1:
+        # the worker state is only set in worker processes, so calls in the calling process do not share it
+        for coding_sequence in coding_sequences:
+            yield _harmonize_gene(coding_sequence, usage_origin, usage_host, options)
+        return
+
+    # genes are sent to the workers in chunks to keep the communication overhead low
+    chunk_size = max(1, len(coding_sequences) // (processes * 8))
+    with Pool(processes, initializer=_initialize_worker, initargs=(usage_origin, usage_host, options)) as pool:
+        for codons in pool.imap(_harmonize_gene_in_worker, coding_sequences, chunk_size):
+            yield codons
+
+
+def harmonize_genome(records, origin_id, host_id, translation_table_origin=1, translation_table_host=1,
+                     use_frequency=False, cache=None, offline=False, registry=None, processes=None, **kwargs):
+    """
+    Harmonize all CDS features of annotated records (e.g. the chromosomes and plasmids of a genome read from a GenBank
+    or EMBL file) against shared codon usage tables. All genes share a single replacement table and are harmonized by
+    'processes' worker processes.
+    The harmonized genes are written back into a copy of their record. Start codons and codons overlapping another
+    CDS are kept, so overlapping genes remain intact. Genes that cannot be harmonized (pseudo genes, lengths that are
+    not a multiple of 3, translations that do not match) are left unchanged and reported in the summary.
+
+    :param records:                   Iterable of Bio.SeqRecord objects with CDS features
+    :param origin_id:                 Species id of the origin organism or CodonUsageTable object
+    :param host_id:                   Species id of the host organism or CodonUsageTable object
+    :param translation_table_origin:  Integer; Genetic code used by the origin organism
+    :param translation_table_host:    Integer; Genetic code used by the host organism
+    :param use_frequency:             Boolean; Use frequency per thousand instead of fraction
+    :param cache:                     LibCharm.Cache.TableCache used for the codon usage tables
+    :param offline:                   Boolean; Load codon usage tables from the cache only
+    :param registry:                  LibCharm.CodonUsageTable.TableRegistry; Defaults to the process-wide registry
+    :param processes:                 Integer; Number of worker processes. If 'None' or 1, genes are harmonized in
+                                      the calling process.
+    :param kwargs:                    Further options passed on to Sequence (e.g. lower_threshold)
+    :return:                          Tuple of the list of harmonized records and the list of per-gene summaries
+                                      (dictionaries with the keys in SUMMARY_COLUMNS)
+    """
+    if registry is None:
+        registry = default_registry
+    usage_tables = []
+    for species, translation_table in ((origin_id, translation_table_origin), (host_id, translation_table_host)):
+        if not isinstance(species, CodonUsageTable):
+            species = registry.get(species, translation_table, use_frequency, cache=cache, offline=offline)
+        usage_tables.append(species)
+    options = dict(kwargs, translation_table_origin=translation_table_origin,
+                   translation_table_host=translation_table_host, use_frequency=use_frequency)
+
+    records = list(records)
+    genes = []
+    for record_index, record in enumerate(records):
+        for feature in record.features:
+            if feature.type != 'CDS':
+                continue
+            positions, reverse = cds_positions(feature)
+            gene = {'record': record.id, 'gene': gene_name(feature, '{}:CDS{}'.format(record.id, len(genes) + 1)),
+                    'start': int(positions.min()) + 1 if len(positions) else None,
+                    'end': int(positions.max()) + 1 if len(positions) else None,
+                    'strand': feature.location.strand, 'codons': len(positions) // 3, 'harmonized_codons': 0,
+                    'kept_overlapping_codons': 0, 'ambiguous_codons': 0, 'mean_initial_df': None,
+                    'mean_final_df': None, 'error': None}
+            genes.append((record_index, feature, positions, reverse, gene))
+
+    # coverage of every base by CDS features, used to find codons shared by overlapping genes. Bases read twice by
+    # the same gene (e.g. at ribosomal frameshifts) count twice.
+    coverage = [numpy.zeros(len(record), dtype=numpy.uint32) for record in records]
+    for record_index, feature, positions, reverse, gene in genes:
+        numpy.add.at(coverage[record_index], positions, 1)
+
+    # extract and encode the coding sequences of all genes that can be harmonized
+    pending = []
+    for index, (record_index, feature, positions, reverse, gene) in enumerate(genes):
+        if 'pseudo' in feature.qualifiers or 'pseudogene' in feature.qualifiers:
+            gene['error'] = 'pseudo gene'
+        elif feature.qualifiers.get('codon_start', ['1'])[0] != '1':
+            gene['error'] = 'partial CDS (codon_start={})'.format(feature.qualifiers['codon_start'][0])
+        elif len(positions) % 3 or not positions.size:
+            gene['error'] = 'partial CDS (length of {} bp is not a multiple of 3)'.format(len(positions))
+        else:
+            try:
+                coding_sequence = str(feature.extract(records[record_index].seq)).upper()
+                pending.append((index, encode_codons(coding_sequence), coding_sequence))
+            except ValueError as error:
+                gene['error'] = str(error)
+
+    if pending and options.get('use_replacement_table', True):
+        options['replacement_map'] = shared_replacement_map((codons for index, codons, dna in pending),
+                                                            usage_tables[0], usage_tables[1], **options)
+    # only the harmonization is computed by the workers; translations are verified below
+    results = harmonize_coding_sequences([dna for index, codons, dna in pending], usage_tables[0], usage_tables[1],
+                                         processes, **options)
+
+    sequences = [bytearray(str(record.seq).encode('ascii')) for record in records]
+    for (index, original, dna), codons in zip(pending, results):
+        record_index, feature, positions, reverse, gene = genes[index]
+        new = codons.new.copy()
+        # start codons are recognized by their position and are kept, as are codons shared with other genes
+        new[0] = codons.original[0]
+        shared = (coverage[record_index][positions] > 1).reshape(-1, 3).any(axis=1)
+        new[shared] = codons.original[shared]
+        if not synonymous_codons(codons.original, new, translation_table_origin, translation_table_host).all():
+            gene['error'] = 'translations of harmonized and original gene do not match'
+            continue
+
+        changed = new != codons.original
+        kept = new != codons.new
+        gene['harmonized_codons'] = int(numpy.count_nonzero(changed))
+        gene['kept_overlapping_codons'] = int(numpy.count_nonzero(shared & kept))
+        gene['ambiguous_codons'] = int(numpy.count_nonzero(codons.ambiguous))
+        if not numpy.isnan(codons.initial_df).all():
+            gene['mean_initial_df'] = float(numpy.nanmean(codons.initial_df))
+            gene['mean_final_df'] = float(numpy.nanmean(numpy.where(kept, codons.initial_df, codons.final_df)))
+
+        # write the changed bases back into the record, complemented on the reverse strand
+        bases = numpy.frombuffer(decode_codons(new).encode('ascii'), dtype=numpy.uint8).copy()
+        bases[reverse] = numpy.frombuffer(bases[reverse].tobytes().translate(_COMPLEMENT), dtype=numpy.uint8)
+        changed_bases = numpy.repeat(changed, 3)
+        genome = numpy.frombuffer(sequences[record_index], dtype=numpy.uint8)
+        genome[positions[changed_bases]] = bases[changed_bases]
+
+    # copy the records with the harmonized sequences and note the changes in the qualifiers of the CDS features
+    notes = {id(feature): gene for record_index, feature, positions, reverse, gene in genes if not gene['error']}
+    harmonized_records = []
+    for record, sequence in zip(records, sequences):
+        features = []
+        for feature in record.features:
+            gene = notes.get(id(feature))
+            if gene is not None:
+                feature = copy(feature)
+                feature.qualifiers = dict(feature.qualifiers)
+                feature.qualifiers['note'] = list(feature.qualifiers.get('note', [])) + [
+                    'codon harmonized by CHarm ({} of {} codons replaced)'.format(gene['harmonized_codons'],
+                                                                                 gene['codons'])]
+            features.append(feature)
+        harmonized_records.append(SeqRecord(Seq(sequence.decode('ascii'), record.seq.alphabet), id=record.id,
+                                            name=record.name, description=record.description,
+                                            dbxrefs=list(record.dbxrefs), features=features,
+                                            annotations=dict(record.annotations),
+                                            letter_annotations=dict(record.letter_annotations)))
+    return harmonized_records, [gene for record_index, feature, positions, reverse, gene in genes]
+
+
+def write_gene_summary(genes, filename):
+    """
+    Write per-gene summaries as returned by harmonize_genome() to a tab separated file
+    :param genes:       List of dictionaries with the keys in SUMMARY_COLUMNS
+    :param filename:    String; Path of the output file
+    """
+    with open(filename, 'w') as summary_file:
+        summary_file.write('\t'.join(SUMMARY_COLUMNS) + '\n')
+        for gene in genes:
+            summary_file.write('\t'.join('' if gene[column] is None else str(gene[column])
+                                         for column in SUMMARY_COLUMNS) + '\n')
@@ -0,0 +1,319 @@
+"""Harmonization of a sequence for several expression hosts, ranking of hosts and an index of hosts by codon usage"""
+from multiprocessing import Pool
+
+try:
+    import numpy
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+try:
+    from Bio.SeqRecord import SeqRecord
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+from .. import IO
+from ..Analysis import DIFFERENCE_THRESHOLDS
+from ..Codons import CODON_INDEX, N_UNAMBIGUOUS, encode_codons, genetic_code
+from ..CodonUsageTable import CodonUsageTable
+
+# Columns of the ranking of the hosts
+HOST_COLUMNS = ('rank', 'host', 'translation_table_host', 'codons', 'harmonized_codons', 'mean_initial_df',
+                'mean_final_df', 'max_final_df', 'above_threshold', 'verified')
+
+
+def parse_host(host, translation_table=1):
+    """
+    Parse a host given as 'species' or 'species:translation_table' (e.g. '4932:1')
+    :param host:                String
+    :param translation_table:   Integer; Genetic code used if none is given
+    :return:                    Tuple of species id and translation table
+    """
+    species, _, table = str(host).partition(':')
+    if not species.strip():
+        raise ValueError('Cannot parse host \'{}\'; use \'species\' or \'species:translation_table\''.format(host))
+    try:
+        return species.strip(), int(table) if table else translation_table
+    except ValueError:
+        raise ValueError('Cannot parse host \'{}\'; use \'species\' or \'species:translation_table\''.format(host))
+
+
+def _mean(values):
+    return float(numpy.nanmean(values)) if len(values) and not numpy.isnan(values).all() else None
+
+
+# Sequence with the split codons and the codon usage table of the origin organism harmonized by a worker process of
+# harmonize_hosts()
+_worker_state = {}
+
+
+def _initialize_worker(base, usage_origin):
+    # the codon usage tables are not pickled with the sequence (see Sequence.__getstate__())
+    base.origin_id = usage_origin
+    _worker_state['base'] = base
+
+
+def _harmonize_host(host):
+    usage_host, translation_table = host
+    return _worker_state['base'].copy(host_id=usage_host, translation_table_host=translation_table) \
+        .compute('harmonization')
+
+
+def harmonize_hosts(sequence, hosts, processes=None):
+    """
+    Harmonize a sequence for several hosts and rank the hosts by how well they match the codon usage of the origin
+    organism. The codon usage tables of all hosts are loaded concurrently. All hosts share the codon usage table of
+    the origin organism and the codons of the original sequence.
+    Hosts are ranked by whether the translations match, the mean difference in codon usage of the harmonized
+    sequence (mean_final_df) and the fraction of codons differing by more than 0.2 (or 5 for frequencies).
+
+    :param sequence:    LibCharm.Sequence.Sequence object with the origin organism and the options; its host is not
+                        harmonized for unless it is listed in hosts. The object itself is not changed.
+    :param hosts:       List of species ids, (species id, translation table) tuples or CodonUsageTable objects.
+                        Translation tables default to the one of the sequence. Tables without species id are named
+                        after their position in the list (e.g. 'host 3').
+    :param processes:   Integer; Number of worker processes harmonizing the hosts. If 'None' or 1, the hosts are
+                        harmonized in the calling process.
+    :return:            List of (summary, Sequence) tuples in the order of the ranking. Summaries are dictionaries with
+                        the keys in HOST_COLUMNS.
+    """
+    requests = []
+    origin_id = sequence.origin_id
+    if not isinstance(origin_id, CodonUsageTable):
+        requests.append((origin_id, sequence.translation_table_origin.id, sequence.use_frequency))
+    for host in hosts:
+        if isinstance(host, CodonUsageTable):
+            continue
+        species, translation_table = host if isinstance(host, tuple) else (host, sequence.translation_table_host.id)
+        requests.append((species, translation_table, sequence.use_frequency))
+    tables = iter(sequence.registry.get_many(requests, cache=sequence.cache, offline=sequence.offline))
+    if not isinstance(origin_id, CodonUsageTable):
+        origin_id = next(tables)
+
+    # codons of the original sequence are split once and shared by the copies for every host
+    base = sequence.copy(origin_id=origin_id)
+    base.compute('usage_origin', 'codons')
+
+    host_tables = []
+    for host in hosts:
+        if isinstance(host, CodonUsageTable):
+            host_tables.append((host, host.translation_table or sequence.translation_table_host.id))
+        else:
+            translation_table = host[1] if isinstance(host, tuple) else sequence.translation_table_host.id
+            host_tables.append((next(tables), translation_table))
+    if processes and processes > 1 and len(host_tables) > 1:
+        with Pool(min(processes, len(host_tables)), initializer=_initialize_worker,
+                  initargs=(base, origin_id)) as pool:
+            sequences = pool.map(_harmonize_host, host_tables)
+        for harmonized, (table, translation_table) in zip(sequences, host_tables):
+            harmonized.attach_usage_tables(origin_id, table)
+    else:
+        sequences = [base.copy(host_id=table, translation_table_host=translation_table)
+                     for table, translation_table in host_tables]
+
+    results = []
+    for index, ((table, _), harmonized) in enumerate(zip(host_tables, sequences)):
+        codons = harmonized.codons
+        final_df = codons.final_df[~numpy.isnan(codons.final_df)]
+        results.append(({'host': table.species if table.species is not None else 'host {}'.format(index + 1),
+                          'translation_table_host': harmonized.translation_table_host.id,
+                          'codons': len(codons),
+                          'harmonized_codons': int(numpy.count_nonzero(codons.changed())),
+                          'mean_initial_df': _mean(codons.initial_df),
+                          'mean_final_df': _mean(final_df),
+                          'max_final_df': float(final_df.max()) if len(final_df) else None,
+                          'above_threshold': float(numpy.count_nonzero(
+                              final_df > DIFFERENCE_THRESHOLDS[bool(sequence.use_frequency)]) / len(codons))
+                          if len(codons) else 0.0,
+                          'verified': bool(harmonized.verify_harmonized_sequence())}, harmonized))
+
+    results.sort(key=lambda result: (not result[0]['verified'],
+                                     numpy.inf if result[0]['mean_final_df'] is None else result[0]['mean_final_df'],
+                                     result[0]['above_threshold']))
+    for rank, (summary, harmonized) in enumerate(results, 1):
+        summary['rank'] = rank
+    return results
+
+
+def write_host_summary(results, filename):
+    """
+    Write the ranking of the hosts as returned by harmonize_hosts() to a tab separated file
+    :param results:     List of (summary, Sequence) tuples
+    :param filename:    String; Path of the output file
+    """
+    with open(filename, 'w') as summary_file:
+        summary_file.write('\t'.join(HOST_COLUMNS) + '\n')
+        for summary, harmonized in results:
+            summary_file.write('\t'.join('' if summary[column] is None else str(summary[column])
+                                         for column in HOST_COLUMNS) + '\n')
+
+
+def write_host_sequences(results, filename):
+    """
+    Write the harmonized sequences of all hosts as returned by harmonize_hosts() to a FASTA file, in the order of the
+    ranking
+    :param results:     List of (summary, Sequence) tuples
+    :param filename:    String; Path of the output file
+    :return:            Number of sequences written
+    """
+    return IO.write_records((SeqRecord(harmonized.harmonized_sequence, id='host_{}'.format(summary['host']),
+                                       description='rank {} of {} hosts'.format(summary['rank'], len(results)))
+                             for summary, harmonized in results), filename, 'fasta')
+
+
+def usage_vector(table):
+    """
+    Return the usage fractions of the 64 codons of a codon usage table in the order of LibCharm.Codons.CODONS. Tables
+    of frequencies/1000 are converted to fractions per amino acid; codons missing from the table are 0.
+    :param table:   CodonUsageTable object
+    :return:        numpy array
+    """
+    vector = numpy.zeros(N_UNAMBIGUOUS)
+    for aa, codons in table.usage_table.items():
+        values = [(CODON_INDEX[codon], usage['f']) for codon, usage in codons.items()]
+        total = sum(value for index, value in values)
+        for index, value in values:
+            if table.use_frequency:
+                value = value / total if total else 0.0
+            vector[index] = value
+    return vector
+
+
+class HostIndex():
+    """
+    Index of the codon usage of many species answering which hosts match the codon usage of an origin organism best.
+    Every species is stored as vector of the usage fractions of the 64 codons, so a query compares the origin with
+    all species at once. The distance of two species is the weighted mean of the absolute differences of the fractions
+    of all codons (the mean df of harmonize_hosts() before harmonization). By default, every amino acid weighs the
+    same; the codons of a gene weigh by how often they occur in the gene.
+    species             - List of species ids
+    translation_tables  - List of the genetic codes of the species
+    fractions           - Array of the usage fractions of the 64 codons of every species (see usage_vector())
+    """
+
+    def __init__(self, species, translation_tables, fractions):
+        self.species = numpy.asarray(species, dtype=str)
+        self.translation_tables = numpy.asarray(translation_tables, dtype=numpy.int64)
+        self.fractions = numpy.nan_to_num(numpy.asarray(fractions, dtype=numpy.float64).reshape(-1, N_UNAMBIGUOUS))
+        if not len(self.species) == len(self.translation_tables) == len(self.fractions):
+            raise ValueError('Species, translation tables and fractions need to have the same length')
+        self._rows = {(species, int(translation_table)): row for row, (species, translation_table) in
+                      enumerate(zip(self.species.tolist(), self.translation_tables.tolist()))}
+
+    def __len__(self):
+        return len(self.species)
+
+    def __contains__(self, key):
+        return (str(key[0]), int(key[1])) in self._rows
+
+    @classmethod
+    def from_tables(cls, tables):
+        """
+        Build an index of codon usage tables
+        :param tables:  Iterable of CodonUsageTable objects with species id and genetic code
+        """
+        tables = list(tables)
+        for table in tables:
+            if table.species is None:
+                raise ValueError('The species of a codon usage table is unknown')
+        return cls([str(table.species) for table in tables], [table.translation_table or 1 for table in tables],
+                   [usage_vector(table) for table in tables])
+
+    @classmethod
+    def from_database(cls, database):
+        """
+        Build an index of all tables of a codon usage database
+        :param database:    LibCharm.Database.CodonUsageDatabase
+        """
+        entries = database.entries()
+        return cls([species for species, translation_table in entries],
+                   [translation_table for species, translation_table in entries], database.fraction)
+
+    def save(self, filename):
+        """
+        Write the index to a numpy .npz file
+        :param filename:    String; Path of the file
+        """
+        with open(filename, 'wb') as index_file:
+            numpy.savez(index_file, species=self.species, translation_tables=self.translation_tables,
+                        fractions=self.fractions)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read an index written by HostIndex.save()
+        :param filename:    String; Path of the file
+        """
+        with numpy.load(filename, allow_pickle=False) as index_file:
+            return cls(index_file['species'], index_file['translation_tables'], index_file['fractions'])
+
+    def weights(self, translation_table=1, sequence=None, amino_acid_weights=None):
+        """
+        Return the weights of the 64 codons used by closest()
+        :param translation_table:   Integer; Genetic code of the origin organism, defines the amino acids of codons
+        :param sequence:            DNA sequence as string or Bio.Seq object; codons weigh by their number in the
+                                    sequence. Ambiguous codons are ignored.
+        :param amino_acid_weights:  Dictionary of amino acids (one letter codes, '*' for stop codons) and weights;
+                                    amino acids that are missing weigh 0
+        :return:                    numpy array
+        """
+        amino_acids = genetic_code(translation_table).amino_acids[:N_UNAMBIGUOUS]
+        if sequence is not None:
+            indices = encode_codons(''.join(str(sequence).upper().split()))
+            weights = numpy.bincount(indices[indices < N_UNAMBIGUOUS], minlength=N_UNAMBIGUOUS).astype(numpy.float64)
+        else:
+            # every amino acid weighs the same, whatever its number of codons
+            weights = 1.0 / numpy.bincount(amino_acids)[amino_acids]
+        if amino_acid_weights is not None:
+            weights = weights * numpy.array([amino_acid_weights.get(chr(aa), 0.0) for aa in amino_acids])
+        return weights
+
+    def distances(self, origin, weights):
+        """
+        Return the distances of all species of the index to the origin organism
+        :param origin:      Array of 64 usage fractions (see usage_vector())
+        :param weights:     Array of 64 codon weights (see HostIndex.weights())
+        :return:            numpy array in the order of the species
+        """
+        total = weights.sum()
+        if not total:
+            raise ValueError('All codons weigh 0')
+        return numpy.abs(self.fractions - numpy.nan_to_num(origin)).dot(weights / total)
+
+    def closest(self, origin, k=10, sequence=None, amino_acid_weights=None, translation_table=None):
+        """
+        Return the k species with the codon usage closest to the origin organism
+        :param origin:              CodonUsageTable of the origin organism, (species, translation_table) tuple of a
+                                    species in the index or array of 64 usage fractions. The origin is not listed
+                                    itself.
+        :param k:                   Integer; Number of species returned
+        :param sequence:            DNA sequence; codons weigh by their number in the sequence (see weights())
+        :param amino_acid_weights:  Dictionary of amino acids and weights (see weights())
+        :param translation_table:   Integer; Only list species using this genetic code
+        :return:                    List of (species, translation_table, distance) tuples, closest first
+        """
+        origin_table = 1
+        exclude = None
+        if isinstance(origin, CodonUsageTable):
+            origin_table = origin.translation_table or 1
+            if origin.species is not None:
+                exclude = self._rows.get((str(origin.species), int(origin_table)))
+            origin = usage_vector(origin)
+        elif isinstance(origin, tuple):
+            origin_table = int(origin[1])
+            exclude = self._rows.get((str(origin[0]), origin_table))
+            if exclude is None:
+                raise KeyError('Species {} (genetic code {}) is not in the index'.format(*origin))
+            origin = self.fractions[exclude]
+
+        distances = self.distances(origin, self.weights(origin_table, sequence, amino_acid_weights))
+        candidates = numpy.ones(len(distances), dtype=bool)
+        if exclude is not None:
+            candidates[exclude] = False
+        if translation_table is not None:
+            candidates &= self.translation_tables == int(translation_table)
+        candidates = numpy.flatnonzero(candidates)
+        # Equally distant hosts keep the order of their rows in the index, also at the cut after k hosts
+        candidates = candidates[numpy.lexsort((candidates, distances[candidates]))[:k]]
+        return [(str(self.species[row]), int(self.translation_tables[row]), float(distances[row]))
+                for row in candidates]
@@ -1,4 +1,11 @@
-"""Handling data input from sequence files in multiple formats"""
+"""Handling data input from sequence files in multiple formats and export of harmonization results"""
+import json
+
+try:
+    import numpy
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
 try:
     from Bio import SeqIO
     from Bio.Data import CodonTable
@@ -35,3 +42,165 @@ def load_file(filename, file_format="fasta"):
     # else return None
     else:
         return None
+
+
+def iterate_records(filename, file_format="fasta"):
+    """
+    Iterate over all records of a sequence file. Records are read one at a time, so files of any size can be
+    processed with constant memory usage.
+    :param filename:     String; Path and filename of input sequence file
+    :param file_format:  String; Format to be used. Refer to Biopython docs for available formats. Defaults to 'fasta'
+    :return:             Generator of Bio.SeqRecord objects
+    """
+    for record in SeqIO.parse(filename, file_format, IUPAC.ambiguous_dna):
+        yield record
+
+
+def write_records(records, filename, file_format="genbank"):
+    """
+    Write sequence records to a file
+    :param records:      Iterable of Bio.SeqRecord objects
+    :param filename:     String; Path and filename of output sequence file
+    :param file_format:  String; Format to be used. Refer to Biopython docs for available formats. Defaults to 'genbank'
+    :return:             Number of records written
+    """
+    return SeqIO.write(records, filename, file_format)
+
+
+# Spellings of boolean options accepted by parse_boolean()
+BOOLEANS = {'true': True, 'yes': True, '1': True, 'false': False, 'no': False, '0': False}
+
+
+def parse_boolean(value):
+    """
+    Parse a boolean option given as string (e.g. 'yes', 'false' or '1'). Booleans are returned unchanged.
+    :param value:   String or Boolean
+    :return:        Boolean
+    """
+    if isinstance(value, bool):
+        return value
+    try:
+        return BOOLEANS[str(value).strip().lower()]
+    except KeyError:
+        raise ValueError('\'{}\' is not a valid boolean'.format(value))
+
+
+# Formats supported by write_results() and the extensions of their files
+RESULT_FORMATS = {'tsv': 'tsv', 'jsonl': 'jsonl', 'npz': 'npz'}
+# Size of the write buffer of exported results in bytes
+BUFFER_SIZE = 1 << 20
+# Number of codons formatted at once by the text writers
+CHUNK_SIZE = 8192
+
+
+def result_columns(sequence):
+    """
+    Return the per-codon results of a harmonized sequence as columns
+    :param sequence:    LibCharm.Sequence.Sequence object
+    :return:            Dictionary of numpy arrays with one entry per codon, in the order of the exported columns
+    """
+    codons = sequence.codons
+    return {'position': codons.position,
+            'aa': numpy.array(list(codons.amino_acids())),
+            'original': codons.original_codons(),
+            'new': codons.new_codons(),
+            'changed': codons.changed(),
+            'ambiguous': codons.ambiguous,
+            'initial_df': codons.initial_df,
+            'final_df': codons.final_df,
+            'origin_f': codons.origin_f,
+            'target_f': codons.target_f}
+
+
+def result_summary(sequence):
+    """
+    Return the summary of a harmonized sequence
+    :param sequence:    LibCharm.Sequence.Sequence object
+    :return:            Dictionary of JSON serializable values
+    """
+    # imported here, as LibCharm.Analysis imports this module
+    from ..Analysis import DIFFERENCE_THRESHOLDS
+
+    codons = sequence.codons
+    threshold = DIFFERENCE_THRESHOLDS[bool(sequence.use_frequency)]
+    return {'origin': sequence.usage_origin.species,
+            'host': sequence.usage_host.species,
+            'translation_table_origin': sequence.translation_table_origin.id,
+            'translation_table_host': sequence.translation_table_host.id,
+            'use_frequency': bool(sequence.use_frequency),
+            'lower_threshold': sequence.lower_threshold,
+            'codons': len(codons),
+            'harmonized_codons': int(numpy.count_nonzero(codons.changed())),
+            'ambiguous_codons': int(numpy.count_nonzero(codons.ambiguous)),
+            'codons_above_threshold': int(numpy.count_nonzero(codons.final_df > threshold)),
+            'verified': bool(sequence.verify_harmonized_sequence()),
+            'harmonized_sequence': str(sequence.harmonized_sequence),
+            'translated_sequence': str(sequence.harmonized_translated_sequence)}
+
+
+def column_values(array):
+    """
+    Convert a column (see result_columns()) to a list of JSON serializable values. NaN is converted to 'None'.
+    :param array:   numpy array
+    """
+    values = array.tolist()
+    if array.dtype.kind == 'f':
+        nan = numpy.isnan(array)
+        if nan.any():
+            for index in numpy.flatnonzero(nan).tolist():
+                values[index] = None
+    return values
+
+
+def _write_tsv(result_file, columns, summary):
+    for key, value in summary.items():
+        result_file.write('# {}: {}\n'.format(key, value))
+    result_file.write('\t'.join(columns) + '\n')
+    n = len(next(iter(columns.values()), ()))
+    for start in range(0, n, CHUNK_SIZE):
+        chunk = [['' if value is None else str(value) for value in column_values(column[start:start + CHUNK_SIZE])]
+                 for column in columns.values()]
+        result_file.write(''.join('\t'.join(row) + '\n' for row in zip(*chunk)))
+
+
+def _write_jsonl(result_file, columns, summary):
+    result_file.write(json.dumps(dict([('record', 'summary')], **summary)) + '\n')
+    keys = ['record'] + list(columns)
+    n = len(next(iter(columns.values()), ()))
+    encoder = json.JSONEncoder()
+    for start in range(0, n, CHUNK_SIZE):
+        chunk = [column_values(column[start:start + CHUNK_SIZE]) for column in columns.values()]
+        result_file.write(''.join(encoder.encode(dict(zip(keys, ('codon',) + row))) + '\n'
+                                  for row in zip(*chunk)))
+
+
+def write_results(sequence, filename, output_format='tsv'):
+    """
+    Write the per-codon results and the summary of a harmonized sequence to a file in one pass. The text formats are
+    formatted in chunks of codons and written through a single buffered file object.
+    Formats:
+    tsv     - Summary as '# key: value' comment lines, followed by a header line and one tab separated line per codon.
+              Undefined values are empty fields.
+    jsonl   - One JSON object per line; the first object holds the summary ("record": "summary"), the following
+              ones the codons ("record": "codon"). Undefined values are null.
+    npz     - numpy archive with one array per column and the summary as JSON string in 'summary'
+
+    :param sequence:        LibCharm.Sequence.Sequence object
+    :param filename:        String; Path of the output file
+    :param output_format:   String; One of 'tsv', 'jsonl' and 'npz'. Defaults to 'tsv'
+    :return:                Path of the output file
+    """
+    if output_format not in RESULT_FORMATS:
+        raise ValueError('Unknown output format: {}'.format(output_format))
+    columns = result_columns(sequence)
+    summary = result_summary(sequence)
+    if output_format == 'npz':
+        with open(filename, 'wb') as result_file:
+            numpy.savez(result_file, summary=numpy.array(json.dumps(summary)), **columns)
+    else:
+        with open(filename, 'w', buffering=BUFFER_SIZE) as result_file:
+            if output_format == 'tsv':
+                _write_tsv(result_file, columns, summary)
+            else:
+                _write_jsonl(result_file, columns, summary)
+    return filename
@@ -0,0 +1,133 @@
+"""Timers and counters collected while codon usage tables are loaded and sequences are harmonized"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Sinks receiving the events of all Metrics objects of the process
+_sinks = []
+
+
+def add_sink(sink):
+    """
+    Register a function receiving the events of all Metrics objects of the process. The function is called with
+    (metrics, kind, name, value) whenever a timer stops (kind 'timer', value is a dictionary with 'wall' and 'cpu'
+    time in seconds) or a counter changes (kind 'counter', value is the new value of the counter).
+    :param sink:    Function
+    """
+    if sink not in _sinks:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    """
+    Unregister a function registered with add_sink()
+    :param sink:    Function
+    """
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+class Metrics():
+    """
+    Wall and CPU time of named steps and named counters of a single object (e.g. a Sequence or a CodonUsageTable).
+    Timers of steps that run several times accumulate their times and count their calls. CPU time is the time of
+    the whole process, so it includes the work of other threads. Thread-safe.
+    label   - String; Name of the object the metrics belong to (e.g. 'sequence')
+    sinks   - List of functions receiving the events of this object in addition to the process-wide sinks (see
+              add_sink())
+    """
+
+    def __init__(self, label=None, sinks=None):
+        self.label = label
+        self.timers = {}
+        self.counters = {}
+        self.sinks = list(sinks or [])
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks cannot be pickled and sinks are local to the process
+        state = dict(self.__dict__)
+        del state['_lock']
+        state['sinks'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _emit(self, kind, name, value):
+        for sink in self.sinks + _sinks:
+            sink(self, kind, name, value)
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Context manager measuring the wall and CPU time of a step
+        :param name:    String; Name of the step
+        """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add_time(self, name, wall, cpu=0.0):
+        """
+        Add the time of a step measured elsewhere
+        :param name:    String; Name of the step
+        :param wall:    Float; Wall time in seconds
+        :param cpu:     Float; CPU time in seconds
+        """
+        with self._lock:
+            timer = self.timers.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+            timer['wall'] += wall
+            timer['cpu'] += cpu
+            timer['calls'] += 1
+        self._emit('timer', name, {'wall': wall, 'cpu': cpu})
+
+    def count(self, name, value=1):
+        """
+        Increase a counter
+        :param name:    String; Name of the counter
+        :param value:   Number added to the counter. Defaults to 1
+        """
+        with self._lock:
+            value = self.counters[name] = self.counters.get(name, 0) + value
+        self._emit('counter', name, value)
+
+    def set(self, name, value):
+        """
+        Set a counter to a value
+        :param name:    String; Name of the counter
+        :param value:   Number
+        """
+        with self._lock:
+            self.counters[name] = value
+        self._emit('counter', name, value)
+
+    def as_dict(self):
+        """
+        Return a copy of all timers and counters as dictionary with the keys 'label', 'timers' and 'counters'
+        """
+        with self._lock:
+            return {'label': self.label,
+                    'timers': {name: dict(timer) for name, timer in self.timers.items()},
+                    'counters': dict(self.counters)}
+
+    def report(self, title=None):
+        """
+        Return the timers and counters as table
+        :param title:   String; Heading of the first column. Defaults to the label
+        """
+        metrics = self.as_dict()
+        lines = []
+        if metrics['timers']:
+            lines.append('{:<32} {:>10} {:>10} {:>6}'.format(title or metrics['label'] or 'step', 'wall [s]',
+                                                               'cpu [s]', 'calls'))
+            for name, timer in metrics['timers'].items():
+                lines.append('{:<32} {:>10.4f} {:>10.4f} {:>6}'.format(name, timer['wall'], timer['cpu'],
+                                                                     timer['calls']))
+        for name, value in metrics['counters'].items():
+            lines.append('{:<32} {:>10}'.format(name, value))
+        return '\n'.join(lines)
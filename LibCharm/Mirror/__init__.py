@@ -0,0 +1,183 @@
+"""Local indexed store mirroring codon usage tables from http://www.kazusa.or.jp/codon"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .. import CodonUsageTable as codon_usage
+from ..Cache import DEFAULT_CACHE_DIR
+from ..Database import write_database
+from ..Fetcher import TableFetcher, FetchError
+
+# Default location of the store
+DEFAULT_STORE = os.path.join(DEFAULT_CACHE_DIR, 'tables.sqlite')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tables (
+    species TEXT NOT NULL,
+    translation_table INTEGER NOT NULL,
+    fetched REAL NOT NULL,
+    entries TEXT NOT NULL,
+    PRIMARY KEY (species, translation_table)
+)
+'''
+
+
+class TableStore():
+    """
+    Stores parsed codon usage tables in a single SQLite database indexed by species id and genetic code. Every table
+    holds the complete parsed entries, so both fractions and frequencies/1000 can be loaded from it. Thread-safe.
+    path    - String; Path of the database file. Defaults to '~/.cache/charm/tables.sqlite'
+    """
+
+    def __init__(self, path=None):
+        if path:
+            self.path = path
+        else:
+            self.path = DEFAULT_STORE
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(_SCHEMA)
+
+    @staticmethod
+    def key(species, translation_table=1):
+        """
+        Generate the key of a table in the store
+        :param species:             Species id as used by http://www.kazusa.or.jp/codon
+        :param translation_table:   Integer; Genetic code of the table
+        """
+        return str(species), int(translation_table)
+
+    def get(self, species, translation_table=1):
+        """
+        Return the entries of a table
+        :param species:             Species id
+        :param translation_table:   Integer; Genetic code of the table
+        :return:                    Tuple of (entries, time the table was fetched) or 'None' if the table is not stored.
+                                    Entries are (codon, aa, fraction, frequency/1000, number) tuples.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT entries, fetched FROM tables WHERE species = ? AND '
+                                           'translation_table = ?', self.key(species, translation_table)).fetchone()
+        if row is None:
+            return None
+        return [tuple(entry) for entry in json.loads(row[0])], row[1]
+
+    def put(self, species, translation_table, entries, fetched=None):
+        """
+        Store the entries of a table, replacing a previously stored version. Every table is committed on its own, so
+        interrupted mirror runs keep their progress.
+        :param species:             Species id
+        :param translation_table:   Integer; Genetic code of the table
+        :param entries:             Iterable of (codon, aa, fraction, frequency/1000, number) tuples
+        :param fetched:             Float; Time the table was fetched. Defaults to now
+        """
+        if fetched is None:
+            fetched = time.time()
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?)',
+                                     self.key(species, translation_table) + (fetched, json.dumps(list(entries))))
+
+    def age(self, species, translation_table=1):
+        """
+        Return the age of a stored table in seconds or 'None' if the table is not stored
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT fetched FROM tables WHERE species = ? AND translation_table = ?',
+                                           self.key(species, translation_table)).fetchone()
+        if row is None:
+            return None
+        return max(time.time() - row[0], 0.0)
+
+    def keys(self):
+        """
+        Return the (species, translation_table) keys of all stored tables
+        """
+        with self._lock:
+            return [tuple(row) for row in self._connection.execute('SELECT species, translation_table FROM tables '
+                                                                   'ORDER BY species, translation_table')]
+
+    def outdated(self, requests, max_age=None):
+        """
+        Return the requested tables that are missing from the store or older than max_age
+        :param requests:    Iterable of (species, translation_table) tuples
+        :param max_age:     Float; Maximum age in seconds. Defaults to 'None' (stored tables never expire)
+        :return:            List of (species, translation_table) keys
+        """
+        outdated = []
+        for species, translation_table in requests:
+            age = self.age(species, translation_table)
+            if age is None or (max_age is not None and age > max_age):
+                outdated.append(self.key(species, translation_table))
+        return outdated
+
+    def __contains__(self, key):
+        return self.age(*key) is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM tables').fetchone()[0]
+
+    def close(self):
+        """
+        Close the database
+        """
+        with self._lock:
+            self._connection.close()
+
+
+def mirror(store, requests, fetcher=None, max_age=None, callback=None):
+    """
+    Fetch all requested tables that are missing from the store or outdated, concurrently and subject to the rate
+    limit of the fetcher, and write them to the store as soon as they are parsed. Re-running the mirror on the same
+    store only fetches what is still missing or stale.
+    :param store:       TableStore the tables are written to
+    :param requests:    Iterable of (species, translation_table) tuples
+    :param fetcher:     LibCharm.Fetcher.TableFetcher; Defaults to a fetcher limited to one request per second
+    :param max_age:     Float; Age in seconds after which stored tables are fetched again. Defaults to 'None'
+    :param callback:    Function called with (key, error) after every table; error is 'None' on success
+    :return:            Dictionary with the lists of 'fetched', 'skipped' and 'failed' keys
+    """
+    requests = list(dict.fromkeys(TableStore.key(*request) for request in requests))
+    outdated = store.outdated(requests, max_age)
+    pending = set(outdated)
+    summary = {'fetched': [], 'skipped': [key for key in requests if key not in pending], 'failed': []}
+    if not outdated:
+        return summary
+    if fetcher is None:
+        fetcher = TableFetcher(rate_limit=1)
+
+    with ThreadPoolExecutor(max_workers=fetcher.max_workers) as executor:
+        futures = {executor.submit(codon_usage.fetch_entries,
+                                   codon_usage.KAZUSA_URL.format(species, translation_table), translation_table,
+                                   fetcher): (species, translation_table)
+                   for species, translation_table in outdated}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                store.put(key[0], key[1], future.result())
+            except (FetchError, ValueError) as error:
+                summary['failed'].append(key)
+                if callback:
+                    callback(key, error)
+                continue
+            summary['fetched'].append(key)
+            if callback:
+                callback(key, None)
+    return summary
+
+
+def export_database(store, filename):
+    """
+    Write all tables of a store to a memory-mapped codon usage database (see LibCharm.Database)
+    :param store:       TableStore the tables are read from
+    :param filename:    String; Path of the database file
+    :return:            Number of tables written
+    """
+    return write_database(filename, ((species, translation_table, store.get(species, translation_table)[0])
+                                     for species, translation_table in store.keys()))
@@ -1,35 +1,49 @@
 """Handling of sequences an generating harmonized sequences"""
+from collections import deque
+from multiprocessing import Pool
 from operator import itemgetter
 
 try:
     from Bio.Seq import Seq
     from Bio.Alphabet import IUPAC
     from Bio.Data import CodonTable
-    from Bio.Data import IUPACData
 except ImportError as e:
     print('ERROR: {}'.format(e.msg))
     exit(1)
+try:
+    import numpy
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+from ..Codons import CODONS, CODON_INDEX, N_CODONS, N_UNAMBIGUOUS, NO_CODON, AmbiguityIndex, CodonRecord, \
+    encode_codons, decode_codons, genetic_code, synonymous_codons, translate_codons
+from ..CodonUsageTable import CodonUsageTable, registry as default_registry
+from ..Metrics import Metrics
 
-from ..CodonUsageTable import CodonUsageTable
+# Minimum number of codons per chunk harmonized by a worker process in per-codon mode
+MIN_CHUNK_SIZE = 4096
 
 
 class Sequence():
     """
-    Provides methods for storage and manipulation of sequences
+    Provides methods for storage and manipulation of sequences. Codon usage tables, translations and the harmonized
+    sequence are computed on first access. Changing a parameter discards only the results that depend on it.
     """
 
     def __init__(self, sequence, origin_id, host_id, translation_table_origin=1, translation_table_host=1,
                  use_frequency=False, lower_threshold=None, strong_stop=True, lower_alternative=True,
-                 use_replacement_table=True, use_highest_frequency_if_ambiguous=True):
+                 use_replacement_table=True, use_highest_frequency_if_ambiguous=True, cache=None, offline=False,
+                 registry=None, metrics=None, replacement_map=None, processes=None):
         """
         Initialize the Sequence object
         sequence                    - DNA or RNA sequence as Bio.Seq object or string. This can for example be
                                       generated by using BioPython directly or by loading a FASTA file using
                                       LibCharm.IO.load_file
         origin_id                   - Species id of the origin organism (can be found in the URL at
-                                      http://www.kazusa.or.jp/codon)
+                                      http://www.kazusa.or.jp/codon) or a pre-built CodonUsageTable object
         host_id                     - Species id of the host organism (can be found in the URL at
-                                      http://www.kazusa.or.jp/codon)
+                                      http://www.kazusa.or.jp/codon) or a pre-built CodonUsageTable object
         translation_table_host      - Integer; Genetic code used by the target host organism. Corrensponds to one of
                                       the translation tables listed here:
                                       http://www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi
@@ -52,76 +66,384 @@ class Sequence():
         use_highest_frequency_if_ambiguous - Boolean: If the sequence contains ambiguous codons (e.g. GCN), always
                                              assume that the most frequent unambiguous codon is used. If set to 'False',
                                              the least frequent unambiguous codon will be used.
+        cache                       - LibCharm.Cache.TableCache; Persistent cache used for the codon usage tables.
+                                      Defaults to 'None' (tables are always fetched from the server)
+        offline                     - Boolean; Load codon usage tables from the cache only and never access the
+                                      network. Defaults to 'False'
+        registry                    - LibCharm.CodonUsageTable.TableRegistry; Registry providing shared codon usage
+                                      tables for species ids. Defaults to the process-wide registry
+        metrics                     - LibCharm.Metrics.Metrics; Records the time spent on every stage and the number
+                                      of codons, unique codons and ambiguous codons. Defaults to a new Metrics object
+        replacement_map             - Dict of arrays as returned by Sequence.compile_replacement_table(); Replacement
+                                      table shared by many sequences that are harmonized with the same codon usage
+                                      tables and options (e.g. all genes of a genome). It is used as long as these
+                                      options are unchanged and it covers all codons of the sequence.
+        processes                   - Integer; Number of worker processes harmonizing chunks of the sequence if
+                                      use_replacement_table is 'False'. If 'None' or 1, all codons are harmonized in
+                                      the calling process.
+        """
+
+        # Parameters are stored first; all results are computed on first access (see Sequence.STAGES)
+        self._stages = {}
+        self._lower_threshold = lower_threshold
+        self._strong_stop = strong_stop
+        self._lower_alternative = lower_alternative
+        self._use_replacement_table = use_replacement_table
+        self._use_frequency = use_frequency
+        self._use_highest_frequency_if_ambiguous = use_highest_frequency_if_ambiguous
+        self._origin_id = origin_id
+        self._host_id = host_id
+        self.cache = cache
+        self.offline = offline
+        self.processes = processes
+        if registry is None:
+            registry = default_registry
+        self.registry = registry
+        if metrics is None:
+            metrics = Metrics('sequence')
+        self.metrics = metrics
+
+        # Set translation tables for original and harmonized sequence
+        self.translation_table_origin = translation_table_origin
+        self.translation_table_host = translation_table_host
+        # Reformat and sanitize sequence
+        self.original_sequence = sequence
+        # Initialize empty replacement map
+        self.replacement_map = None
+        self.shared_replacement_map = replacement_map
+        self._shared_options = self.replacement_options()
+
+    # Stages of the harmonization and the stages they are computed from. A stage is computed on first access and
+    # cached until it is invalidated by a change of one of its inputs.
+    STAGES = {
+        'usage_origin': (),
+        'usage_host': (),
+        'encoding': (),
+        'original_translated_sequence': ('encoding',),
+        'codons': ('encoding',),
+        'harmonization': ('usage_origin', 'usage_host', 'codons'),
+        'harmonized_sequence': ('harmonization',),
+        'harmonized_translated_sequence': ('harmonization',),
+        'mismatches': ('harmonization',),
+        'verification': ('mismatches',),
+    }
+
+    # Parameters and the stages that directly depend on them
+    PARAMETERS = {
+        'original_sequence': ('encoding',),
+        'origin_id': ('usage_origin',),
+        'host_id': ('usage_host',),
+        'translation_table_origin': ('usage_origin', 'original_translated_sequence', 'codons'),
+        'translation_table_host': ('usage_host', 'harmonized_translated_sequence'),
+        'use_frequency': ('usage_origin', 'usage_host', 'harmonization'),
+        'lower_threshold': ('harmonization',),
+        'strong_stop': ('harmonization',),
+        'lower_alternative': ('harmonization',),
+        'use_replacement_table': ('harmonization',),
+        'use_highest_frequency_if_ambiguous': ('harmonization',),
+    }
+
+    def _parameter(name):
+        """
+        Generate a property for a parameter that invalidates the dependent stages if it is changed
+        """
+        attribute = '_' + name
+
+        def getter(self):
+            return getattr(self, attribute)
+
+        def setter(self, value):
+            setattr(self, attribute, value)
+            self.invalidate(*self.PARAMETERS[name])
+
+        return property(getter, setter)
+
+    def _stage(name):
+        """
+        Generate a read-only property that returns the (cached) result of a stage
         """
+        return property(lambda self: self.get_stage(name))
+
+    origin_id = _parameter('origin_id')
+    host_id = _parameter('host_id')
+    use_frequency = _parameter('use_frequency')
+    strong_stop = _parameter('strong_stop')
+    lower_alternative = _parameter('lower_alternative')
+    use_replacement_table = _parameter('use_replacement_table')
+    use_highest_frequency_if_ambiguous = _parameter('use_highest_frequency_if_ambiguous')
+
+    usage_origin = _stage('usage_origin')
+    usage_host = _stage('usage_host')
+    original_translated_sequence = _stage('original_translated_sequence')
+    harmonized_sequence = _stage('harmonized_sequence')
+    harmonized_translated_sequence = _stage('harmonized_translated_sequence')
+    del _parameter, _stage
+
+    @property
+    def codons(self):
+        """
+        Harmonized codons of the sequence as LibCharm.Codons.CodonRecord
+        """
+        return self.get_stage('harmonization')
 
-        # setting threshold if provided, otherwise fall back to defaults
-        if not lower_threshold:
-            if use_frequency:
-                if not lower_threshold:
-                    self.lower_threshold = 5
+    @property
+    def lower_threshold(self):
+        """
+        Threshold that defines the minimum codon usage that is considered appropriate. Defaults to 0.1 for fractions
+        and 5 for frequencies/1000.
+        """
+        if not self._lower_threshold:
+            if self.use_frequency:
+                return 5
+            return 0.1
+        return self._lower_threshold
+
+    @lower_threshold.setter
+    def lower_threshold(self, value):
+        self._lower_threshold = value
+        self.invalidate(*self.PARAMETERS['lower_threshold'])
+
+    @property
+    def translation_table_origin(self):
+        """
+        Genetic code used by the origin organism as Bio.Data.CodonTable object
+        """
+        return self._translation_table_origin
+
+    @translation_table_origin.setter
+    def translation_table_origin(self, value):
+        self._translation_table_origin = self.get_translation_table(value)
+        self.invalidate(*self.PARAMETERS['translation_table_origin'])
+
+    @property
+    def translation_table_host(self):
+        """
+        Genetic code used by the host organism as Bio.Data.CodonTable object
+        """
+        return self._translation_table_host
+
+    @translation_table_host.setter
+    def translation_table_host(self, value):
+        self._translation_table_host = self.get_translation_table(value)
+        self.invalidate(*self.PARAMETERS['translation_table_host'])
+
+    @property
+    def original_sequence(self):
+        """
+        Original DNA sequence as Bio.Seq object
+        """
+        return self._original_sequence
+
+    @original_sequence.setter
+    def original_sequence(self, sequence):
+        # Reformat and sanitize sequence string (remove whitespaces, change to uppercase)
+        if isinstance(sequence, str):
+            # if a string is provided, check if it contains U and not T to distinguish between RNA and DNA
+            if 'U' in sequence.upper() and 'T' not in sequence.upper():
+                seq = Seq(''.join(sequence.upper().split()), IUPAC.ambiguous_rna)
+                # if RNA, convert to DNA alphabet
+                sequence = seq.back_transcribe()
             else:
-                if not lower_threshold:
-                    self.lower_threshold = 0.1
-        else:
-            self.lower_threshold = lower_threshold
+                sequence = Seq(''.join(sequence.upper().split()), IUPAC.ambiguous_dna)
+        self._original_sequence = sequence
+        self.invalidate(*self.PARAMETERS['original_sequence'])
+
+    def get_stage(self, name):
+        """
+        Return the result of a stage. The stage and the stages it depends on are computed if necessary.
+
+        :param name:    Name of the stage (see Sequence.STAGES)
+        """
+        if name not in self._stages:
+            if 'usage_origin' in self.STAGES[name] and 'usage_host' in self.STAGES[name]:
+                self.load_usage_tables()
+            for dependency in self.STAGES[name]:
+                self.get_stage(dependency)
+            # dependencies are computed first, so the timer of a stage only covers the stage itself
+            with self.metrics.timer(name):
+                self._stages[name] = getattr(self, '_compute_' + name)()
+        return self._stages[name]
+
+    def invalidate(self, *stages):
+        """
+        Discard the results of stages and of all stages computed from them
+
+        :param stages:  Names of the stages (see Sequence.STAGES)
+        """
+        pending = list(stages)
+        while pending:
+            stage = pending.pop()
+            self._stages.pop(stage, None)
+            pending.extend(dependent for dependent, dependencies in self.STAGES.items() if stage in dependencies)
+
+    def compute(self, *stages):
+        """
+        Compute stages in advance (e.g. before handing the object to another process). If no stages are given, all
+        stages are computed. Returns the Sequence object itself.
+
+        :param stages:  Names of the stages (see Sequence.STAGES)
+        """
+        for stage in stages or self.STAGES:
+            self.get_stage(stage)
+        return self
+
+    def copy(self, **parameters):
+        """
+        Return a copy of the sequence sharing the codon usage tables and the results computed so far and change
+        parameters of the copy. Only the results depending on the changed parameters are computed again.
 
-        # set other variables to provided values or defaults
-        self.strong_stop = strong_stop
-        self.lower_alternative = lower_alternative
-        self.use_replacement_table = use_replacement_table
-        self.use_frequency = use_frequency
-        self.use_highest_frequency_if_ambiguous = use_highest_frequency_if_ambiguous
+        :param parameters:  New values of parameters of the copy (see Sequence.PARAMETERS)
+        """
+        unknown = set(parameters) - set(self.PARAMETERS)
+        if unknown:
+            raise TypeError('Unknown parameters: {}'.format(', '.join(sorted(unknown))))
+        sequence = Sequence.__new__(Sequence)
+        sequence.__dict__.update(self.__dict__)
+        sequence._stages = dict(self._stages)
+        if 'codons' in self._stages:
+            # codon records are harmonized in place, so the copy gets its own record
+            codons = self._stages['codons'][:]
+            sequence._stages['codons'] = codons
+            if 'harmonization' in self._stages:
+                sequence._stages['harmonization'] = codons
+        sequence.metrics = Metrics(self.metrics.label)
+        for name, value in parameters.items():
+            setattr(sequence, name, value)
+        return sequence
+
+    def load_usage_tables(self):
+        """
+        Load the codon usage tables of origin organism and target host. Tables that have to be fetched are fetched
+        concurrently.
+        """
+        pending = [(stage, species, table.id) for stage, species, table in
+                   (('usage_origin', self.origin_id, self.translation_table_origin),
+                    ('usage_host', self.host_id, self.translation_table_host))
+                   if stage not in self._stages and not isinstance(species, CodonUsageTable)]
+        if len(pending) == 2:
+            with self.metrics.timer('usage_tables'):
+                tables = self.registry.get_many([(species, translation_table, self.use_frequency)
+                                                 for stage, species, translation_table in pending],
+                                                cache=self.cache, offline=self.offline)
+            for (stage, species, translation_table), table in zip(pending, tables):
+                self._stages[stage] = table
+        # a single table to fetch and tables given as objects are loaded by their stages
+        self.get_stage('usage_origin')
+        self.get_stage('usage_host')
+
+    def attach_usage_tables(self, usage_origin, usage_host):
+        """
+        Attach the codon usage tables the sequence was harmonized with (e.g. after it was sent from another process)
+        without discarding any results
 
-        # generate a list of ambiguous DNA letters only (IUPACData.ambiguous_dna_letters also includes the unambiguous
-        # G, C, A and T.
-        self.ambiguous_dna_letters = list(set(IUPACData.ambiguous_dna_letters) - set(IUPACData.unambiguous_dna_letters))
+        :param usage_origin:    CodonUsageTable object of the origin organism
+        :param usage_host:      CodonUsageTable object of the target host
+        """
+        self._origin_id = usage_origin
+        self._host_id = usage_host
+        self._stages['usage_origin'] = usage_origin
+        self._stages['usage_host'] = usage_host
+
+    def _compute_usage_origin(self):
+        return self.get_usage_table(self.origin_id, self.translation_table_origin.id, self.registry, self.cache,
+                                    self.offline)
+
+    def _compute_usage_host(self):
+        return self.get_usage_table(self.host_id, self.translation_table_host.id, self.registry, self.cache,
+                                    self.offline)
+
+    def _compute_encoding(self):
+        # sequences that cannot be encoded (e.g. partial codons) are translated by Biopython; splitting them into
+        # codons reports the error
+        try:
+            return encode_codons(self.original_sequence)
+        except ValueError:
+            return None
+
+    def _compute_original_translated_sequence(self):
+        indices = self.get_stage('encoding')
+        if indices is None:
+            return self.translate_sequence(self.original_sequence, self.translation_table_origin, cds=True)
+        return self.translate_codons(indices, self.translation_table_origin, cds=True)
+
+    def _compute_codons(self):
+        return self.split_original_sequence_to_codons()
+
+    def _compute_harmonization(self):
+        return self.harmonize_codons()
+
+    def _compute_harmonized_sequence(self):
+        return self.construct_new_sequence()
+
+    def _compute_harmonized_translated_sequence(self):
+        return self.translate_codons(self.codons.new, self.translation_table_host, cds=True)
+
+    def _compute_mismatches(self):
+        codons = self.codons
+        return numpy.flatnonzero(~synonymous_codons(codons.original, codons.new, self.translation_table_origin,
+                                                    self.translation_table_host, cds=True))
+
+    def _compute_verification(self):
+        return not len(self.get_stage('mismatches'))
+
+    def __getstate__(self):
+        # Bio.Data.CodonTable objects cannot be pickled, so only the ids of the genetic codes are stored. The registry
+        # is local to the process. Shared replacement maps and codon usage tables are not copied along with every
+        # sequence; tables given as objects are replaced by their species ids, and the receiving process attaches its
+        # own tables (see Sequence.attach_usage_tables()) or obtains them from its registry.
+        state = dict(self.__dict__)
+        state['_stages'] = {stage: result for stage, result in self._stages.items()
+                            if stage not in ('usage_origin', 'usage_host')}
+        for name in ('_origin_id', '_host_id'):
+            if isinstance(state[name], CodonUsageTable):
+                state[name] = state[name].species
+        if self.shared_replacement_map is not None:
+            state['shared_replacement_map'] = None
+            if self.replacement_map is self.shared_replacement_map:
+                state['replacement_map'] = None
+        state['_translation_table_origin'] = self.translation_table_origin.id
+        state['_translation_table_host'] = self.translation_table_host.id
+        state['registry'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._translation_table_origin = CodonTable.ambiguous_dna_by_id[state['_translation_table_origin']]
+        self._translation_table_host = CodonTable.ambiguous_dna_by_id[state['_translation_table_host']]
+        self.registry = default_registry
+
+    @staticmethod
+    def get_translation_table(translation_table):
+        """
+        Return the Bio.Data.CodonTable object of a genetic code
 
+        :param translation_table:  Integer; NCBI translation table id or Bio.Data.CodonTable object
+        """
+        if isinstance(translation_table, CodonTable.CodonTable):
+            translation_table = translation_table.id
         # check if translation table id is > 15. Values > 15 cannot be mapped to http://www.kazusa.or.jp/codon/!
-        if translation_table_origin > 15 or translation_table_host > 15:
+        if int(translation_table) > 15:
             raise ValueError('Though the NCBI lists more than 15 translation tables, CHarm is limited to the '
                              'first 15 as listed on \'http://www.kazusa.or.jp/codon/\'.')
-        # Set translation table for original sequence
-        self.translation_table_origin = CodonTable.ambiguous_dna_by_id[int(translation_table_origin)]
-        self.translation_table_host = CodonTable.ambiguous_dna_by_id[int(translation_table_host)]
-        # Reformat and sanitize sequence string (remove whitespaces, change to uppercase)
-        if type(sequence) is 'str':
-            try:
-                # if a string is provided, check if it contains U and not T to distinguish between RNA and DNA
-                if 'U' in sequence and not 'T' in sequence:
-                    seq = Seq(''.join(sequence.upper().split()), IUPAC.ambiguous_rna)
-                    # if RNA, convert to DNA alphabet
-                    self.original_sequence = seq.back_transcribe()
-                else:
-                    self.original_sequence = Seq(''.join(sequence.upper().split()), IUPAC.ambiguous_dna)
-            except ValueError as error:
-                print('ERROR: {}'.format(error))
-                exit(1)
-        else:
-            self.original_sequence = sequence
-        # Translate original DNA sequence to amino acid sequence
-        self.original_translated_sequence = self.translate_sequence(self.original_sequence,
-                                                                    self.translation_table_origin, cds=True)
-        # Initialize empty harmonize sequence
-        self.harmonized_sequence = ''
-
-        # Fetch codon usage tables for original and host organism
-        self.usage_origin = CodonUsageTable('http://www.kazusa.or.jp/codon/cgi-bin/showcodon.cgi?'
-                                            'species={}&aa={}&style=N'.format(origin_id,
-                                                                              translation_table_origin),
-                                            self.use_frequency)
-        self.usage_host = CodonUsageTable('http://www.kazusa.or.jp/codon/cgi-bin/showcodon.cgi?'
-                                          'species={}&aa={}&style=N'.format(host_id,
-                                                                            translation_table_host),
-                                          self.use_frequency)
-        # Split DNA sequence into list of codons
-        self.codons = self.split_original_sequence_to_codons()
-        # Harmonize codon usage
-        self.harmonize_codons()
-        # Construct new sequence out of harmonized codons
-        self.harmonized_sequence = self.construct_new_sequence()
-        # Translate harmonized DNA sequence to amino acid sequence
-        self.harmonized_translated_sequence = self.translate_sequence(self.harmonized_sequence,
-                                                                      self.translation_table_host, cds=True)
+        return CodonTable.ambiguous_dna_by_id[int(translation_table)]
+
+    def get_usage_table(self, species, translation_table, registry, cache=None, offline=False):
+        """
+        Return the codon usage table of a species. Pre-built tables are returned as they are.
+
+        :param species:            Species id or CodonUsageTable object
+        :param translation_table:  Integer; Genetic code used by the species
+        :param registry:           LibCharm.CodonUsageTable.TableRegistry the table is obtained from
+        :param cache:              LibCharm.Cache.TableCache used if the table has to be fetched
+        :param offline:            Boolean; Only load the table from the cache if it has to be fetched
+        :return:                   CodonUsageTable object
+        """
+        if isinstance(species, CodonUsageTable):
+            if species.use_frequency != self.use_frequency:
+                raise ValueError('The provided codon usage table does not match use_frequency={}'.format(
+                    self.use_frequency))
+            return species
+        return registry.get(species, translation_table, self.use_frequency, cache=cache, offline=offline)
 
     @staticmethod
     def chunks(string, n):
@@ -141,8 +463,15 @@ class Sequence():
         :param translation_table:    NCBI translation table id to be used as int
         :param cds:                  Whether the input sequence is a coding region or not
         :param to_stop:              Only translate up to the first stop codon
-        :return translated_sequence: Translation of DNA sequence as string
+        :return translated_sequence: Translation of DNA sequence as Bio.Seq object
         """
+        try:
+            indices = encode_codons(sequence)
+        except ValueError:
+            # partial codons and invalid letters are left to Biopython
+            indices = None
+        if indices is not None:
+            return self.translate_codons(indices, translation_table, cds=cds, to_stop=to_stop)
 
         translated_sequence = None
         try:
@@ -152,26 +481,40 @@ class Sequence():
             print("This might be just fine if an additional stop codon was found at the end of the sequence.")
             return self.translate_sequence(sequence, translation_table, cds=False, to_stop=True)
         except KeyError as error:
-            print("Error during translation: ", error)
-            exit(1)
+            raise ValueError('Error during translation: {}'.format(error))
         return translated_sequence
 
-    def get_harmonized_codons(self):
+    def translate_codons(self, indices, translation_table, cds=True, to_stop=False):
         """
-        Returns a list of all harmonized codons
+        Translate an array of codon indices (see LibCharm.Codons.CODONS) by looking them up in the compiled genetic
+        code. If the checks of a coding region fail, the sequence is translated up to the first stop codon instead.
+
+        :param indices:              Array of codon indices
+        :param translation_table:    NCBI translation table id or Bio.Data.CodonTable object
+        :param cds:                  Whether the input sequence is a coding region or not
+        :param to_stop:              Only translate up to the first stop codon
+        :return translated_sequence: Translation as Bio.Seq object
         """
-        harmonized_codons = []
-        for codon in self.codons:
-            if str(codon['original']) != str(codon['new']) or codon['ambiguous']:
-                harmonized_codons.append(codon)
+        try:
+            translated_sequence = translate_codons(indices, translation_table, cds=cds, to_stop=to_stop)
+        except CodonTable.TranslationError as error:
+            print("Error during translation: ", error)
+            print("This might be just fine if an additional stop codon was found at the end of the sequence.")
+            return self.translate_codons(indices, translation_table, cds=False, to_stop=True)
+        return Seq(translated_sequence, IUPAC.protein)
 
-        return harmonized_codons
+    def get_harmonized_codons(self):
+        """
+        Returns all harmonized codons as LibCharm.Codons.CodonRecord
+        """
+        return self.codons.select(self.codons.changed())
 
     def split_original_sequence_to_codons(self):
         """
-        Splits the sequence into codons.
+        Splits the sequence into codons, which are translated by looking them up in the compiled genetic code.
 
-        :return codons:     position   - position of codon in the sequence (1 ... end)
+        :return codons:     LibCharm.Codons.CodonRecord with the columns
+                            position   - position of codon in the sequence (1 ... end)
                             original   - original codon
                             new        - new codon after harmonization
                             origin_f   - usage frequency/fraction of the original codon in the origin organism
@@ -183,55 +526,102 @@ class Sequence():
                             aa         - amino acid coded by the codon
         """
 
-        codons = []
-        position = 0
+        indices = self.get_stage('encoding')
+        if indices is None:
+            # raises the error that prevented encoding
+            indices = encode_codons(self.original_sequence)
 
-        for codon in self.chunks(self.original_sequence, 3):
-            position += 1
-            aa = str(codon.translate(table=self.translation_table_origin))
-
-            codons.append({'position': int(position),
-                           'original': str(codon),
-                           'ambiguous': None,
-                           'new': None,
-                           'origin_f': None,
-                           'target_f': None,
-                           'initial_df': None,
-                           'final_df': None,
-                           'aa': aa})
-        return codons
+        self.metrics.set('codons_split', len(indices))
+        return CodonRecord(indices, genetic_code(self.translation_table_origin).amino_acids[indices])
 
     def choose_wobble_codon(self, usage_table, codon, aa, highest_f):
         """
         Choose an unambiguous codon if the original codon is ambiguous. If highest_f is 'True',
-        the codon with the highest frequency in the original organism is used as a reference.
+        the codon with the highest frequency in the original organism is used as a reference. Ambiguity is resolved
+        at any position by a lookup in the ambiguity index of the usage table.
 
         :param usage_table: Usage table as provided by self.usage_origin.usage_table or self.usage_host.usage_table
         :param codon:       The ambiguous codon as string
         :param aa:          The amino acid translation of the codon
         :param highest_f:   If 'True', use the highest frequency codon in the original organism as reference
+        :return:            List of [codon, frequency]; [None, None] if the expanded codons code for different amino
+                            acids
         """
-        codons = []
-        for k in IUPACData.ambiguous_dna_values.keys():
-            if k in self.ambiguous_dna_letters:
-                values = list(IUPACData.ambiguous_dna_values[k])
-                for v in values:
-                    if k in codon:
-                        codons.append(codon.replace(k, v))
-
-        max_f = [None, 0.0]
-        min_f = [None, 100.0]
-        for c in codons:
-            f = usage_table[aa][c]['f']
-            if f > max_f[1]:
-                max_f = [c, f]
-            if f < min_f[1]:
-                min_f = [c, f]
-
-        if highest_f:
-            return max_f
+        if usage_table is self.usage_origin.usage_table:
+            index = self.usage_origin.ambiguity_index()
+        elif usage_table is self.usage_host.usage_table:
+            index = self.usage_host.ambiguity_index()
         else:
-            return min_f
+            index = AmbiguityIndex(usage_table)
+
+        resolved = index.resolve(codon, highest_f)
+        if resolved is None:
+            return [None, None]
+        return [CODONS[resolved[0]], resolved[1]]
+
+    def rank_replacement_codons(self, codon, aa, ambiguity_index=None):
+        """
+        Rank the codons of the host coding for the same amino acid as a codon by the difference of their usage
+        frequency in the host to the usage frequency of the codon in the origin organism. The ranking does not depend
+        on lower_threshold, strong_stop and lower_alternative, so it can be reused if only these options change (see
+        select_replacement_codon()).
+
+        :param codon:           Original codon as string
+        :param aa:              Amino acid the codon is translated to by the origin organism
+        :param ambiguity_index: LibCharm.Codons.AmbiguityIndex of the origin usage table; used if the codon is ambiguous
+        :return ranking:        'None' if an ambiguous codon might code for different amino acids, otherwise a
+                                dictionary with the unambiguous original codon ('codon'), its amino acid ('aa'), the
+                                usage in origin organism and host ('origin_f', 'target_f') and their difference
+                                ('initial_df'), the host codons as (codon, df, frequency in host) tuples sorted by df
+                                and frequency ('ranked') and sorted by frequency ('by_frequency')
+        """
+        if CODON_INDEX[codon] >= N_UNAMBIGUOUS:
+            if ambiguity_index is None:
+                ambiguity_index = self.usage_origin.ambiguity_index()
+            resolved = ambiguity_index.resolve(codon, self.use_highest_frequency_if_ambiguous)
+            if resolved is None:
+                return None
+            codon = CODONS[resolved[0]]
+            aa = chr(ambiguity_index.amino_acids[CODON_INDEX[codon]])
+
+        origin_f = self.usage_origin.usage_table[aa][codon]['f']
+        target_f = self.usage_host.usage_table[aa][codon]['f']
+        candidates = []
+        for item, usage in self.usage_host.usage_table[aa].items():
+            candidates.append((item, abs(origin_f - usage['f']), usage['f']))
+        return {'codon': codon, 'aa': aa, 'origin_f': origin_f, 'target_f': target_f,
+                'initial_df': abs(origin_f - target_f), 'ranked': sorted(candidates, key=itemgetter(1, 2)),
+                'by_frequency': sorted(candidates, key=itemgetter(2))}
+
+    @staticmethod
+    def select_replacement_codon(ranking, lower_threshold, strong_stop=True, lower_alternative=True):
+        """
+        Choose the replacement of a codon from its ranking (see rank_replacement_codons())
+
+        :param ranking:             Ranking of the codon as returned by rank_replacement_codons()
+        :param lower_threshold:     Float; Minimum codon usage considered appropriate (see Sequence.lower_threshold)
+        :param strong_stop:         Boolean; Use the strongest stop codon of the host
+        :param lower_alternative:   Boolean; Use the codon with the lower usage if two codons have the same df
+        :return:                    Tuple of the new codon, its df and its usage in the host
+        """
+        if ranking['aa'] == '*' and strong_stop:
+            # choose the stop codon with the highest usage frequency in the host
+            return ranking['by_frequency'][-1]
+
+        # codons below the threshold are only used if the original codon is below the threshold, too
+        codon_substitutions = [candidate for candidate in ranking['ranked']
+                               if not candidate[2] < lower_threshold < ranking['origin_f']]
+        if not codon_substitutions:
+            # if nothing fits better, leave the original codon in place
+            return ranking['codon'], ranking['initial_df'], ranking['target_f']
+
+        chosen_codon_index = 0  # choose lowest df by default
+        if len(codon_substitutions) >= 2 and codon_substitutions[0][1] == codon_substitutions[1][1] and not \
+                codon_substitutions[0][2] == codon_substitutions[1][2] and not lower_alternative:
+            # if df of the first possible substitutions are identical, choose the one with the higher frequency in
+            # target host if lower_alternative == False
+            chosen_codon_index += 1
+        return codon_substitutions[chosen_codon_index]
 
     def sort_replacement_codons(self, codons):
         """
@@ -242,80 +632,50 @@ class Sequence():
         :return codons: Ranked list of codons
         """
 
-        for codon in codons:
+        ambiguity_index = self.usage_origin.ambiguity_index()
 
-            aa = codon['aa']
-            orig_codon = str(codon['original'])
+        for codon in codons:
 
-            if str(codon['original'])[-1] in self.ambiguous_dna_letters:
-                orig_unambiguous_codon = self.choose_wobble_codon(self.usage_origin.usage_table, orig_codon, aa,
-                                                                  self.use_highest_frequency_if_ambiguous)[0]
+            orig_codon = str(codon['original']).upper()
+            if CODON_INDEX[orig_codon] >= N_UNAMBIGUOUS:
                 codon['ambiguous'] = True
-            else:
-                orig_unambiguous_codon = orig_codon
-
-            origin_f = self.usage_origin.usage_table[aa][orig_unambiguous_codon]['f']
-            target_f = self.usage_host.usage_table[aa][orig_unambiguous_codon]['f']
-
-            df = abs(origin_f - target_f)
 
-            codon['origin_f'] = origin_f
-            codon['target_f'] = target_f
-            codon['initial_df'] = df
+            ranking = self.rank_replacement_codons(orig_codon, codon['aa'], ambiguity_index)
+            if ranking is None:
+                # the codon might code for different amino acids, so it is left in place
+                codon['new'] = orig_codon
+                continue
 
-            codon_substitutions = []
-            stop_codons = []
-
-            for item in self.usage_host.usage_table[aa]:
-
-                f_target_new = self.usage_host.usage_table[aa][item]['f']
-                df_new = abs(origin_f - f_target_new)
-
-                if aa == '*' and self.strong_stop:
-                    stop_codons.append((item, df_new, f_target_new))
-                else:
-                    if f_target_new < self.lower_threshold < origin_f:
-                        add = False
-                    else:
-                        if df_new < df:
-                            add = True
-                        else:  # target_f == 0:
-                            add = True
-
-                    if add:
-                        codon_substitutions.append((item, df_new, f_target_new))
-
-            if codon_substitutions:
-                # sort the possible substitutions by df and frequency in target host
-                sorted_codon_substitutions = sorted(codon_substitutions, key=itemgetter(1, 2))
-
-                chosen_codon_index = 0  # choose lowest df by default
-
-                if len(codon_substitutions) >= 2:
-
-                    if (sorted_codon_substitutions[0][1] == sorted_codon_substitutions[1][1]) and not \
-                            (sorted_codon_substitutions[0][2] == sorted_codon_substitutions[1][2]):
-                        # if df of the first possible substitutions are identical
-                        if not self.lower_alternative and len(sorted_codon_substitutions) > 1:
-                            # choose the one with the higher frequency in target host if lower_alternative == False
-                            chosen_codon_index += 1
+            codon['origin_f'] = ranking['origin_f']
+            codon['initial_df'] = ranking['initial_df']
+            codon['new'], codon['final_df'], codon['target_f'] = self.select_replacement_codon(
+                ranking, self.lower_threshold, self.strong_stop, self.lower_alternative)
+        return codons
 
-                codon['final_df'] = sorted_codon_substitutions[chosen_codon_index][1]
-                codon['target_f'] = sorted_codon_substitutions[chosen_codon_index][2]
-                codon['new'] = sorted_codon_substitutions[chosen_codon_index][0]
+    def sort_replacement_codons_in_parallel(self, codons):
+        """
+        Rank the possible replacements for the original codons like sort_replacement_codons(), but split the codons
+        into chunks that are harmonized by self.processes worker processes. The workers share the codon usage tables
+        and the results are written back in the order of the codons, so the result is the same as in a single process.
 
-            else:
-                if aa == '*' and self.strong_stop:  # if this is a stop codon and we want a strong stop codon
-                    sorted_stop_codons = sorted(stop_codons, key=itemgetter(2))  # sort by frequency in target host
-
-                    # choose the codon with the highest usage frequency
-                    codon['final_df'] = sorted_stop_codons[-1][1]
-                    codon['target_f'] = sorted_stop_codons[-1][2]
-                    codon['new'] = sorted_stop_codons[-1][0]
-                else:
-                    # if nothing fits better, leave the original codon in place
-                    codon['final_df'] = df
-                    codon['new'] = orig_unambiguous_codon
+        :param codons:  LibCharm.Codons.CodonRecord
+        :return codons: The codon record
+        """
+        n_chunks = min(self.processes * 4, len(codons) // MIN_CHUNK_SIZE)
+        bounds = numpy.linspace(0, len(codons), n_chunks + 1).astype(numpy.int64)
+        options = {'translation_table_origin': self.translation_table_origin.id,
+                   'translation_table_host': self.translation_table_host.id, 'use_frequency': self.use_frequency,
+                   'lower_threshold': self.lower_threshold, 'strong_stop': self.strong_stop,
+                   'lower_alternative': self.lower_alternative,
+                   'use_highest_frequency_if_ambiguous': self.use_highest_frequency_if_ambiguous}
+
+        chunks = (codons.select(slice(start, end)) for start, end in zip(bounds[:-1], bounds[1:]))
+        with Pool(self.processes, initializer=_initialize_worker,
+                  initargs=(self.usage_origin, self.usage_host, options)) as pool:
+            for start, chunk in zip(bounds[:-1], pool.imap(_sort_codons, chunks)):
+                for field in ('ambiguous', 'new') + CodonRecord.FLOAT_FIELDS:
+                    getattr(codons, field)[start:start + len(chunk)] = getattr(chunk, field)
+        self.metrics.count('codon_chunks', n_chunks)
         return codons
 
     def compute_replacement_table(self):
@@ -324,49 +684,86 @@ class Sequence():
         to replace codons in a much longer list without the need to compute the codon substitution for every single
         position.
         """
-        unique_codons = []
-        unique_codons_triplets = []
-
-        for codon in self.codons:
-            if len(unique_codons) == 0 or codon['original'] not in unique_codons_triplets:
-                unique_codons_triplets.append(codon['original'])
-                unique_codons.append(codon)
+        codons = self.get_stage('codons')
+        unique_indices = numpy.unique(codons.original, return_index=True)[1]
+        unique_codons = [codons[index] for index in unique_indices]
 
         return self.sort_replacement_codons(unique_codons)
 
+    @staticmethod
+    def compile_replacement_table(codon_substitutions):
+        """
+        Compiles a replacement table as generated by compute_replacement_table() into dense lookup arrays that are
+        indexed by codon index (see LibCharm.Codons.CODONS). Entries of codons that are not part of the replacement
+        table are set to NO_CODON or NaN respectively.
+
+        :param codon_substitutions: List of harmonized unique codons
+        :return replacement_map:    Dict of arrays: new (codon index), origin_f, target_f, initial_df, final_df and
+                                    ambiguous
+        """
+        replacement_map = {'new': numpy.full(N_CODONS, NO_CODON, dtype=numpy.uint16),
+                           'ambiguous': numpy.zeros(N_CODONS, dtype=bool)}
+        for key in ('origin_f', 'target_f', 'initial_df', 'final_df'):
+            replacement_map[key] = numpy.full(N_CODONS, numpy.nan)
+
+        for codon in codon_substitutions:
+            index = CODON_INDEX[str(codon['original']).upper()]
+            replacement_map['new'][index] = CODON_INDEX[codon['new']]
+            replacement_map['ambiguous'][index] = bool(codon['ambiguous'])
+            for key in ('origin_f', 'target_f', 'initial_df', 'final_df'):
+                replacement_map[key][index] = codon[key]
+
+        return replacement_map
+
+    def replacement_options(self):
+        """
+        Return the codon usage tables and options a replacement table depends on
+        """
+        return (self.origin_id, self.host_id, self.translation_table_origin.id, self.translation_table_host.id,
+                self.use_frequency, self.lower_threshold, self.strong_stop, self.lower_alternative,
+                self.use_highest_frequency_if_ambiguous)
+
     def harmonize_codons(self):
         """
         Harmonizes the codon usage of self.original_sequence. This can either be done per codon or by
         computing a replacement table first (default). The second approach is much faster for long sequences but
-        not as flexible.
+        not as flexible. The results are stored in the codon record of the sequence, which is returned.
         """
 
+        # results computed from a previous harmonization are outdated now
+        self.invalidate('harmonization')
+        codons = self.get_stage('codons')
+
         if self.use_replacement_table:
             # This is a much faster approach, but not as flexible as the substitution is only done per codon and cannot
-            # be expanded to its surroundings.
-            codon_substitutions = self.compute_replacement_table()
-            for codon in self.codons:
-                for new_codon in codon_substitutions:
-                    if codon['original'] == new_codon['original']:
-                        for key, value in new_codon.items():
-                            if key != 'position':
-                                codon[key] = value
-
+            # be expanded to its surroundings. The replacement table is compiled into lookup arrays indexed by codon,
+            # so it can be applied to the whole sequence at once. A shared replacement map is used if it was compiled
+            # for the same options and covers all codons of the sequence.
+            replacement_map = self.shared_replacement_map
+            if replacement_map is None or self.replacement_options() != self._shared_options or \
+                    (replacement_map['new'][codons.original] == NO_CODON).any():
+                replacement_map = self.compile_replacement_table(self.compute_replacement_table())
+            self.replacement_map = replacement_map
+            for key, values in self.replacement_map.items():
+                setattr(codons, key, values[codons.original])
+
+        elif self.processes and self.processes > 1 and len(codons) >= 2 * MIN_CHUNK_SIZE:
+            self.sort_replacement_codons_in_parallel(codons)
         else:
-            self.codons = self.sort_replacement_codons(self.codons)
+            self.sort_replacement_codons(codons)
 
-        return self.codons
+        self.metrics.count('codons_processed', len(codons))
+        self.metrics.set('unique_codons', int(numpy.count_nonzero(numpy.bincount(codons.original))))
+        self.metrics.set('ambiguous_codons', int(numpy.count_nonzero(codons.ambiguous)))
+        self._stages['harmonization'] = codons
+        return codons
 
     def construct_new_sequence(self):
         """
         Constructs the harmonized sequence out of the original and substituted codons
         in self.codons
         """
-        tmp = []
-        for codon in self.codons:
-            tmp.append(codon['new'])
-
-        harmonized_sequence = Seq(''.join(tmp), IUPAC.unambiguous_dna)
+        harmonized_sequence = Seq(decode_codons(self.codons.new), IUPAC.unambiguous_dna)
         #harmonized_translated_sequence = self.translate_sequence(harmonized_sequence, cds=True)
 
         return harmonized_sequence
@@ -375,8 +772,215 @@ class Sequence():
         """
         Verifies that the translation of the original and harmonized sequence is identical.
         This has to be true, but might fail due to potential errors in the algorithm.
+        Every harmonized codon is compared with the original codon in the genetic codes of origin and host, so neither
+        sequence is translated; get_mismatches() lists the codons that differ.
+        """
+        return self.get_stage('verification')
+
+    def get_mismatches(self):
+        """
+        Returns the codons of the harmonized sequence that do not code for the amino acid of the original codon
+
+        :return mismatches: List of dictionaries with the keys
+                            position    - position of codon in the sequence (1 ... end)
+                            original    - original codon
+                            new         - new codon after harmonization or 'None'
+                            original_aa - amino acid coded by the original codon in the origin organism
+                            new_aa      - amino acid coded by the new codon in the target host or 'None'
+        """
+        codons = self.codons
+        host = genetic_code(self.translation_table_host)
+        mismatches = []
+        for index in self.get_stage('mismatches'):
+            new = int(codons.new[index])
+            mismatches.append({'position': int(codons.position[index]),
+                               'original': CODONS[codons.original[index]],
+                               'new': None if new == NO_CODON else CODONS[new],
+                               'original_aa': chr(codons.aa[index]),
+                               'new_aa': None if new == NO_CODON else chr(host.amino_acids[new])})
+        return mismatches
+
+    def edit_codons(self, start, end, sequence=''):
+        """
+        Replace the codons start ... end - 1 (counted from 0) of the original sequence by the codons of another DNA or
+        RNA sequence. Codons are inserted if start equals end and deleted if the sequence is empty. Results that have
+        already been computed are updated for the edited codons only: the inserted codons are harmonized and spliced
+        into the codon record, the harmonized sequence and the translations. Translations are computed anew if the
+        start or stop codon is edited or a stop codon is inserted.
+
+        :param start:       Integer; Index of the first replaced codon
+        :param end:         Integer; Index after the last replaced codon
+        :param sequence:    DNA or RNA sequence as Bio.Seq object or string; the length has to be a multiple of three
+        :return:            The Sequence object itself
+        """
+        dna = ''.join(str(sequence).upper().split())
+        if 'U' in dna and 'T' not in dna:
+            dna = dna.replace('U', 'T')
+        indices = encode_codons(dna)
+        encoding = self.get_stage('encoding')
+        if encoding is None:
+            raise ValueError('Only sequences of whole codons can be edited')
+        n_codons = len(encoding)
+        if not 0 <= start <= end <= n_codons:
+            raise IndexError('Codons {} ... {} are not part of a sequence of {} codons'.format(start, end, n_codons))
+
+        with self.metrics.timer('edit'):
+            original = str(self._original_sequence)
+            self._original_sequence = Seq(original[:3 * start] + dna + original[3 * end:],
+                                          self._original_sequence.alphabet)
+            self._stages['encoding'] = numpy.concatenate((encoding[:start], indices, encoding[end:]))
+            self._stages.pop('mismatches', None)
+            self._stages.pop('verification', None)
+            self._splice_translation('original_translated_sequence', start, end, n_codons, indices,
+                                     self.translation_table_origin)
+            if 'codons' not in self._stages:
+                return self
+
+            record = CodonRecord(indices, genetic_code(self.translation_table_origin).amino_acids[indices])
+            harmonized = 'harmonization' in self._stages
+            if harmonized:
+                self.harmonize_inserted_codons(record)
+            codons = self._stages['codons'].splice(start, end, record)
+            self._stages['codons'] = codons
+            self.metrics.set('codons_split', len(codons))
+            if not harmonized:
+                return self
+
+            self._stages['harmonization'] = codons
+            if 'harmonized_sequence' in self._stages:
+                harmonized_sequence = str(self._stages['harmonized_sequence'])
+                self._stages['harmonized_sequence'] = Seq(harmonized_sequence[:3 * start] + decode_codons(record.new) +
+                                                          harmonized_sequence[3 * end:], IUPAC.unambiguous_dna)
+            self._splice_translation('harmonized_translated_sequence', start, end, n_codons, record.new,
+                                     self.translation_table_host)
+            self.metrics.count('codons_processed', len(record))
+            self.metrics.set('unique_codons', int(numpy.count_nonzero(numpy.bincount(codons.original))))
+            self.metrics.set('ambiguous_codons', int(numpy.count_nonzero(codons.ambiguous)))
+        return self
+
+    def harmonize_inserted_codons(self, codons):
+        """
+        Harmonize codons inserted by edit_codons() like the rest of the sequence. In replacement table mode, codons
+        that are not part of the replacement table yet are added to a copy of the table.
+
+        :param codons:  LibCharm.Codons.CodonRecord with the inserted codons
+        :return codons: The codon record
         """
-        if str(self.original_translated_sequence) == str(self.harmonized_translated_sequence):
-            return True
+        if not self.use_replacement_table:
+            return self.sort_replacement_codons(codons)
+
+        replacement_map = self.replacement_map
+        missing = numpy.unique(codons.original[replacement_map['new'][codons.original] == NO_CODON])
+        if len(missing):
+            unique_codons = CodonRecord(missing, genetic_code(self.translation_table_origin).amino_acids[missing])
+            added = self.compile_replacement_table(self.sort_replacement_codons(unique_codons))
+            # the replacement table might be shared with other sequences, so it is never changed in place
+            replacement_map = {key: values.copy() for key, values in replacement_map.items()}
+            for key, values in replacement_map.items():
+                values[missing] = added[key][missing]
+            self.replacement_map = replacement_map
+        for key, values in replacement_map.items():
+            setattr(codons, key, values[codons.original])
+        return codons
+
+    def _splice_translation(self, stage, start, end, n_codons, indices, translation_table):
+        # a translation of a coding sequence holds one amino acid per codon except for the stop codon; it is spliced
+        # if the edit keeps start and stop codon and does not insert a stop codon, and computed anew otherwise
+        translation = self._stages.get(stage)
+        if translation is None:
+            return
+        if len(translation) == n_codons - 1 and 0 < start and end < n_codons and \
+                not genetic_code(translation_table).stop[indices].any():
+            translation = str(translation)
+            self._stages[stage] = Seq(translation[:start] + translate_codons(indices, translation_table, cds=False) +
+                                      translation[end:], IUPAC.protein)
         else:
-            return False
+            del self._stages[stage]
+
+
+# Stages computed for every record by harmonize_records(); the translations are computed on access
+BATCH_STAGES = ('harmonization', 'harmonized_sequence', 'verification')
+
+# Codon usage tables and options of the Sequence objects generated by a worker process of harmonize_records() or
+# Sequence.sort_replacement_codons_in_parallel()
+_worker_state = {}
+
+
+def _initialize_worker(usage_origin, usage_host, options):
+    _worker_state['usage_origin'] = usage_origin
+    _worker_state['usage_host'] = usage_host
+    _worker_state['options'] = options
+
+
+def _harmonize_record(sequence):
+    return Sequence(sequence, _worker_state['usage_origin'], _worker_state['usage_host'],
+                    **_worker_state['options']).compute(*BATCH_STAGES)
+
+
+def _attach(sequence, usage_tables):
+    # sequences returned by the workers are sent without their codon usage tables (see Sequence.__getstate__())
+    sequence.attach_usage_tables(*usage_tables)
+    return sequence
+
+
+def _sort_codons(codons):
+    # a single empty sequence of every worker holds the tables and options the chunks are harmonized with
+    if 'template' not in _worker_state:
+        _worker_state['template'] = Sequence('', _worker_state['usage_origin'], _worker_state['usage_host'],
+                                             **_worker_state['options'])
+    return _worker_state['template'].sort_replacement_codons(codons)
+
+
+def harmonize_records(records, origin_id, host_id, translation_table_origin=1, translation_table_host=1,
+                      use_frequency=False, cache=None, offline=False, registry=None, processes=None,
+                      max_in_flight=None, **kwargs):
+    """
+    Harmonize a stream of sequence records (e.g. as generated by LibCharm.IO.iterate_records) one by one. The codon
+    usage tables are obtained only once and shared by all records. Results are yielded in the order of the input,
+    and at most max_in_flight records are held in memory at any time.
+
+    :param records:                   Iterable of Bio.SeqRecord objects
+    :param origin_id:                 Species id of the origin organism or CodonUsageTable object
+    :param host_id:                   Species id of the host organism or CodonUsageTable object
+    :param translation_table_origin:  Integer; Genetic code used by the origin organism
+    :param translation_table_host:    Integer; Genetic code used by the host organism
+    :param use_frequency:             Boolean; Use frequency per thousand instead of fraction
+    :param cache:                     LibCharm.Cache.TableCache used for the codon usage tables
+    :param offline:                   Boolean; Load codon usage tables from the cache only
+    :param registry:                  LibCharm.CodonUsageTable.TableRegistry; Defaults to the process-wide registry
+    :param processes:                 Integer; Number of worker processes. If 'None' or 1, records are harmonized
+                                      in the calling process.
+    :param max_in_flight:             Integer; Maximum number of records submitted to the workers, but not yet
+                                      yielded. Defaults to twice the number of processes.
+    :param kwargs:                    Further options passed on to Sequence (e.g. lower_threshold)
+    :return:                          Generator of (Bio.SeqRecord, Sequence) tuples
+    """
+    if registry is None:
+        registry = default_registry
+    options = dict(kwargs, translation_table_origin=translation_table_origin,
+                   translation_table_host=translation_table_host, use_frequency=use_frequency)
+
+    usage_tables = []
+    for species, translation_table in ((origin_id, translation_table_origin), (host_id, translation_table_host)):
+        if not isinstance(species, CodonUsageTable):
+            species = registry.get(species, translation_table, use_frequency, cache=cache, offline=offline)
+        usage_tables.append(species)
+
+    if not processes or processes == 1:
+        for record in records:
+            yield record, Sequence(record.seq, usage_tables[0], usage_tables[1], **options).compute(*BATCH_STAGES)
+        return
+
+    if not max_in_flight:
+        max_in_flight = 2 * processes
+
+    pending = deque()
+    with Pool(processes, initializer=_initialize_worker, initargs=(usage_tables[0], usage_tables[1], options)) as pool:
+        for record in records:
+            pending.append((record, pool.apply_async(_harmonize_record, (record.seq,))))
+            if len(pending) >= max_in_flight:
+                record, result = pending.popleft()
+                yield record, _attach(result.get(), usage_tables)
+        while pending:
+            record, result = pending.popleft()
+            yield record, _attach(result.get(), usage_tables)
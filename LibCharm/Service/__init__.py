@@ -0,0 +1,331 @@
+"""Resident harmonization service keeping codon usage tables and replacement tables in memory"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+try:
+    import numpy
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+from .. import IO
+from ..Cache import CacheMissError
+from ..Codons import N_UNAMBIGUOUS
+from ..CodonUsageTable import registry as default_registry
+from ..Fetcher import FetchError
+from ..Genome import shared_replacement_map
+from ..Metrics import Metrics
+from ..Sequence import Sequence
+
+# Options of a harmonization request and their defaults
+OPTIONS = OrderedDict([('translation_table_origin', 1), ('translation_table_host', 1), ('use_frequency', False),
+                       ('lower_threshold', None), ('strong_stop', True), ('lower_alternative', True),
+                       ('use_highest_frequency_if_ambiguous', True)])
+# Number of request latencies kept for the latency percentiles
+LATENCY_WINDOW = 1000
+
+
+class RequestError(ValueError):
+    """
+    Raised if a harmonization request is malformed
+    """
+    pass
+
+
+class HarmonizationService():
+    """
+    Harmonizes sequences on request. The codon usage tables of every origin/host pair are obtained once from the
+    registry, and a replacement table covering all unambiguous codons is compiled once per pair and set of options.
+    Concurrent requests for a pair that is not loaded yet wait for a single load instead of loading it themselves.
+    Thread-safe.
+    registry        - LibCharm.CodonUsageTable.TableRegistry; Defaults to the process-wide registry
+    cache           - LibCharm.Cache.TableCache used when tables are loaded
+    offline         - Boolean; Only load tables from the cache, the store or the database of the registry
+    max_contexts    - Integer; Maximum number of origin/host pairs and options kept in memory. Defaults to 64
+    """
+
+    def __init__(self, registry=None, cache=None, offline=False, max_contexts=64):
+        if registry is None:
+            registry = default_registry
+        self.registry = registry
+        self.cache = cache
+        self.offline = offline
+        self.max_contexts = max_contexts
+        self.metrics = Metrics('service')
+        self.started = time.time()
+        self._contexts = OrderedDict()
+        self._loading = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(request):
+        """
+        Return the key of the context (tables, replacement table and options) a request is harmonized with
+        :param request:     Dictionary; Harmonization request
+        """
+        for name in ('origin', 'host'):
+            if name not in request:
+                raise RequestError('Request is missing \'{}\''.format(name))
+        unknown = set(request) - set(OPTIONS) - {'origin', 'host', 'sequence', 'codons', 'id'}
+        if unknown:
+            raise RequestError('Unknown request fields: {}'.format(', '.join(sorted(unknown))))
+        options = []
+        for name, default in OPTIONS.items():
+            value = request.get(name, default)
+            try:
+                # normalize the options, so equal requests share a context
+                if isinstance(default, bool):
+                    value = IO.parse_boolean(value)
+                elif value is not None:
+                    value = type(default)(value) if default is not None else float(value)
+            except (KeyError, TypeError, ValueError):
+                raise RequestError('Invalid value of \'{}\': {}'.format(name, value))
+            options.append(value)
+        return (str(request['origin']), str(request['host'])) + tuple(options)
+
+    def context(self, key):
+        """
+        Return the codon usage tables, the options and the compiled replacement table for a context key. Contexts are
+        kept in least recently used order.
+        :param key:     Context key as returned by HarmonizationService.key()
+        :return:        Dictionary with 'usage_origin', 'usage_host', 'options' and 'replacement_map'
+        """
+        with self._lock:
+            context = self._contexts.get(key)
+            if context is not None:
+                self._contexts.move_to_end(key)
+                self.metrics.count('context_hits')
+                return context
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            try:
+                with self._lock:
+                    # another request might have loaded the context in the meantime
+                    context = self._contexts.get(key)
+                    if context is not None:
+                        self.metrics.count('coalesced_loads')
+                        return context
+
+                with self.metrics.timer('load_context'):
+                    options = dict(zip(OPTIONS, key[2:]))
+                    usage_origin, usage_host = self.registry.get_many(
+                        [(key[0], options['translation_table_origin'], options['use_frequency']),
+                         (key[1], options['translation_table_host'], options['use_frequency'])],
+                        cache=self.cache, offline=self.offline)
+                    replacement_map = shared_replacement_map([numpy.arange(N_UNAMBIGUOUS)], usage_origin,
+                                                             usage_host, **options)
+                context = {'usage_origin': usage_origin, 'usage_host': usage_host, 'options': options,
+                           'replacement_map': replacement_map}
+                with self._lock:
+                    self._contexts[key] = context
+                    while len(self._contexts) > self.max_contexts:
+                        self._contexts.popitem(last=False)
+                self.metrics.count('context_loads')
+            finally:
+                # failed loads are not kept either; the next request tries again
+                with self._lock:
+                    if self._loading.get(key) is key_lock:
+                        del self._loading[key]
+        return context
+
+    def harmonize(self, request):
+        """
+        Harmonize a single sequence
+        :param request:     Dictionary with 'sequence', 'origin' and 'host' (species ids), optionally the options in
+                            OPTIONS, an 'id' that is returned with the result and 'codons' (Boolean) to return the
+                            per-codon results
+        :return:            Dictionary with the summary of the harmonization (see LibCharm.IO.result_summary) and
+                            optionally the per-codon results as lists in 'columns'
+        """
+        return self.harmonize_batch([request])[0]
+
+    def harmonize_batch(self, requests):
+        """
+        Harmonize several sequences. Requests using the same origin/host pair and options share one context, which
+        is looked up only once per batch. If a context cannot be loaded, only the requests sharing it fail.
+        :param requests:    List of requests (see HarmonizationService.harmonize())
+        :return:            List of results in the order of the requests. Results of failed requests hold the error
+                            message in 'error'.
+        """
+        start = time.perf_counter()
+        if not isinstance(requests, list) or not all(isinstance(request, dict) for request in requests):
+            raise RequestError('Requests have to be JSON objects')
+        keys = [self.key(request) for request in requests]
+        for request in requests:
+            if not isinstance(request.get('sequence'), str):
+                raise RequestError('Request is missing the \'sequence\' string')
+        # contexts are loaded when they are first needed; requests sharing a context that cannot be loaded all fail
+        contexts = {}
+
+        results = []
+        codons = 0
+        errors = 0
+        for request, key in zip(requests, keys):
+            try:
+                if key not in contexts:
+                    try:
+                        contexts[key] = self.context(key)
+                    except (CacheMissError, FetchError, ValueError) as error:
+                        contexts[key] = error
+                context = contexts[key]
+                if isinstance(context, Exception):
+                    raise context
+                sequence = Sequence(request['sequence'], context['usage_origin'], context['usage_host'],
+                                    replacement_map=context['replacement_map'], metrics=Metrics('sequence'),
+                                    **context['options'])
+                with self.metrics.timer('harmonization'):
+                    sequence.compute()
+                result = IO.result_summary(sequence)
+                if request.get('codons'):
+                    result['columns'] = {name: IO.column_values(column)
+                                        for name, column in IO.result_columns(sequence).items()}
+                codons += len(sequence.codons)
+            except (CacheMissError, FetchError, ValueError) as error:
+                result = {'error': str(error)}
+                errors += 1
+            if 'id' in request:
+                result['id'] = request['id']
+            results.append(result)
+
+        self.metrics.count('requests')
+        self.metrics.count('sequences', len(requests))
+        self.metrics.count('codons', codons)
+        if errors:
+            self.metrics.count('errors', errors)
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+        return results
+
+    def statistics(self):
+        """
+        Return throughput and latency of the service
+        :return:    Dictionary with uptime, number of requests, sequences and codons, throughput per second, latency
+                    percentiles in milliseconds of the recent requests, number of cached contexts and the timers and
+                    counters of the service
+        """
+        metrics = self.metrics.as_dict()
+        uptime = time.time() - self.started
+        with self._lock:
+            latencies = numpy.array(self._latencies) * 1000
+            contexts = len(self._contexts)
+        statistics = {'uptime': uptime,
+                      'requests': metrics['counters'].get('requests', 0),
+                      'sequences': metrics['counters'].get('sequences', 0),
+                      'codons': metrics['counters'].get('codons', 0),
+                      'errors': metrics['counters'].get('errors', 0),
+                      'contexts': contexts,
+                      'registry': {'hits': self.registry.hits, 'misses': self.registry.misses},
+                      'metrics': metrics}
+        statistics['sequences_per_second'] = statistics['sequences'] / uptime if uptime else 0.0
+        statistics['codons_per_second'] = statistics['codons'] / uptime if uptime else 0.0
+        if len(latencies):
+            statistics['latency_ms'] = {'p50': float(numpy.percentile(latencies, 50)),
+                                        'p95': float(numpy.percentile(latencies, 95)),
+                                        'p99': float(numpy.percentile(latencies, 99)),
+                                        'max': float(latencies.max())}
+        return statistics
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    JSON interface of a HarmonizationService:
+    POST /harmonize - Body is a single request (answered with a single result), a list of requests or an object with
+                      a list of requests in 'requests' (answered with an object with a list of results in 'results')
+    GET /metrics    - Statistics of the service
+    GET /health     - Status of the service
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            super().log_message(*args)
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(200, self.server.service.statistics())
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/harmonize':
+            self.send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            if isinstance(payload, dict) and 'requests' in payload:
+                self.send_json(200, {'results': self.server.service.harmonize_batch(payload['requests'])})
+            elif isinstance(payload, list):
+                self.send_json(200, {'results': self.server.service.harmonize_batch(payload)})
+            else:
+                self.send_json(200, self.server.service.harmonize(payload))
+        except CacheMissError as error:
+            self.send_json(404, {'error': str(error)})
+        except FetchError as error:
+            self.send_json(502, {'error': str(error)})
+        except ValueError as error:
+            # malformed JSON or requests
+            self.send_json(400, {'error': str(error)})
+        except Exception as error:
+            # keep serving; the client gets an answer for any failure
+            self.send_json(500, {'error': '{}: {}'.format(type(error).__name__, error)})
+
+
+class ServiceServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves a HarmonizationService over HTTP; every connection is handled in its own thread
+    address - Tuple of host and port. Port 0 picks a free port
+    service - HarmonizationService
+    verbose - Boolean; Log every request to standard error
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        self.service = service
+        self.verbose = verbose
+        super().__init__(address, ServiceHandler)
+
+
+class UnixServiceServer(ThreadingMixIn, UnixStreamServer):
+    """
+    Serves a HarmonizationService over HTTP on a Unix socket
+    path    - String; Path of the socket. An existing socket file is replaced
+    service - HarmonizationService
+    verbose - Boolean; Log every request to standard error
+    """
+    daemon_threads = True
+
+    def __init__(self, path, service, verbose=False):
+        self.service = service
+        self.verbose = verbose
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, ServiceHandler)
+
+    def get_request(self):
+        request, client_address = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) address
+        return request, ('unix', 0)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
@@ -0,0 +1,158 @@
+"""Comparison of many harmonization settings of a sequence in a single pass"""
+from collections import OrderedDict
+from itertools import product
+
+try:
+    import numpy
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+from ..Analysis import DIFFERENCE_THRESHOLDS
+from ..Codons import CODONS, CODON_INDEX, N_UNAMBIGUOUS, synonymous_codons
+from ..IO import parse_boolean
+
+# Parameters of Sequence that can be swept
+SWEEP_PARAMETERS = ('lower_threshold', 'lower_alternative', 'strong_stop', 'use_frequency',
+                    'use_highest_frequency_if_ambiguous')
+# Columns of the comparison of the settings
+SWEEP_COLUMNS = SWEEP_PARAMETERS + ('codons', 'harmonized_codons', 'mean_final_df', 'max_final_df', 'above_threshold',
+                                    'verified')
+
+
+def parameter_grid(**values):
+    """
+    Return all combinations of the values of sweep parameters
+    :param values:  Lists of values of the parameters in SWEEP_PARAMETERS (e.g. lower_threshold=[0.05, 0.1, 0.2])
+    :return:        List of dictionaries of parameter names and values
+    """
+    unknown = set(values) - set(SWEEP_PARAMETERS)
+    if unknown:
+        raise ValueError('Parameters cannot be swept: {}'.format(', '.join(sorted(unknown))))
+    names = [name for name in SWEEP_PARAMETERS if name in values]
+    return [dict(zip(names, combination)) for combination in product(*(values[name] for name in names))]
+
+
+def parse_grid(specifications):
+    """
+    Parse a grid of settings given as strings as 'parameter=value,value,...' (e.g. 'lower_threshold=0.05,0.1' or
+    'strong_stop=yes,no'). Thresholds may be 'none' to use the default threshold.
+    :param specifications:  List of strings
+    :return:                List of dictionaries of parameter names and values (see parameter_grid())
+    """
+    values = {}
+    for specification in specifications:
+        name, _, text = specification.partition('=')
+        name = name.strip()
+        if name not in SWEEP_PARAMETERS or not text:
+            raise ValueError('Cannot parse \'{}\'; use one of {} as \'parameter=value,value,...\''.format(
+                specification, ', '.join(SWEEP_PARAMETERS)))
+        parsed = []
+        for value in text.split(','):
+            value = value.strip().lower()
+            if name == 'lower_threshold':
+                parsed.append(None if value == 'none' else float(value))
+            else:
+                try:
+                    parsed.append(parse_boolean(value))
+                except ValueError:
+                    raise ValueError('\'{}\' is not a valid value of {}'.format(value, name))
+        values.setdefault(name, []).extend(parsed)
+    return parameter_grid(**values)
+
+
+def sweep(sequence, grid):
+    """
+    Compare the harmonization of a sequence with many settings. The candidate replacements of every unique codon
+    are ranked once for every combination of use_frequency and use_highest_frequency_if_ambiguous (see
+    Sequence.rank_replacement_codons()); every setting then only selects from these rankings. The codons are split
+    and the codon usage tables are loaded only once.
+
+    :param sequence:    LibCharm.Sequence.Sequence object; parameters that are not part of a setting are taken from
+                        it. The object itself is not changed.
+    :param grid:        List of dictionaries of parameter names and values (see parameter_grid())
+    :return:            List of dictionaries with the keys in SWEEP_COLUMNS, in the order of the grid. The parameters
+                        hold the values actually used (e.g. the default threshold instead of 'None').
+    """
+    groups = OrderedDict()
+    for index, setting in enumerate(grid):
+        unknown = set(setting) - set(SWEEP_PARAMETERS)
+        if unknown:
+            raise ValueError('Parameters cannot be swept: {}'.format(', '.join(sorted(unknown))))
+        key = (bool(setting.get('use_frequency', sequence.use_frequency)),
+               bool(setting.get('use_highest_frequency_if_ambiguous', sequence.use_highest_frequency_if_ambiguous)))
+        groups.setdefault(key, []).append(index)
+
+    results = [None] * len(grid)
+    for (use_frequency, use_highest_frequency_if_ambiguous), indices in groups.items():
+        base = sequence.copy(use_frequency=use_frequency,
+                             use_highest_frequency_if_ambiguous=use_highest_frequency_if_ambiguous)
+        base.load_usage_tables()
+        default_threshold = base.lower_threshold
+        codons = base.get_stage('codons')
+        unique, first, inverse = numpy.unique(codons.original, return_index=True, return_inverse=True)
+        counts = numpy.bincount(inverse.ravel(), minlength=len(unique))
+        ambiguity_index = base.usage_origin.ambiguity_index()
+        rankings = [base.rank_replacement_codons(CODONS[codon], chr(codons.aa[position]), ambiguity_index)
+                    for codon, position in zip(unique, first)]
+        # ambiguous codons always count as harmonized (see LibCharm.Codons.CodonRecord.changed())
+        ambiguous = unique >= N_UNAMBIGUOUS
+        verified = {}
+
+        for index in indices:
+            setting = grid[index]
+            # 'None' selects the default threshold of fractions or frequencies
+            base.lower_threshold = setting.get('lower_threshold', default_threshold)
+            strong_stop = setting.get('strong_stop', base.strong_stop)
+            lower_alternative = setting.get('lower_alternative', base.lower_alternative)
+
+            new = unique.copy()
+            final_df = numpy.full(len(unique), numpy.nan)
+            for position, ranking in enumerate(rankings):
+                if ranking is not None:
+                    codon, final_df[position], _ = base.select_replacement_codon(
+                        ranking, base.lower_threshold, strong_stop, lower_alternative)
+                    new[position] = CODON_INDEX[codon]
+
+            # settings resulting in the same codons share the verification, which only compares the unique codons
+            # (see Sequence.verify_harmonized_sequence())
+            key = new.tobytes()
+            if key not in verified:
+                synonymous = synonymous_codons(unique, new, base.translation_table_origin, base.translation_table_host)
+                if len(codons):
+                    # the start codon is verified as start codon; other occurrences of the same codon are not
+                    start = inverse.ravel()[0]
+                    start_codon = synonymous_codons(unique[start:start + 1], new[start:start + 1],
+                                                    base.translation_table_origin, base.translation_table_host,
+                                                    cds=True)[0]
+                    synonymous[start] = start_codon and (counts[start] == 1 or synonymous[start])
+                verified[key] = bool(synonymous.all())
+            valid = ~numpy.isnan(final_df)
+            n_valid = counts[valid].sum()
+            results[index] = {'lower_threshold': base.lower_threshold,
+                              'lower_alternative': bool(lower_alternative),
+                              'strong_stop': bool(strong_stop),
+                              'use_frequency': use_frequency,
+                              'use_highest_frequency_if_ambiguous': use_highest_frequency_if_ambiguous,
+                              'codons': len(codons),
+                              'harmonized_codons': int(counts[(new != unique) | ambiguous].sum()),
+                              'mean_final_df': float((final_df[valid] * counts[valid]).sum() / n_valid)
+                              if n_valid else None,
+                              'max_final_df': float(final_df[valid].max()) if n_valid else None,
+                              'above_threshold': float(counts[final_df > DIFFERENCE_THRESHOLDS[use_frequency]].sum() /
+                                                       len(codons)) if len(codons) else 0.0,
+                              'verified': verified[key]}
+    return results
+
+
+def write_sweep(results, filename):
+    """
+    Write the results of sweep() to a tab separated file
+    :param results:     List of dictionaries with the keys in SWEEP_COLUMNS
+    :param filename:    String; Path of the output file
+    """
+    with open(filename, 'w') as sweep_file:
+        sweep_file.write('\t'.join(SWEEP_COLUMNS) + '\n')
+        for result in results:
+            sweep_file.write('\t'.join('' if result[column] is None else str(result[column])
+                                       for column in SWEEP_COLUMNS) + '\n')
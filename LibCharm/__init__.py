@@ -1,2 +1,2 @@
 """Master module for loading LibCHarm"""
-__all__ = ["IO", "Sequence", "CodonUsageTable"]
+__all__ = ["IO", "Sequence", "CodonUsageTable", "Cache", "Codons", "Fetcher", "Mirror", "Database", "Metrics", "Genome", "Service", "Sweep", "Hosts", "Analysis"]
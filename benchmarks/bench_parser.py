@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+bench_parser.py: Compares the Kazusa table parser with the former BeautifulSoup/html5lib based parser.
+"""
+
+import argparse
+import io
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from LibCharm.CodonUsageTable import extract_table, parse_kazusa_table
+
+PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'kazusa', '83333_1.html')
+
+
+def parse_legacy(page):
+    """
+    Former implementation: parse the whole page with html5lib and cut the entries at fixed positions
+    """
+    from bs4 import BeautifulSoup
+
+    table_string = str(BeautifulSoup(page, 'html5lib').pre)
+    table_string = table_string.replace('<pre>\n', '').replace('<pre>', '')
+    table_string = table_string.replace('\n</pre>', '').replace('</pre>', '')
+
+    entries = []
+    for line in table_string.split('\n'):
+        for codon_raw in line.split(')'):
+            codon_raw = codon_raw.strip()
+            codon = codon_raw[:3].strip().replace('U', 'T')
+            if codon:
+                entries.append((codon, codon_raw[4:5].strip(), float(codon_raw[6:10].strip()),
+                                float(codon_raw[11:15].strip())))
+    return entries
+
+
+def parse_native(page):
+    """
+    Current implementation: extract the <pre> section from the byte stream and tokenize the entries
+    """
+    return parse_kazusa_table(extract_table(io.BytesIO(page)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=200, help='number of repetitions')
+    parser.add_argument('page', type=str, nargs='?', default=PAGE, help='Kazusa codon usage table page')
+    args = parser.parse_args()
+
+    with open(args.page, 'rb') as page_file:
+        page = page_file.read()
+
+    native = timeit.timeit(lambda: parse_native(page), number=args.number) / args.number
+    print('native parser:           {:>10.1f} µs per table'.format(native * 1e6))
+
+    try:
+        legacy = timeit.timeit(lambda: parse_legacy(page), number=args.number) / args.number
+    except ImportError as error:
+        print('legacy parser skipped: {}'.format(error))
+        return
+    print('BeautifulSoup/html5lib:  {:>10.1f} µs per table'.format(legacy * 1e6))
+    print('speedup:                 {:>10.1f}x'.format(legacy / native))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+charm-bench.py: Offline benchmarks of the stages of the CHarm harmonization pipeline.
+
+Codon usage tables are taken from the recorded pages in tests/kazusa and served by a local stand-in server, and the
+sequences are generated randomly, so the benchmarks never access the network and are reproducible. Every stage is
+timed separately (best of several runs) and its peak memory is measured with tracemalloc in a separate run. Results
+are written as JSON and can be compared with the results of an earlier commit.
+"""
+
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    import numpy
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+try:
+    import LibCharm.CodonUsageTable as codon_usage
+    from LibCharm.CodonUsageTable import CodonUsageTable
+    from LibCharm.Codons import CODON_BYTES, CODON_INDEX, N_UNAMBIGUOUS, genetic_code
+    from LibCharm.Fetcher import TableFetcher
+    from LibCharm.Sequence import Sequence
+    from tests.kazusa_stub import KazusaStub, PAGES
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+# Sizes of the benchmarked sequences in base pairs
+DEFAULT_SIZES = (300, 10000, 1000000, 10000000)
+# Slowdowns of less than this many seconds are never reported as regressions, as they are within timer noise
+MIN_DIFFERENCE = 0.001
+# Stages of the pipeline in the order they are run
+STAGES = ('table_fetch', 'table_parse', 'sequence', 'split', 'harmonize', 'construct_new_sequence',
+          'verify', 'translate', 'plot')
+
+
+def load_plot():
+    """
+    Import plot() from charm-cli.py
+    """
+    spec = importlib.util.spec_from_file_location('charm_cli', os.path.join(ROOT, 'charm-cli.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.plot
+
+
+def random_sequence(size, translation_table=1, ambiguous=0.0, seed=0):
+    """
+    Generate a random coding sequence: ATG, random sense codons and a stop codon
+
+    :param size:                length of the sequence in base pairs (rounded down to whole codons, at least 2)
+    :param translation_table:   genetic code used to choose sense and stop codons
+    :param ambiguous:           fraction of codons of which the third letter is replaced by 'N'
+    :param seed:                seed of the random number generator
+    :return sequence:           DNA sequence as string
+    """
+    rng = numpy.random.RandomState(seed)
+    code = genetic_code(translation_table)
+    sense = numpy.flatnonzero(~code.stop[:N_UNAMBIGUOUS])
+    n_codons = max(size // 3, 2)
+    indices = numpy.empty(n_codons, dtype=numpy.intp)
+    # ATG is the only codon of methionine, so harmonization never replaces it
+    indices[0] = CODON_INDEX['ATG']
+    indices[1:-1] = rng.choice(sense, n_codons - 2)
+    indices[-1] = numpy.flatnonzero(code.stop[:N_UNAMBIGUOUS])[0]
+    letters = CODON_BYTES[indices]
+    if ambiguous:
+        letters[1:-1, 2][rng.random_sample(n_codons - 2) < ambiguous] = ord('N')
+    return letters.tobytes().decode('ascii')
+
+
+def measure(function, memory=False):
+    """
+    Run a function and return its result and either its run time in seconds or the peak memory in bytes allocated
+    while it ran
+    """
+    if not memory:
+        start = time.perf_counter()
+        result = function()
+        return result, time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        result = function()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_tables(origin, host, memory=False):
+    """
+    Measure fetching the codon usage tables from the stand-in server and parsing the recorded pages
+    :return tables, results:    parsed tables of origin and host and dictionary of stage name -> measurement
+    """
+    results = {}
+    with KazusaStub() as stub:
+        url = codon_usage.KAZUSA_URL
+        codon_usage.KAZUSA_URL = stub.url
+        fetcher = TableFetcher()
+        try:
+            results['table_fetch'] = measure(lambda: [CodonUsageTable.from_kazusa(species, fetcher=fetcher)
+                                                      for species in (origin, host)], memory)[1]
+        finally:
+            codon_usage.KAZUSA_URL = url
+            fetcher.close()
+    tables, results['table_parse'] = measure(
+        lambda: [CodonUsageTable.from_file(os.path.join(PAGES, '{}_1.html'.format(species)))
+                 for species in (origin, host)], memory)
+    return tables, results
+
+
+def run_pipeline(dna, tables, use_replacement_table, plot=None, directory=None, memory=False, processes=None):
+    """
+    Measure the stages of the harmonization of one sequence
+    :return:    dictionary of stage name -> measurement
+    """
+    results = {}
+    sequence, results['sequence'] = measure(lambda: Sequence(dna, tables[0], tables[1],
+                                                             use_replacement_table=use_replacement_table,
+                                                             processes=processes), memory)
+    results['split'] = measure(lambda: sequence.compute('encoding', 'codons'), memory)[1]
+    results['harmonize'] = measure(lambda: sequence.compute('harmonization'), memory)[1]
+    results['construct_new_sequence'] = measure(lambda: sequence.compute('harmonized_sequence'), memory)[1]
+    results['verify'] = measure(lambda: sequence.compute('verification'), memory)[1]
+    results['translate'] = measure(lambda: sequence.compute('original_translated_sequence',
+                                                            'harmonized_translated_sequence'), memory)[1]
+    if not sequence.verify_harmonized_sequence():
+        raise RuntimeError('Translations of harmonized and original sequence do not match')
+    if plot:
+        results['plot'] = measure(lambda: plot(sequence, os.path.join(directory, 'bench')), memory)[1]
+    return results
+
+
+def git_revision():
+    """
+    Return the commit the benchmarks were run on or 'None' outside of a git checkout
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the run times of two benchmark runs
+
+    :param results:     benchmark results
+    :param baseline:    benchmark results of an earlier run
+    :param tolerance:   relative slowdown above which a stage counts as regression (e.g. 0.2 for 20%)
+    :return lines, regressions: report lines and number of regressions
+    """
+    previous = {(entry['size'], entry['mode'], entry['stage']): entry for entry in baseline['results']}
+    lines = []
+    regressions = 0
+    for entry in results['results']:
+        before = previous.get((entry['size'], entry['mode'], entry['stage']))
+        if before is None or not before['seconds']:
+            continue
+        ratio = entry['seconds'] / before['seconds']
+        flag = ''
+        if ratio > 1 + tolerance and entry['seconds'] - before['seconds'] > MIN_DIFFERENCE:
+            flag = ' REGRESSION'
+            regressions += 1
+        lines.append('{:>10} {:<13} {:<24} {:>10.4f} -> {:>10.4f} s  x{:.2f}{}'.format(
+            entry['size'], entry['mode'], entry['stage'], before['seconds'], entry['seconds'], ratio, flag))
+    return lines, regressions
+
+
+def parse_arguments():
+    """
+    Parse command line arguments and return list of arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='sizes of the benchmarked sequences in base pairs; Default is: {}'.format(
+                            ' '.join(str(size) for size in DEFAULT_SIZES)))
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of runs of every benchmark; the fastest run is reported; Default is: 3')
+    parser.add_argument('--max_per_codon_size', type=int, default=1000000,
+                        help='largest sequence harmonized in per-codon mode (without replacement table); '
+                             'Default is: 1000000')
+    parser.add_argument('--processes', type=int, nargs='+', default=[],
+                        help='numbers of worker processes the per-codon mode is additionally benchmarked with '
+                             '(e.g. 2 4 8); Default is: per-codon mode runs in a single process only')
+    parser.add_argument('--ambiguous', type=float, default=0.0,
+                        help='fraction of ambiguous codons in the sequences; Default is: 0')
+    parser.add_argument('--origin', type=int, default=83333,
+                        help='species id of the origin organism (recorded in tests/kazusa); Default is: 83333')
+    parser.add_argument('--host', type=int, default=4227,
+                        help='species id of the host organism (recorded in tests/kazusa); Default is: 4227')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random sequences; Default is: 0')
+    parser.add_argument('--no_plot', action='store_true', help='do not benchmark plotting')
+    parser.add_argument('--no_memory', action='store_true', help='do not measure peak memory')
+    parser.add_argument('-o', '--output', type=str, default='charm-bench.json',
+                        help='JSON file the results are written to; Default is: charm-bench.json')
+    parser.add_argument('--compare', type=str, help='JSON file of an earlier run to compare the run times with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown reported as regression by --compare; Default is: 0.2')
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    """
+    Main function of charm-bench.py.
+    """
+    args = parse_arguments()
+    warnings.simplefilter('ignore')
+    plot = None
+    if not args.no_plot:
+        plot = load_plot()
+
+    entries = []
+
+    def record(size, mode, timings, peaks):
+        for stage in STAGES:
+            if stage in timings:
+                entries.append({'size': size, 'mode': mode, 'stage': stage, 'seconds': timings[stage],
+                                'peak_bytes': peaks.get(stage)})
+                print('{:>10} {:<13} {:<24} {:>10.4f} s {:>12}'.format(
+                    size, mode, stage, timings[stage],
+                    '' if peaks.get(stage) is None else '{:.1f} MiB'.format(peaks[stage] / 2 ** 20)))
+
+    runs = [run_tables(args.origin, args.host) for _ in range(args.repeat)]
+    tables = runs[0][0]
+    peaks = {}
+    if not args.no_memory:
+        peaks = run_tables(args.origin, args.host, memory=True)[1]
+    record(0, 'tables', {stage: min(run[1][stage] for run in runs) for stage in runs[0][1]}, peaks)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            dna = random_sequence(size, ambiguous=args.ambiguous, seed=args.seed)
+            modes = [('replacement', True, None), ('per_codon', False, None)]
+            modes += [('per_codon_x{}'.format(processes), False, processes) for processes in args.processes]
+            for mode, use_replacement_table, processes in modes:
+                if not use_replacement_table and size > args.max_per_codon_size:
+                    continue
+                runs = [run_pipeline(dna, tables, use_replacement_table, plot, directory, processes=processes)
+                        for _ in range(args.repeat)]
+                peaks = {}
+                if not args.no_memory:
+                    # tracemalloc only sees the memory of the calling process
+                    peaks = run_pipeline(dna, tables, use_replacement_table, plot, directory, memory=True,
+                                         processes=processes)
+                record(len(dna), mode, {stage: min(run[stage] for run in runs) for stage in runs[0]}, peaks)
+
+    results = {'revision': git_revision(),
+               'date': datetime.datetime.now().isoformat(),
+               'python': platform.python_version(),
+               'numpy': numpy.__version__,
+               'platform': platform.platform(),
+               'repeat': args.repeat,
+               'results': entries}
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=1)
+    print('\nResults written to {}'.format(args.output))
+
+    if args.compare:
+        with open(args.compare, 'r') as baseline_file:
+            lines, regressions = compare(results, json.load(baseline_file), args.tolerance)
+        print('\nComparison with {}:\n'.format(args.compare))
+        print('\n'.join(lines))
+        if regressions:
+            print('\n{} stages are more than {:.0f}% slower'.format(regressions, args.tolerance * 100))
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
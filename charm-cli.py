@@ -6,7 +6,10 @@ charm-cli.py: Simple command line interface for CHarm.
 """
 
 import argparse
+import atexit
+import cProfile
 import logging
+import os
 
 try:
     import matplotlib
@@ -27,6 +30,17 @@ except ImportError as e:
 
 try:
     from LibCharm.Sequence import Sequence
+    from LibCharm.Cache import TableCache, CacheMissError
+    from LibCharm.Fetcher import FetchError
+    from LibCharm.Mirror import TableStore
+    from LibCharm.Database import CodonUsageDatabase
+    from LibCharm.CodonUsageTable import TableRegistry, registry as default_registry
+    from LibCharm.Metrics import Metrics
+    from LibCharm.Analysis import DEFAULT_WINDOW, DIFFERENCE_THRESHOLDS, gene_profiles, sequence_profiles, \
+        window_statistics, write_profiles
+    from LibCharm.Genome import harmonize_genome, write_gene_summary
+    from LibCharm.Sweep import parse_grid, sweep, write_sweep
+    from LibCharm.Hosts import HostIndex, harmonize_hosts, parse_host, write_host_sequences, write_host_summary
     from LibCharm import IO
 except ImportError as e:
     print('ERROR: {}'.format(e.msg))
@@ -48,18 +62,11 @@ def autolabel(rects, ax, labels, vertical=True):
     else:
         rotation = 'horizontal'
 
-    if len(labels) == len(rects):
-        heights = []
-        for rect in rects:
-            height = rect.get_height()
-            heights.append(height)
-
+    if len(labels) == len(rects) and len(rects):
+        heights = [rect.get_height() for rect in rects]
         max_height = max(heights)
 
-        for rect in rects:
-            i = rects.index(rect)
-            label = labels[i]
-            height = rect.get_height()
+        for rect, height, label in zip(rects, heights, labels):
             if height > 0:
                 y = 1.05 * height
             else:
@@ -68,107 +75,115 @@ def autolabel(rects, ax, labels, vertical=True):
                     ha='center', va='bottom', rotation=rotation, size='x-small')
 
 
-def plot_codon_usage(sequence, ax):
+def difference_threshold(sequence):
     """
-    Plot the codon usage for origin and target host as bar graph
+    Return the threshold above which differences in codon usage are highlighted
 
     :param sequence: LibCharm.Sequence object
-    :param ax      : matplotlib axis object
     """
+    return DIFFERENCE_THRESHOLDS[bool(sequence.use_frequency)]
 
-    x1 = x2 = numpy.arange(len(sequence.codons))
-    bar_width = 0.5
-    xlabels = []
 
-    origin_f = []
-    target_f = []
+def set_usage_locators(ax, sequence, differences=False):
+    """
+    Label the y axis and set the distance between its ticks according to use_frequency
 
-    # extract data to plot from sequence object
-    for c in sequence.codons:
-        origin_f.append(c['origin_f'])
-        target_f.append(c['target_f'])
-        xlabels.append(c['aa'])
+    :param ax:          matplotlib axis object
+    :param sequence:    LibCharm.Sequence object
+    :param differences: whether the axis shows differences in codon usage
+    """
+    if not sequence.use_frequency:
+        if differences:
+            major_locator = matplotlib.ticker.MultipleLocator(0.05)
+        else:
+            # set the y axis label
+            ax.set_ylabel('codon usage [fraction]')
+            major_locator = matplotlib.ticker.MultipleLocator(0.1)
+        minor_locator = matplotlib.ticker.MultipleLocator(0.01)
+    else:
+        if not differences:
+            # set the y axis label if frequency is used instead of fractions
+            ax.set_ylabel('codon usage [frequency/1000]')
+        major_locator = matplotlib.ticker.MultipleLocator(10)
+        minor_locator = matplotlib.ticker.MultipleLocator(1)
 
-    # convert lists to numpy arrays
-    origin_f = numpy.array(origin_f)
-    target_f = numpy.array(target_f)
+    # set the distance between the ticks on the y axis
+    ax.yaxis.set_major_locator(major_locator)
+    ax.yaxis.set_minor_locator(minor_locator)
 
-    # plot data
-    p1 = ax.bar(x1, origin_f, color='b', width=bar_width)
-    p2 = ax.bar(x2 + (0.5 * bar_width), target_f, color='r', width=bar_width)
 
-    # hide top and right axes
+def style_axis(ax):
+    """
+    Hide top and right axes and let the ticks point outwards
+
+    :param ax: matplotlib axis object
+    """
     ax.spines['right'].set_visible(False)
     ax.spines['top'].set_visible(False)
-    # set tick parameters
     ax.tick_params(axis='both', which='both', direction='out')
     ax.get_xaxis().tick_bottom()
     ax.get_yaxis().tick_left()
+
+
+def plot_codon_usage(sequence, ax, codons=None):
+    """
+    Plot the codon usage for origin and target host as bar graph
+
+    :param sequence: LibCharm.Sequence object
+    :param ax      : matplotlib axis object
+    :param codons:   LibCharm.Codons.CodonRecord with the codons to plot; defaults to all codons of sequence
+    """
+    if codons is None:
+        codons = sequence.codons
+
+    x1 = x2 = codons.position - 1
+    bar_width = 0.5
+
+    # extract data to plot from sequence object
+    origin_f = codons.origin_f
+    target_f = codons.target_f
+    xlabels = list(codons.amino_acids())
+
+    # plot data
+    p1 = ax.bar(x1, origin_f, color='b', width=bar_width)
+    p2 = ax.bar(x2 + (0.5 * bar_width), target_f, color='r', width=bar_width)
+
+    style_axis(ax)
     # position xticks and labels on x axis to be centered for both bars
     ax.set_xticks(x1 + bar_width / 2)
     ax.set_xticklabels(xlabels, **{'family': 'monospace'})
     ax.set_xlabel('amino acid')
     # add a legend to the plot
     ax.legend((p1, p2), ('Origin organism', 'Host organism'), loc=2, bbox_to_anchor=(1, 1))
-    ax.hlines(sequence.lower_threshold, 0, len(x1), colors='k', linestyles='solid', **{'linewidth': 1})
+    if len(x1):
+        ax.hlines(sequence.lower_threshold, x1[0], x1[-1] + 1, colors='k', linestyles='solid', **{'linewidth': 1})
 
-    if not sequence.use_frequency:
-        # set the y axis label
-        ax.set_ylabel('codon usage [fraction]')
-        # specify the distance between the ticks on the y axis
-        major_locator = matplotlib.ticker.MultipleLocator(0.1)
-        minor_locator = matplotlib.ticker.MultipleLocator(0.01)
-    else:
-        # set the y axis label if frequency is used instead of fractions
-        ax.set_ylabel('codon usage [frequency/1000]')
-        # specify the distance between the ticks on the y axis
-        major_locator = matplotlib.ticker.MultipleLocator(10)
-        minor_locator = matplotlib.ticker.MultipleLocator(1)
-
-    # set the distance between the ticks on the y axis
-    ax.yaxis.set_major_locator(major_locator)
-    ax.yaxis.set_minor_locator(minor_locator)
+    set_usage_locators(ax, sequence)
 
 
-def plot_codon_usage_differences(sequence, ax):
+def plot_codon_usage_differences(sequence, ax, codons=None):
     """
     Plot the difference in codon usage for origin and target host as bar graph
 
     :param sequence: LibCharm.Sequence object
     :param ax:       matplotlib axis object
+    :param codons:   LibCharm.Codons.CodonRecord with the codons to plot; defaults to all codons of sequence
     """
+    if codons is None:
+        codons = sequence.codons
 
-    # Generate a range of residues out of the length of the sequence array
-    x1 = numpy.arange(len(sequence.codons))
+    # Positions of the residues on the x axis
+    x1 = codons.position - 1
 
     # Set the threshold according to use_frequency
-    if sequence.use_frequency:
-        threshold = 5
-    else:
-        threshold = 0.2
+    threshold = difference_threshold(sequence)
 
     # Set width of bars
     bar_width = 0.8
-    # Initialize array of labels for the x axis
-    xlabels = []
-
-    # Initialize arrays of data and labels for the bars
-    df = []
-    bar_labels = []
-
-    # walk over the codons in sequence
-    for c in sequence.codons:
-        # add final_df to data array
-        df.append(c['final_df'])
-        # add residue to xlabels
-        xlabels.append(c['aa'])
-        # generate bar label and add to list
-        label = u'{} → {}'.format(c['original'], c['new'])
-        bar_labels.append(label)
-
-    # convert lists to numpy arrays
-    bar_labels = numpy.array(bar_labels)
-    df = numpy.array(df)
+    # Extract data, labels for the x axis and labels for the bars from sequence
+    df = codons.final_df
+    xlabels = list(codons.amino_acids())
+    bar_labels = numpy.char.add(numpy.char.add(codons.original_codons(), u' → '), codons.new_codons())
     # find bars that exceed the threshold
     mask1 = numpy.ma.where(df > threshold)
     mask2 = numpy.ma.where(df <= threshold)
@@ -180,12 +195,7 @@ def plot_codon_usage_differences(sequence, ax):
     p2 = ax.bar(x1[mask2], df[mask2], color='b', width=bar_width)
     autolabel(p2, ax, bar_labels[mask2], vertical=True)
 
-    # hide top and right axis
-    ax.spines['right'].set_visible(False)
-    ax.spines['top'].set_visible(False)
-    ax.tick_params(axis='both', which='both', direction='out')
-    ax.get_xaxis().tick_bottom()
-    ax.get_yaxis().tick_left()
+    style_axis(ax)
 
     # set x axis labels to be centered and to use a monospaced font
     ax.set_xticks(x1 + bar_width / 2)
@@ -194,43 +204,286 @@ def plot_codon_usage_differences(sequence, ax):
 
     ax.set_ylabel(r'Differential codon usage $f_{origin} - f_{host}$')
 
-    if not sequence.use_frequency:
-        major_locator = matplotlib.ticker.MultipleLocator(0.05)
-        minor_locator = matplotlib.ticker.MultipleLocator(0.01)
-    else:
-        major_locator = matplotlib.ticker.MultipleLocator(10)
-        minor_locator = matplotlib.ticker.MultipleLocator(1)
-
     ax.legend((p1, p2), (u'Δf > {}'.format(threshold), u'Δf ≤ {}'.format(threshold)), loc=2, bbox_to_anchor=(1, 1))
 
-    ax.yaxis.set_major_locator(major_locator)
-    ax.yaxis.set_minor_locator(minor_locator)
+    set_usage_locators(ax, sequence, differences=True)
 
-    ax.hlines(threshold, 0, len(x1), colors='k', linestyles='dotted', **{'linewidth': 1})
+    if len(x1):
+        ax.hlines(threshold, x1[0], x1[-1] + 1, colors='k', linestyles='dotted', **{'linewidth': 1})
 
 
-def plot(sequence, prefix=None):
+def plot_windows(sequence, axarr, window):
     """
-    Wrapper for plot_codon_usage_differences and plot_codon_usage
+    Plot codon usage and differences in codon usage aggregated in windows of codons, for sequences that are too long
+    to plot every codon
 
-    :param sequence:  LibCharm.Sequence object
-    :param prefix:    Resulting plot files will be prefixed with 'prefix'
+    :param sequence: LibCharm.Sequence object
+    :param axarr:    two matplotlib axis objects
+    :param window:   number of codons per window
+    """
+    codons = sequence.codons
+    threshold = difference_threshold(sequence)
+
+    origin = window_statistics(codons.origin_f, window, threshold)
+    target = window_statistics(codons.target_f, window, threshold)
+    differences = window_statistics(codons.final_df, window, threshold)
+    # windows are drawn at the position of their first codon (1-based)
+    x = differences['start'] + 1
+
+    ax = axarr[0]
+    ax.step(x, origin['mean'], where='post', color='b', label='Origin organism')
+    ax.step(x, target['mean'], where='post', color='r', label='Host organism')
+    ax.axhline(sequence.lower_threshold, color='k', linestyle='solid', linewidth=1)
+    style_axis(ax)
+    ax.set_xlabel('codon position (mean of {} codons)'.format(window))
+    ax.legend(loc=2, bbox_to_anchor=(1, 1))
+    set_usage_locators(ax, sequence)
+    ax.yaxis.set_major_locator(matplotlib.ticker.MaxNLocator())
+    ax.yaxis.set_minor_locator(matplotlib.ticker.NullLocator())
+
+    ax = axarr[1]
+    lines = ax.step(x, differences['mean'], where='post', color='b', label=u'mean Δf')
+    lines += ax.step(x, differences['max'], where='post', color='r', label=u'max Δf')
+    ax.axhline(threshold, color='k', linestyle='dotted', linewidth=1)
+    style_axis(ax)
+    ax.set_xlabel('codon position (windows of {} codons)'.format(window))
+    ax.set_ylabel(r'Differential codon usage $f_{origin} - f_{host}$')
+
+    above = ax.twinx()
+    lines += above.step(x, differences['above'] * 100, where='post', color='0.6',
+                        label=u'codons with Δf > {} [%]'.format(threshold))
+    above.set_ylabel(u'codons with Δf > {} [%]'.format(threshold))
+    above.set_ylim(0, 100)
+    ax.legend(lines, [line.get_label() for line in lines], loc=2, bbox_to_anchor=(1.05, 1))
+
+
+def plot(sequence, prefix=None, plot_format='svg', detail='auto', max_codons=1000, window=None,
+         codons_per_page=None):
+    """
+    Wrapper for plot_codon_usage_differences and plot_codon_usage. Short sequences are plotted codon by codon, long
+    ones as aggregates of windows of codons.
+
+    :param sequence:        LibCharm.Sequence object
+    :param prefix:          Resulting plot files will be prefixed with 'prefix'
+    :param plot_format:     'svg', 'png' or 'pdf'
+    :param detail:          'codons', 'windows' or 'auto' (codons if the sequence has at most max_codons codons)
+    :param max_codons:      maximum number of codons plotted one by one if detail is 'auto'
+    :param window:          number of codons per window; defaults to a value giving about 500 windows
+    :param codons_per_page: split plots of single codons into pages (files; pages of a single file for 'pdf')
+    :return filenames:      list of the written files
     """
 
     if prefix:
-        filename = '{}_charm_results.svg'.format(prefix)
+        basename = '{}_charm_results'.format(prefix)
+    else:
+        basename = 'charm_results'
+
+    n_codons = len(sequence.codons)
+    if detail == 'auto':
+        if n_codons > max_codons:
+            detail = 'windows'
+        else:
+            detail = 'codons'
+
+    if detail == 'windows':
+        if not window:
+            window = max(1, n_codons // 500)
+        fig, axarr = matplotlib.pyplot.subplots(2, figsize=(20, 10), dpi=300)
+        plot_windows(sequence, axarr, window)
+        filename = '{}.{}'.format(basename, plot_format)
+        fig.savefig(filename, format=plot_format, bbox_inches='tight')
+        matplotlib.pyplot.close(fig)
+        return [filename]
+
+    if codons_per_page and n_codons > codons_per_page:
+        pages = [sequence.codons[start:start + codons_per_page] for start in range(0, n_codons, codons_per_page)]
     else:
-        filename = 'charm_results.svg'
+        pages = [sequence.codons]
+
+    filenames = []
+    pdf = None
+    if plot_format == 'pdf' and len(pages) > 1:
+        from matplotlib.backends.backend_pdf import PdfPages
+        filenames.append('{}.pdf'.format(basename))
+        pdf = PdfPages(filenames[0])
+
+    for number, codons in enumerate(pages):
+        # Create a plot with two subplots
+        if len(pages) > 1:
+            figsize = (max(10, 50 * len(codons) / max(codons_per_page, 1)), 20)
+        else:
+            figsize = (50, 20)
+        fig, axarr = matplotlib.pyplot.subplots(2, figsize=figsize, dpi=300)
+
+        # Actually plot data
+        plot_codon_usage(sequence, axarr[0], codons)
+        plot_codon_usage_differences(sequence, axarr[1], codons)
+
+        if pdf is not None:
+            pdf.savefig(fig)
+        else:
+            if len(pages) > 1:
+                filename = '{}_page{}.{}'.format(basename, number + 1, plot_format)
+            else:
+                filename = '{}.{}'.format(basename, plot_format)
+            fig.savefig(filename, format=plot_format)
+            filenames.append(filename)
+        matplotlib.pyplot.close(fig)
 
-    # Create a plot with two subplots
-    fig, axarr = matplotlib.pyplot.subplots(2, figsize=(50, 20), dpi=300)
+    if pdf is not None:
+        pdf.close()
+    return filenames
 
-    # Actually plot data
-    plot_codon_usage(sequence, axarr[0])
-    plot_codon_usage_differences(sequence, axarr[1])
 
-    # Save plot as svg
-    matplotlib.pyplot.savefig(filename, format='svg', orientation='landscape', papertype='a4')
+def log_codons(logger, codons, harmonized_sequence):
+    """
+    Log a table of all codons, the harmonized sequence and warnings for ambiguous codons. The table is formatted as a
+    whole and passed to the logger in a single record instead of one record per codon.
+
+    :param logger:              logger instance
+    :param codons:              LibCharm.Codons.CodonRecord of the harmonized sequence
+    :param harmonized_sequence: harmonized sequence
+    """
+    table_header = '{:<10} {:^3} {:^4}    {:^4} {:^7} {:>6} {:<7} {:>6}'.format('position', 'aa', 'orig', 'new',
+                                                                                'initial', 'final', 'origin', 'target')
+    lines = [table_header]
+    warnings = []
+
+    # Iterate over all codons in the sequence and format some statistics and information. The columns are converted
+    # to lists in bulk instead of accessing the codons one by one.
+    columns = {'position': codons.position.tolist(),
+               'aa': list(codons.amino_acids()),
+               'original': codons.original_codons().tolist(),
+               'new': codons.new_codons().tolist(),
+               'ambiguous': codons.ambiguous.tolist(),
+               'initial_df': codons.initial_df.tolist(),
+               'final_df': codons.final_df.tolist(),
+               'origin_f': codons.origin_f.tolist(),
+               'target_f': codons.target_f.tolist()}
+    for values in zip(*columns.values()):
+        c = dict(zip(columns.keys(), values))
+        if str(c['original']) != str(c['new']):
+            line = '{:<10} {:^3} {:<4} -> {:<4} {:<5.2f} -> {:<3.2f}  {:<5.2f} -> {:<3.2f}'.format(c['position'],
+                                                                                                   c['aa'],
+                                                                                                   c['original'],
+                                                                                                   c['new'],
+                                                                                                   c['initial_df'],
+                                                                                                   c['final_df'],
+                                                                                                   c['origin_f'],
+                                                                                                   c['target_f'])
+        else:
+            line = '{:<10} {:^3} {:<12} {:<5.2f}          {:<5.2f} -> {:<3.2f}'.format(c['position'],
+                                                                                       c['aa'],
+                                                                                       c['original'],
+                                                                                       c['initial_df'],
+                                                                                       c['origin_f'],
+                                                                                       c['target_f'])
+        if c['ambiguous']:
+            line += ' WARNING: Original codon is ambiguous!'
+            warnings.append('Codon {} ({}) coding for {} is ambiguous! {} was chosen for the '
+                            'harmonized sequence!'.format(c['position'],
+                                                          c['original'],
+                                                          c['aa'],
+                                                          c['new']))
+        lines.append(line)
+
+    logger.info('\n'.join(lines))
+    logger.info('\nCodon-harmonized sequence:\n\n{}'.format(harmonized_sequence))
+    if warnings:
+        logger.warn('\nWARNINGS OCCURRED DURING HARMONIZATION:\n\n' + '\n'.join(warnings))
+
+
+def log_profile(logger, metrics, sequence):
+    """
+    Log the time spent on the steps of charm-cli and the stages of the harmonization as well as the time spent on
+    loading the codon usage tables
+
+    :param logger:      logger instance
+    :param metrics:     LibCharm.Metrics.Metrics object of the run
+    :param sequence:    LibCharm.Sequence object
+    """
+    logger.info('\nPROFILE:\n')
+    logger.info(metrics.report('step'))
+    for name, table in (('origin', sequence.usage_origin), ('host', sequence.usage_host)):
+        report = table.metrics.report('codon usage table ({})'.format(name))
+        if report:
+            logger.info('\n' + report)
+
+
+def write_profile(profiler, filename):
+    """
+    Stop a profiler and write its statistics to a file
+
+    :param profiler:    cProfile.Profile object
+    :param filename:    path of the statistics file
+    """
+    profiler.disable()
+    profiler.dump_stats(filename)
+
+
+def harmonize_annotated_file(args, logger, metrics, **options):
+    """
+    Harmonize all CDS features of a GenBank or EMBL file. The harmonized records are written to
+    '<prefix>_charm-harmonized.<gbk|embl>' and a summary of every gene to '<prefix>_charm-genes.tsv'.
+
+    :param args:        parsed command line arguments
+    :param logger:      logger instance
+    :param metrics:     LibCharm.Metrics.Metrics object of the run
+    :param options:     options passed on to LibCharm.Genome.harmonize_genome
+    """
+    if args.prefix:
+        basename = '{}_charm-'.format(args.prefix)
+    else:
+        basename = 'charm-'
+    extension = 'gbk' if args.input_format == 'genbank' else 'embl'
+
+    try:
+        with metrics.timer('read_input'):
+            records = list(IO.iterate_records(args.input, args.input_format))
+        with metrics.timer('harmonization'):
+            harmonized_records, genes = harmonize_genome(records, args.origin, args.host, processes=args.processes,
+                                                         **options)
+    except (CacheMissError, FetchError, ValueError) as error:
+        logger.error('ERROR: {}'.format(error))
+        exit(1)
+
+    with metrics.timer('export'):
+        IO.write_records(harmonized_records, '{}harmonized.{}'.format(basename, extension), args.input_format)
+        write_gene_summary(genes, '{}genes.tsv'.format(basename))
+
+    failed = [gene for gene in genes if gene['error']]
+    logger.info('SUMMARY:\n')
+    logger.info('Records: {}'.format(len(harmonized_records)))
+    logger.info('CDS features: {}'.format(len(genes)))
+    logger.info('Harmonized genes: {}'.format(len(genes) - len(failed)))
+    logger.info('Harmonized codons: {} of {}'.format(sum(gene['harmonized_codons'] for gene in genes),
+                                                     sum(gene['codons'] for gene in genes)))
+    logger.info('Codons kept because genes overlap: {}\n'.format(sum(gene['kept_overlapping_codons']
+                                                                     for gene in genes)))
+    logger.info('Harmonized records written to {}harmonized.{}'.format(basename, extension))
+    logger.info('Summary of all genes written to {}genes.tsv'.format(basename))
+    if args.usage_profiles:
+        registry = options.get('registry') or default_registry
+        try:
+            usage_tables = [registry.get(species, translation_table, options['use_frequency'],
+                                         cache=options.get('cache'), offline=options.get('offline', False))
+                            for species, translation_table in ((args.origin, options['translation_table_origin']),
+                                                               (args.host, options['translation_table_host']))]
+            with metrics.timer('profiles'):
+                profiles = list(gene_profiles(records, harmonized_records, genes, usage_tables[0], usage_tables[1],
+                                              args.usage_window, args.usage_step, options['use_frequency']))
+                write_profiles([profile for gene, profile in profiles], '{}profiles.tsv'.format(basename),
+                               names=[gene['gene'] for gene, profile in profiles])
+            logger.info('Codon usage profiles of all genes written to {}profiles.tsv'.format(basename))
+        except (CacheMissError, FetchError, IOError) as error:
+            logger.error('ERROR: Cannot write codon usage profiles: {}'.format(error))
+    if failed:
+        logger.warn('\nWARNING: {} genes were left unchanged:\n\n'.format(len(failed)) +
+                    '\n'.join('{} ({}): {}'.format(gene['gene'], gene['record'], gene['error']) for gene in failed))
+
+    if args.profile:
+        logger.info('\nPROFILE:\n')
+        logger.info(metrics.report('step'))
 
 
 def parse_arguments():
@@ -255,16 +508,257 @@ def parse_arguments():
                         help='id of translation table; Default is: standard genetic code = 1; '
                              'id corresponds to \'trans_table\' '
                              'on http://www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi')
+    parser.add_argument('--cache_dir', type=str,
+                        help='directory in which codon usage tables are cached; Default is: ~/.cache/charm')
+    parser.add_argument('--cache_ttl', type=float,
+                        help='time in hours after which cached codon usage tables are fetched again; '
+                             'Default is: cached tables never expire')
+    parser.add_argument('--no_cache', action='store_true', help='always fetch codon usage tables from the server')
+    parser.add_argument('--offline', action='store_true',
+                        help='never access the network; codon usage tables have to be present in the cache or the '
+                             'table store')
+    parser.add_argument('--store', type=str,
+                        help='table store created by charm-mirror.py; tables present in the store are never fetched')
+    parser.add_argument('--database', type=str,
+                        help='codon usage database exported by charm-mirror.py; tables present in the database are '
+                             'never fetched')
+    parser.add_argument('--plot_format', choices=('svg', 'png', 'pdf'), default='svg',
+                        help='file format of the plot; Default is: svg')
+    parser.add_argument('--plot_detail', choices=('auto', 'codons', 'windows'), default='auto',
+                        help='plot every codon or aggregates of windows of codons; \'auto\' plots every codon of '
+                             'sequences with up to --max_plot_codons codons; Default is: auto')
+    parser.add_argument('--max_plot_codons', type=int, default=1000,
+                        help='maximum number of codons plotted one by one in \'auto\' mode; Default is: 1000')
+    parser.add_argument('--window', type=int,
+                        help='number of codons per window of aggregated plots; Default is: 1/500 of the sequence')
+    parser.add_argument('--codons_per_page', type=int,
+                        help='split plots of single codons into pages of this many codons')
+    parser.add_argument('--no_plot', action='store_true', help='do not plot the results')
+    parser.add_argument('--output_format', choices=('tsv', 'jsonl', 'npz'),
+                        help='write the per-codon results and the summary to \'<prefix>_charm-results.<format>\' '
+                             'in this format; Default is: no result file')
+    parser.add_argument('--profile', action='store_true',
+                        help='log the time spent on every step and counts of processed codons')
+    parser.add_argument('--cprofile', type=str,
+                        help='profile the run with cProfile and write the statistics to this file (read them with '
+                             'the pstats module)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not log the per-codon results; only the summary is logged')
     parser.add_argument('origin', type=int, help='species id of origin organism taken from '
                                                  '\'http://www.kazusa.or.jp/codon\' (e.g. \'83333\' for E. coli K12)')
     parser.add_argument('host', type=int, help='species id of host organism taken from '
                                                '\'http://www.kazusa.or.jp/codon\' (e.g. \'83333\' for E. coli K12)')
-    parser.add_argument('input', type=str, help='input file in FASTA format')
+    parser.add_argument('--input_format', choices=('fasta', 'genbank', 'embl'), default='fasta',
+                        help='format of the input file; all CDS features of GenBank and EMBL files are harmonized; '
+                             'Default is: fasta')
+    parser.add_argument('--processes', type=int,
+                        help='number of worker processes harmonizing the CDS features of GenBank and EMBL files or '
+                             'the hosts given by --hosts; Default is: 1')
+    parser.add_argument('--sweep', type=str, action='append',
+                        help='compare the harmonization with all combinations of settings instead of harmonizing '
+                             'the sequence; give the values of one parameter per option as \'parameter=value,...\' '
+                             '(e.g. --sweep lower_threshold=0.05,0.1,0.2 --sweep strong_stop=yes,no); parameters '
+                             'are lower_threshold, lower_alternative, strong_stop, use_frequency and '
+                             'use_highest_frequency_if_ambiguous; the comparison is written to '
+                             '\'<prefix>_charm-sweep.tsv\'')
+    parser.add_argument('--hosts', type=str, nargs='+',
+                        help='harmonize for these hosts in addition to the host and rank all hosts; give species '
+                             'ids, optionally with the id of their translation table as \'species:table\'; the '
+                             'ranking is written to \'<prefix>_charm-hosts.tsv\' and the harmonized sequences to '
+                             '\'<prefix>_charm-hosts.fasta\'')
+    parser.add_argument('--recommend_hosts', type=str,
+                        help='list the hosts of a host recommendation index written by charm-mirror.py --index '
+                             'whose codon usage is closest to the origin, weighted by the codons of the sequence, '
+                             'instead of harmonizing the sequence')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of hosts listed by --recommend_hosts; Default is: 10')
+    parser.add_argument('--usage_profiles', action='store_true',
+                        help='write sliding-window profiles of %%MinMax and CAI of the original and the harmonized '
+                             'sequence and of the difference in codon usage to \'<prefix>_charm-profiles.tsv\'')
+    parser.add_argument('--usage_window', type=int, default=DEFAULT_WINDOW,
+                        help='number of codons per window of the profiles; Default is: {}'.format(DEFAULT_WINDOW))
+    parser.add_argument('--usage_step', type=int, default=1,
+                        help='distance in codons between the starts of two windows of the profiles; Default is: 1')
+    parser.add_argument('input', type=str, help='input file in FASTA, GenBank or EMBL format')
     args = parser.parse_args()
 
+    # sweeps, host recommendations, host comparisons and annotated files are separate modes
+    modes = [option for option, value in (('--sweep', args.sweep), ('--recommend_hosts', args.recommend_hosts),
+                                          ('--hosts', args.hosts)) if value]
+    if args.input_format != 'fasta':
+        modes.append('--input_format {}'.format(args.input_format))
+    if len(modes) > 1:
+        parser.error('{} cannot be combined'.format(' and '.join(modes)))
+
     return args
 
 
+def sweep_settings(args, logger, metrics, sequence):
+    """
+    Compare the harmonization of a sequence with the grid of settings given by --sweep, log the comparison and write
+    it to '<prefix>_charm-sweep.tsv'
+
+    :param args:        parsed command line arguments
+    :param logger:      logger instance
+    :param metrics:     LibCharm.Metrics.Metrics object of the run
+    :param sequence:    LibCharm.Sequence object with the other settings
+    """
+    try:
+        grid = parse_grid(args.sweep)
+    except ValueError as error:
+        logger.error('ERROR: {}'.format(error))
+        exit(1)
+    try:
+        with metrics.timer('sweep'):
+            results = sweep(sequence, grid)
+    except (CacheMissError, FetchError) as error:
+        logger.error('ERROR: {}'.format(error))
+        exit(1)
+
+    lines = ['{:>10} {:>6} {:>6} {:>6} {:>6} {:>10} {:>10} {:>10} {:>8} {:>8}'.format(
+        'threshold', 'lower', 'strong', 'freq', 'high', 'harmonized', 'mean df', 'max df', 'above', 'verified')]
+    for result in results:
+        lines.append('{:>10} {:>6} {:>6} {:>6} {:>6} {:>10} {:>10} {:>10} {:>7.1f}% {:>8}'.format(
+            result['lower_threshold'], str(result['lower_alternative']), str(result['strong_stop']),
+            str(result['use_frequency']), str(result['use_highest_frequency_if_ambiguous']),
+            result['harmonized_codons'],
+            '' if result['mean_final_df'] is None else '{:.4f}'.format(result['mean_final_df']),
+            '' if result['max_final_df'] is None else '{:.4f}'.format(result['max_final_df']),
+            result['above_threshold'] * 100, str(result['verified'])))
+    logger.info('SWEEP of {} settings ({} codons):\n\n{}\n'.format(len(results), len(sequence.original_sequence) // 3,
+                                                                  '\n'.join(lines)))
+
+    if args.prefix:
+        sweep_filename = '{}_charm-sweep.tsv'.format(args.prefix)
+    else:
+        sweep_filename = 'charm-sweep.tsv'
+    try:
+        write_sweep(results, sweep_filename)
+        logger.info('Comparison written to {}'.format(sweep_filename))
+    except IOError as error:
+        logger.error('ERROR: Cannot write comparison: {}'.format(error))
+
+    if args.profile:
+        log_profile(logger, metrics, sequence)
+
+
+def compare_hosts(args, logger, metrics, sequence):
+    """
+    Harmonize a sequence for the host and the hosts given by --hosts, log the ranking of the hosts and write it to
+    '<prefix>_charm-hosts.tsv' and the harmonized sequences to '<prefix>_charm-hosts.fasta'
+
+    :param args:        parsed command line arguments
+    :param logger:      logger instance
+    :param metrics:     LibCharm.Metrics.Metrics object of the run
+    :param sequence:    LibCharm.Sequence object harmonized for the host
+    """
+    translation_table = sequence.translation_table_host.id
+    try:
+        hosts = [(str(args.host), translation_table)] + [parse_host(host, translation_table) for host in args.hosts]
+    except ValueError as error:
+        logger.error('ERROR: {}'.format(error))
+        exit(1)
+    try:
+        with metrics.timer('hosts'):
+            results = harmonize_hosts(sequence, hosts, processes=args.processes)
+    except (CacheMissError, FetchError) as error:
+        logger.error('ERROR: {}'.format(error))
+        exit(1)
+
+    lines = ['{:>5} {:>10} {:>6} {:>10} {:>10} {:>10} {:>10} {:>8} {:>8}'.format(
+        'rank', 'host', 'table', 'harmonized', 'initial df', 'mean df', 'max df', 'above', 'verified')]
+    for summary, harmonized in results:
+        lines.append('{:>5} {:>10} {:>6} {:>10} {:>10} {:>10} {:>10} {:>7.1f}% {:>8}'.format(
+            summary['rank'], summary['host'], summary['translation_table_host'], summary['harmonized_codons'],
+            *['' if summary[key] is None else '{:.4f}'.format(summary[key])
+              for key in ('mean_initial_df', 'mean_final_df', 'max_final_df')],
+            summary['above_threshold'] * 100, str(summary['verified'])))
+    logger.info('HOSTS ranked by the difference in codon usage of the harmonized sequence ({} codons):\n\n{}\n'.format(
+        len(sequence.original_sequence) // 3, '\n'.join(lines)))
+
+    prefix = '{}_'.format(args.prefix) if args.prefix else ''
+    try:
+        write_host_summary(results, '{}charm-hosts.tsv'.format(prefix))
+        write_host_sequences(results, '{}charm-hosts.fasta'.format(prefix))
+        logger.info('Ranking written to {0}charm-hosts.tsv, harmonized sequences to {0}charm-hosts.fasta'.format(
+            prefix))
+    except IOError as error:
+        logger.error('ERROR: Cannot write results: {}'.format(error))
+
+    if args.profile:
+        log_profile(logger, metrics, sequence)
+
+
+def recommend_hosts(args, logger, metrics, sequence):
+    """
+    Log the hosts of the index given by --recommend_hosts whose codon usage is closest to the origin, weighted by the
+    codons of the sequence
+
+    :param args:        parsed command line arguments
+    :param logger:      logger instance
+    :param metrics:     LibCharm.Metrics.Metrics object of the run
+    :param sequence:    LibCharm.Sequence object with the codon usage table of the origin
+    """
+    try:
+        with metrics.timer('host_index'):
+            index = HostIndex.load(args.recommend_hosts)
+            hosts = index.closest(sequence.usage_origin, k=args.top, sequence=sequence.original_sequence)
+    except (IOError, ValueError, KeyError) as error:
+        logger.error('ERROR: Cannot read host recommendation index: {}'.format(error))
+        exit(1)
+
+    lines = ['{:>5} {:>10} {:>6} {:>10}'.format('rank', 'host', 'table', 'distance')]
+    for rank, (species, translation_table, distance) in enumerate(hosts, 1):
+        lines.append('{:>5} {:>10} {:>6} {:>10.4f}'.format(rank, species, translation_table, distance))
+    logger.info('HOSTS of {} species closest to the codon usage of the origin ({} codons):\n\n{}\n'.format(
+        len(index), len(sequence.original_sequence) // 3, '\n'.join(lines)))
+    logger.info('Harmonize for the best candidates with --hosts to compare the harmonized sequences.')
+
+    if args.profile:
+        log_profile(logger, metrics, sequence)
+
+
+def log_usage_profiles(args, logger, metrics, sequence):
+    """
+    Compute the sliding-window profiles of the codon usage of the original and harmonized sequence, log a summary
+    and write them to '<prefix>_charm-profiles.tsv'
+
+    :param args:        parsed command line arguments
+    :param logger:      logger instance
+    :param metrics:     LibCharm.Metrics.Metrics object of the run
+    :param sequence:    LibCharm.Sequence object
+    """
+    with metrics.timer('profiles'):
+        profiles = sequence_profiles(sequence, args.usage_window, args.usage_step)
+
+    def mean(values):
+        values = values[~numpy.isnan(values)]
+        return '{:.4f}'.format(values.mean()) if len(values) else ''
+
+    lines = ['{:<12} {:>10} {:>10}'.format('', 'original', 'harmonized'),
+             '{:<12} {:>10} {:>10}'.format('%MinMax', mean(profiles['minmax_origin']), mean(profiles['minmax_host'])),
+             '{:<12} {:>10} {:>10}'.format('CAI', mean(profiles['cai_origin']), mean(profiles['cai_host'])),
+             '{:<12} {:>10} {:>10}'.format('mean df', mean(profiles['mean_initial_df']),
+                                           mean(profiles['mean_final_df']))]
+    logger.info('PROFILES of {} windows of {} codons (mean of all windows):\n\n{}\n'.format(
+        len(profiles['start']), profiles['end'][0] - profiles['start'][0] if len(profiles['start']) else 0,
+        '\n'.join(lines)))
+    if len(profiles['start']) and not numpy.isnan(profiles['mean_final_df']).all():
+        worst = int(numpy.nanargmax(profiles['mean_final_df']))
+        logger.info('Highest mean df of a window: {:.4f} (codons {} ... {})\n'.format(
+            profiles['mean_final_df'][worst], profiles['start'][worst] + 1, profiles['end'][worst]))
+
+    if args.prefix:
+        profile_filename = '{}_charm-profiles.tsv'.format(args.prefix)
+    else:
+        profile_filename = 'charm-profiles.tsv'
+    try:
+        write_profiles([profiles], profile_filename)
+        logger.info('Codon usage profiles written to {}\n'.format(profile_filename))
+    except IOError as error:
+        logger.error('ERROR: Cannot write codon usage profiles: {}'.format(error))
+
+
 def initialize_logger(prefix):
     """
     Initialization of logging subsystem. Two logging handlers are brought up:
@@ -304,8 +798,15 @@ def main():
 
     # Parse command line arguments
     args = parse_arguments()
+    # Profile the whole run if requested; the statistics are written when charm-cli exits
+    if args.cprofile:
+        profiler = cProfile.Profile()
+        atexit.register(write_profile, profiler, args.cprofile)
+        profiler.enable()
     # Initialize logging
     logger = initialize_logger(args.prefix)
+    # Time spent on the steps of the run and the stages of the harmonization
+    metrics = Metrics('charm-cli')
 
     # Set translation tables according to user input. Defaults to standard genetic code (table 1)
     if args.translation_table_origin:
@@ -318,26 +819,94 @@ def main():
     else:
         translation_table_host = 1
 
-    # set threshold if provided by the user and otherwise fall back to defaults
-    if args.threshold:
-        lower_threshold = args.threshold
-    elif args.frequency:
-        lower_threshold = 5
-    else:
-        lower_threshold = 0.1
+    # set threshold if provided by the user; otherwise Sequence falls back to the default of fractions or frequencies
+    lower_threshold = args.threshold
+
+    # set up the persistent cache for codon usage tables unless disabled by the user
+    cache = None
+    if not args.no_cache:
+        cache_ttl = None
+        if args.cache_ttl is not None:
+            cache_ttl = args.cache_ttl * 3600
+        cache = TableCache(args.cache_dir, ttl=cache_ttl)
+    elif args.offline and not (args.store or args.database):
+        logger.error('ERROR: Offline mode requires the cache, a table store or a database; do not combine --offline '
+                     'with --no_cache.')
+        exit(1)
+
+    # load tables from the table store or database if provided
+    registry = None
+    if args.store or args.database:
+        store = None
+        database = None
+        try:
+            if args.store:
+                if not os.path.isfile(args.store):
+                    raise IOError('Table store {} does not exist.'.format(args.store))
+                store = TableStore(args.store)
+            if args.database:
+                database = CodonUsageDatabase(args.database)
+        except (IOError, ValueError) as error:
+            logger.error('ERROR: {}'.format(error))
+            exit(1)
+        registry = TableRegistry(store=store, database=database)
+
+    # harmonize all genes of annotated genomes and plasmids
+    if args.input_format != 'fasta':
+        harmonize_annotated_file(args, logger, metrics,
+                                 translation_table_origin=translation_table_origin,
+                                 translation_table_host=translation_table_host,
+                                 use_frequency=args.frequency,
+                                 lower_threshold=lower_threshold,
+                                 lower_alternative=args.lower_frequency_alternative,
+                                 cache=cache,
+                                 offline=args.offline,
+                                 registry=registry)
+        exit(0)
 
     # initialize Sequence object with user provided input
-    sequence = Sequence(IO.load_file(args.input), args.origin, args.host,
-                        translation_table_origin=translation_table_origin,
-                        translation_table_host=translation_table_host,
-                        use_frequency=args.frequency,
-                        lower_threshold=lower_threshold,
-                        lower_alternative=args.lower_frequency_alternative)
+    try:
+        with metrics.timer('read_input'):
+            original_sequence = IO.load_file(args.input)
+        sequence = Sequence(original_sequence, args.origin, args.host,
+                            translation_table_origin=translation_table_origin,
+                            translation_table_host=translation_table_host,
+                            use_frequency=args.frequency,
+                            lower_threshold=lower_threshold,
+                            lower_alternative=args.lower_frequency_alternative,
+                            cache=cache,
+                            offline=args.offline,
+                            registry=registry,
+                            metrics=metrics)
+        # load the codon usage tables here, so failures are reported before any output is written
+        sequence.load_usage_tables()
+    except (CacheMissError, FetchError, ValueError) as error:
+        logger.error('ERROR: {}'.format(error))
+        exit(1)
+
+    # compare the harmonization with a grid of settings
+    if args.sweep:
+        sweep_settings(args, logger, metrics, sequence)
+        exit(0)
+
+    # look up the hosts closest to the origin in an index of many species
+    if args.recommend_hosts:
+        recommend_hosts(args, logger, metrics, sequence)
+        exit(0)
+
+    # harmonize for several hosts and rank them
+    if args.hosts:
+        compare_hosts(args, logger, metrics, sequence)
+        exit(0)
 
     # harmonize the provided sequence
-    harmonized_codons = sequence.get_harmonized_codons()
-    # check if input and output sequence are identical
-    verify_sequence = sequence.verify_harmonized_sequence()
+    try:
+        harmonized_codons = sequence.get_harmonized_codons()
+        # check if input and output sequence are identical
+        verify_sequence = sequence.verify_harmonized_sequence()
+    except ValueError as error:
+        logger.error('ERROR: {}'.format(error))
+        exit(1)
 
     # log summary to standard output and log file
     logger.info('SUMMARY:\n')
@@ -347,61 +916,69 @@ def main():
         logger.info(text)
     else:
         logger.error('ERROR: Translations of harmonized and original sequence DO NOT match!')
+        for mismatch in sequence.get_mismatches():
+            logger.error('Codon {}: {} ({}) was replaced by {} ({})'.format(
+                mismatch['position'], mismatch['original'], mismatch['original_aa'], mismatch['new'],
+                mismatch['new_aa']))
     logger.info('Harmonized codons: {}\n'.format(len(harmonized_codons)))
 
-    df_above_thresh = 0
-    for c in sequence.codons:
-        if c['final_df'] > 0.2:
-            df_above_thresh += 1
+    if cache:
+        for name, table in (('origin', sequence.usage_origin), ('host', sequence.usage_host)):
+            if table.from_cache:
+                logger.info('Codon usage table of {} organism loaded from cache '
+                            '(age: {:.1f} h)'.format(name, table.cache_age / 3600))
+            else:
+                logger.info('Codon usage table of {} organism fetched from server'.format(name))
+        statistics = cache.statistics()
+        logger.info('Cache: {} hits, {} misses, {} tables stored in {}\n'.format(statistics['hits'],
+                                                                                  statistics['misses'],
+                                                                                  statistics['entries'],
+                                                                                  cache.directory))
+
+    threshold = difference_threshold(sequence)
+    threshold_text = '{} per 1000'.format(threshold) if sequence.use_frequency else '{:g}%'.format(threshold * 100)
+    df_above_thresh = int(numpy.count_nonzero(sequence.codons.final_df > threshold))
 
     if df_above_thresh > 0:
-        logger.warning("WARNING: Difference in origin and target host codon usage of {} out of {} codons ({}%) exceeds 20%!\n".format(df_above_thresh,
+        logger.warning("WARNING: Difference in origin and target host codon usage of {} out of {} codons ({}%) exceeds {}!\n".format(df_above_thresh,
                                                                                                                                       len(sequence.codons),
-                                                                                                                                      round(df_above_thresh/len(sequence.codons)*100, 1)))
+                                                                                                                                      round(df_above_thresh/len(sequence.codons)*100, 1),
+                                                                                                                                      threshold_text))
     else:
-        logger.info("Differences of codon usage in origin and target host are within 20%.\n")
-
-    table_header = '{:<10} {:^3} {:^4}    {:^4} {:^7} {:>6} {:<7} {:>6}'.format('position', 'aa', 'orig', 'new',
-                                                                                'initial', 'final', 'origin', 'target')
-    logger.info(table_header)
-
-    warnings = []
+        logger.info("Differences of codon usage in origin and target host are within {}.\n".format(threshold_text))
 
-    # Iterate over all codons in the sequence and print some statistics and information
-    for c in sequence.codons:
-        if str(c['original']) != str(c['new']):
-            line = '{:<10} {:^3} {:<4} -> {:<4} {:<5.2f} -> {:<3.2f}  {:<5.2f} -> {:<3.2f}'.format(c['position'],
-                                                                                                   c['aa'],
-                                                                                                   c['original'],
-                                                                                                   c['new'],
-                                                                                                   c['initial_df'],
-                                                                                                   c['final_df'],
-                                                                                                   c['origin_f'],
-                                                                                                   c['target_f'])
+    if args.output_format:
+        if args.prefix:
+            results_filename = '{}_charm-results.{}'.format(args.prefix, IO.RESULT_FORMATS[args.output_format])
         else:
-            line = '{:<10} {:^3} {:<12} {:<5.2f}          {:<5.2f} -> {:<3.2f}'.format(c['position'],
-                                                                                       c['aa'],
-                                                                                       c['original'],
-                                                                                       c['initial_df'],
-                                                                                       c['origin_f'],
-                                                                                       c['target_f'])
-        if c['ambiguous']:
-            line += ' WARNING: Original codon is ambiguous!'
-            warnings.append('Codon {} ({}) coding for {} is ambiguous! {} was chosen for the '
-                            'harmonized sequence!'.format(c['position'],
-                                                          c['original'],
-                                                          c['aa'],
-                                                          c['new']))
-
-        logger.info(line)
+            results_filename = 'charm-results.{}'.format(IO.RESULT_FORMATS[args.output_format])
+        try:
+            with metrics.timer('export'):
+                IO.write_results(sequence, results_filename, args.output_format)
+            logger.info('Results written to {}\n'.format(results_filename))
+        except IOError as error:
+            logger.error('ERROR: Cannot write results: {}'.format(error))
+
+    if args.usage_profiles:
+        log_usage_profiles(args, logger, metrics, sequence)
+
+    codons = sequence.codons
+    if args.quiet:
+        logger.info('Codon-harmonized sequence:\n\n{}'.format(sequence.harmonized_sequence))
+        ambiguous = int(numpy.count_nonzero(codons.ambiguous))
+        if ambiguous:
+            logger.warn('\nWARNING: {} codons of the original sequence are ambiguous!'.format(ambiguous))
+    else:
+        with metrics.timer('log'):
+            log_codons(logger, codons, sequence.harmonized_sequence)
 
-    logger.info('\nCodon-harmonized sequence:\n\n{}'.format(sequence.harmonized_sequence))
-    if warnings:
-        logger.warn('\nWARNINGS OCCURRED DURING HARMONIZATION:\n')
-        for warning in warnings:
-            logger.warn(warning)
+    if not args.no_plot:
+        with metrics.timer('plot'):
+            plot(sequence, args.prefix, plot_format=args.plot_format, detail=args.plot_detail,
+                 max_codons=args.max_plot_codons, window=args.window, codons_per_page=args.codons_per_page)
 
-    plot(sequence, args.prefix)
+    if args.profile:
+        log_profile(logger, metrics, sequence)
 
     # Exit gracefully
     exit(0)
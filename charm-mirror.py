@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+charm-mirror.py: Prefetches codon usage tables from http://www.kazusa.or.jp/codon into a local store.
+"""
+
+import argparse
+import logging
+
+try:
+    from LibCharm.CodonUsageTable import CodonUsageTable
+    from LibCharm.Fetcher import TableFetcher
+    from LibCharm.Hosts import HostIndex
+    from LibCharm.Mirror import TableStore, mirror, export_database
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+
+def read_species_file(filename, translation_table=1):
+    """
+    Read species ids from a file. Every line holds a species id and optionally the id of its genetic code,
+    separated by whitespace. Empty lines and lines starting with '#' are ignored.
+
+    :param filename:            path of the file
+    :param translation_table:   genetic code used for lines without one
+    :return requests:           list of (species, translation_table) tuples
+    """
+    requests = []
+    with open(filename, 'r') as species_file:
+        for line in species_file:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if len(fields) > 1:
+                requests.append((fields[0], int(fields[1])))
+            else:
+                requests.append((fields[0], translation_table))
+    return requests
+
+
+def parse_arguments():
+    """
+    Parse command line arguments and return list of arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--species_file', type=str,
+                        help='file with one species id and optionally the id of its translation table per line')
+    parser.add_argument('-t', '--translation_table', type=int, default=1,
+                        help='id of translation table used for species without one; Default is: standard genetic '
+                             'code = 1')
+    parser.add_argument('--store', type=str,
+                        help='path of the table store; Default is: ~/.cache/charm/tables.sqlite')
+    parser.add_argument('--export', type=str,
+                        help='write all tables of the store to a memory-mapped codon usage database file')
+    parser.add_argument('--index', type=str,
+                        help='write the codon usage of all species of the store to a host recommendation index '
+                             'file (.npz) for charm-cli.py --recommend_hosts')
+    parser.add_argument('--max_age', type=float,
+                        help='time in hours after which stored codon usage tables are fetched again; '
+                             'Default is: stored tables never expire')
+    parser.add_argument('--rate_limit', type=float, default=1.0,
+                        help='maximum number of requests per second sent to the server; Default is: 1')
+    parser.add_argument('--workers', type=int, default=4, help='number of concurrent requests; Default is: 4')
+    parser.add_argument('--retries', type=int, default=3, help='number of retries of failed requests; Default is: 3')
+    parser.add_argument('--timeout', type=float, default=30, help='timeout of requests in seconds; Default is: 30')
+    parser.add_argument('species', type=str, nargs='*', help='species ids taken from '
+                                                             '\'http://www.kazusa.or.jp/codon\' (e.g. \'83333\' '
+                                                             'for E. coli K12)')
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    """
+    Main function of charm-mirror.py.
+    """
+    args = parse_arguments()
+
+    logger = logging.getLogger('charm-mirror')
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+
+    requests = [(species, args.translation_table) for species in args.species]
+    if args.species_file:
+        try:
+            requests += read_species_file(args.species_file, args.translation_table)
+        except (IOError, ValueError) as error:
+            logger.error('ERROR: Cannot read species file: {}'.format(error))
+            exit(1)
+    if not requests and not (args.export or args.index):
+        logger.error('ERROR: No species ids given.')
+        exit(1)
+
+    max_age = None
+    if args.max_age is not None:
+        max_age = args.max_age * 3600
+
+    def report(key, error):
+        if error is None:
+            logger.info('Fetched species {} (translation table {})'.format(*key))
+        else:
+            logger.warning('WARNING: Failed to fetch species {} (translation table {}): {}'.format(key[0], key[1],
+                                                                                                  error))
+
+    store = TableStore(args.store)
+    fetcher = TableFetcher(max_workers=args.workers, timeout=args.timeout, retries=args.retries,
+                           rate_limit=args.rate_limit)
+    try:
+        summary = mirror(store, requests, fetcher, max_age=max_age, callback=report)
+        logger.info('\nFetched: {}, up to date: {}, failed: {}'.format(len(summary['fetched']),
+                                                                       len(summary['skipped']),
+                                                                       len(summary['failed'])))
+        if args.export:
+            logger.info('Exported {} tables to {}'.format(export_database(store, args.export), args.export))
+        if args.index:
+            index = HostIndex.from_tables(CodonUsageTable.from_store(store, species, translation_table)
+                                          for species, translation_table in store.keys())
+            index.save(args.index)
+            logger.info('Indexed {} tables in {}'.format(len(index), args.index))
+    finally:
+        fetcher.close()
+        store.close()
+
+    if summary['failed']:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+charm-server.py: Serves codon harmonization over HTTP/JSON on localhost or a Unix socket, keeping codon usage tables
+and replacement tables in memory between requests.
+"""
+
+import argparse
+import logging
+import os
+
+try:
+    from LibCharm.Cache import TableCache, CacheMissError
+    from LibCharm.CodonUsageTable import TableRegistry
+    from LibCharm.Database import CodonUsageDatabase
+    from LibCharm.Fetcher import FetchError
+    from LibCharm.Mirror import TableStore
+    from LibCharm.Service import HarmonizationService, ServiceServer, UnixServiceServer
+except ImportError as e:
+    print('ERROR: {}'.format(e.msg))
+    exit(1)
+
+
+def parse_arguments():
+    """
+    Parse command line arguments and return list of arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1',
+                        help='address the server listens on; Default is: 127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8642, help='port the server listens on; Default is: 8642')
+    parser.add_argument('--socket', type=str, help='listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--max_contexts', type=int, default=64,
+                        help='maximum number of origin/host pairs and options kept in memory; Default is: 64')
+    parser.add_argument('--preload', type=str, nargs='*', default=[],
+                        help='origin/host pairs loaded at startup as \'origin:host\' (e.g. \'83333:4227\')')
+    parser.add_argument('--cache_dir', type=str,
+                        help='directory in which codon usage tables are cached; Default is: ~/.cache/charm')
+    parser.add_argument('--no_cache', action='store_true', help='always fetch codon usage tables from the server')
+    parser.add_argument('--offline', action='store_true',
+                        help='never access the network; codon usage tables have to be present in the cache or the '
+                             'table store')
+    parser.add_argument('--store', type=str,
+                        help='table store created by charm-mirror.py; tables present in the store are never fetched')
+    parser.add_argument('--database', type=str,
+                        help='codon usage database exported by charm-mirror.py; tables present in the database are '
+                             'never fetched')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    return args
+
+
+def main():
+    """
+    Main function of charm-server.py.
+    """
+    args = parse_arguments()
+
+    logger = logging.getLogger('charm-server')
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+
+    cache = None
+    if not args.no_cache:
+        cache = TableCache(args.cache_dir)
+    elif args.offline and not (args.store or args.database):
+        logger.error('ERROR: Offline mode requires the cache, a table store or a database; do not combine --offline '
+                     'with --no_cache.')
+        exit(1)
+
+    store = None
+    database = None
+    try:
+        if args.store:
+            if not os.path.isfile(args.store):
+                raise IOError('Table store {} does not exist.'.format(args.store))
+            store = TableStore(args.store)
+        if args.database:
+            database = CodonUsageDatabase(args.database)
+    except (IOError, ValueError) as error:
+        logger.error('ERROR: {}'.format(error))
+        exit(1)
+
+    service = HarmonizationService(TableRegistry(store=store, database=database), cache=cache, offline=args.offline,
+                                   max_contexts=args.max_contexts)
+    for pair in args.preload:
+        try:
+            origin, host = pair.split(':')
+            service.context(service.key({'origin': origin, 'host': host}))
+        except ValueError:
+            logger.error('ERROR: Cannot parse \'{}\'; use \'origin:host\'.'.format(pair))
+            exit(1)
+        except (CacheMissError, FetchError) as error:
+            logger.error('ERROR: Cannot load the codon usage tables of {}: {}'.format(pair, error))
+            exit(1)
+        logger.info('Loaded codon usage tables of {}'.format(pair))
+
+    if args.socket:
+        server = UnixServiceServer(args.socket, service, args.verbose)
+        logger.info('Listening on {}'.format(args.socket))
+    else:
+        server = ServiceServer((args.host, args.port), service, args.verbose)
+        logger.info('Listening on http://{}:{}'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
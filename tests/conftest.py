@@ -0,0 +1,36 @@
+import importlib.util
+import logging
+import os
+
+import pytest
+
+from LibCharm.CodonUsageTable import registry
+from tests.kazusa_stub import KazusaStub
+
+
+@pytest.fixture
+def kazusa(monkeypatch):
+    """
+    Redirect codon usage table requests to a local stand-in server
+    """
+    registry.invalidate()
+    with KazusaStub() as stub:
+        monkeypatch.setattr('LibCharm.CodonUsageTable.KAZUSA_URL', stub.url)
+        yield stub
+    registry.invalidate()
+
+
+@pytest.fixture
+def cli():
+    """
+    Load charm-cli.py as module; the handlers of its logger are removed afterwards
+    """
+    spec = importlib.util.spec_from_file_location(
+        'charm_cli', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'charm-cli.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    yield module
+    logger = logging.getLogger('charm-cli')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
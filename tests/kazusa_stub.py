@@ -0,0 +1,101 @@
+"""Local stand-in for http://www.kazusa.or.jp/codon serving the canned codon usage tables in tests/kazusa"""
+import os
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+PAGES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kazusa')
+
+
+class KazusaHandler(BaseHTTPRequestHandler):
+    """
+    Answers showcodon.cgi requests with tests/kazusa/<species>_<aa>.html. Connections are kept alive. Requests for
+    /moved/... are redirected to /... and requests for /loop/... to themselves. Requests with an absolute URL (sent
+    to a proxy) are answered as well.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        path = urlparse(self.path).path
+        if path.startswith('/moved/') or path.startswith('/loop/'):
+            self.send_response(302)
+            self.send_header('Location', self.path.replace('/moved/', '/', 1))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        query = parse_qs(urlparse(self.path).query)
+        species = query.get('species', [''])[0]
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        with self.server.lock:
+            failures = self.server.failures.get(species, 0)
+            if failures:
+                self.server.failures[species] = failures - 1
+        if failures:
+            self.send_error(503)
+            return
+        filename = os.path.join(PAGES, '{}_{}.html'.format(query.get('species', [''])[0], query.get('aa', [''])[0]))
+        if not os.path.isfile(filename):
+            self.send_error(404)
+            return
+        with open(filename, 'rb') as page:
+            body = page.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    block_on_close = False
+
+
+class KazusaStub():
+    """
+    Runs KazusaHandler on a free port on localhost in a background thread
+    failures    - Dictionary; Number of requests per species id that are answered with HTTP 503 before succeeding
+    delay       - Float; Seconds every request is delayed
+    """
+
+    def __init__(self, failures=None, delay=0):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KazusaHandler)
+        self.server.requests = []
+        self.server.connections = 0
+        self.server.failures = {str(species): count for species, count in (failures or {}).items()}
+        self.server.delay = delay
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def connections(self):
+        return self.server.connections
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/codon/cgi-bin/showcodon.cgi?species={{}}&aa={{}}&style=N'.format(
+            self.server.server_port)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,101 @@
+import os
+
+import numpy
+import pytest
+
+from LibCharm import IO
+from LibCharm.Analysis import PROFILE_COLUMNS, gene_profiles, rolling_max, sequence_profiles, usage_profiles, \
+    usage_values, window_statistics, write_profiles
+from LibCharm.Codons import CODON_INDEX, encode_codons
+from LibCharm.CodonUsageTable import CodonUsageTable
+from LibCharm.Genome import harmonize_genome
+from LibCharm.Sequence import Sequence
+from tests.kazusa_stub import PAGES
+from tests.test_Genome import genome
+
+seq = IO.load_file('tests/test_sequence.fasta', file_format="fasta")
+
+
+def test_window_statistics():
+    values = numpy.random.RandomState(0).random_sample(101)
+    values[[3, 50, 51, 52]] = numpy.nan
+    for window in (1, 3, 7, 20, 101, 200):
+        for step in (None, 1, 5):
+            statistics = window_statistics(values, window, 0.5, step)
+            size = min(window, len(values))
+            assert statistics['start'][-1] + size == len(values)
+            for index, start in enumerate(statistics['start']):
+                part = values[start:start + size]
+                part = part[~numpy.isnan(part)]
+                if not len(part):
+                    assert numpy.isnan(statistics['mean'][index]) and numpy.isnan(statistics['max'][index])
+                    continue
+                assert numpy.isclose(statistics['mean'][index], part.mean())
+                assert statistics['max'][index] == part.max()
+                assert numpy.isclose(statistics['above'][index], (part > 0.5).mean())
+    assert numpy.isnan(window_statistics(values, 3, 0.5, 1)['max'][50])
+    assert numpy.array_equal(rolling_max([1, 3, 2, 0, 1], 2), [3, 3, 2, 1])
+    with pytest.raises(ValueError):
+        rolling_max([1, 2], 3)
+
+
+def test_usage_profiles():
+    origin = CodonUsageTable.from_file(os.path.join(PAGES, '83333_1.html'))
+    host = CodonUsageTable.from_file(os.path.join(PAGES, '4227_1.html'))
+    values = usage_values(origin)
+    leucine = [codon for codon in origin.usage_table['L']]
+    usage = [origin.usage_table['L'][codon]['f'] for codon in leucine]
+    assert values['adaptiveness'][CODON_INDEX[leucine[0]]] == max(usage[0] / max(usage), 0.01)
+    assert numpy.isnan(values['adaptiveness'][CODON_INDEX['ATG']])
+
+    # windows of the most and the least used codons
+    best = ''.join(max(codons, key=lambda codon: codons[codon]['f']) for aa, codons in origin.usage_table.items()
+                   if len(codons) > 1 and aa != '*')
+    worst = ''.join(min(codons, key=lambda codon: codons[codon]['f']) for aa, codons in origin.usage_table.items()
+                    if len(codons) > 1 and aa != '*')
+    indices = encode_codons(best + worst + 'ATGNNN')
+    n = len(best) // 3
+    profiles = usage_profiles(indices, indices, origin, host, window=n, step=n)
+    assert list(profiles['start']) == [0, n, n + 2]
+    assert numpy.allclose(profiles['minmax_origin'][:2], [100, -100])
+    assert profiles['cai_origin'][0] == 1
+    assert numpy.isclose(profiles['cai_origin'][1], numpy.exp(numpy.log(values['adaptiveness'][indices[n:2 * n]])
+                                                              .mean()))
+    assert numpy.allclose(profiles['mean_final_df'], profiles['mean_initial_df'])
+
+
+def test_sequence_profiles(kazusa, tmpdir):
+    sequence = Sequence(seq, 83333, 4227)
+    profiles = sequence_profiles(sequence, window=18)
+    codons = sequence.codons
+    assert len(profiles['start']) == len(codons) - 17
+    assert numpy.isclose(profiles['mean_final_df'][5], numpy.nanmean(codons.final_df[5:23]))
+    # the profile of the harmonized sequence in the host follows the profile of the original sequence in the origin
+    unharmonized = usage_profiles(codons.original, codons.original, sequence.usage_origin, sequence.usage_host)
+    assert numpy.nanmean(numpy.abs(profiles['minmax_host'] - profiles['minmax_origin'])) < \
+        numpy.nanmean(numpy.abs(unharmonized['minmax_host'] - unharmonized['minmax_origin']))
+    write_profiles([profiles], str(tmpdir.join('profiles.tsv')))
+    lines = tmpdir.join('profiles.tsv').readlines()
+    assert lines[0].rstrip('\n').split('\t') == list(PROFILE_COLUMNS)
+    assert lines[1].split('\t')[:2] == ['1', '18'] and len(lines) == len(profiles['start']) + 1
+
+
+def test_gene_profiles():
+    record = genome()
+    origin = CodonUsageTable.from_file(os.path.join(PAGES, '83333_1.html'))
+    host = CodonUsageTable.from_file(os.path.join(PAGES, '4227_1.html'))
+    records, genes = harmonize_genome([record], origin, host)
+    profiles = list(gene_profiles([record], records, genes, origin, host, window=10, step=10))
+    assert [gene['gene'] for gene, profile in profiles] == ['forward', 'reverse', 'joined', 'overlapping']
+    for gene, profile in profiles:
+        assert profile['end'][-1] == gene['codons']
+
+
+def test_write_profiles_undefined_values(tmpdir):
+    profile = {column: numpy.array([0.5, numpy.nan]) for column in PROFILE_COLUMNS[2:]}
+    profile.update(start=numpy.array([0, 1]), end=numpy.array([2, 3]))
+    profile['minmax_origin'][0] = numpy.nan
+    write_profiles([profile], str(tmpdir.join('profiles.tsv')), names=['nan'])
+    lines = [line.rstrip('\n').split('\t') for line in tmpdir.join('profiles.tsv').readlines()[1:]]
+    assert lines[0] == ['nan', '1', '2', ''] + ['0.5'] * (len(PROFILE_COLUMNS) - 3)
+    assert lines[1] == ['nan', '2', '3'] + [''] * (len(PROFILE_COLUMNS) - 2)
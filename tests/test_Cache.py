@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+import pytest
+
+from LibCharm.Cache import TableCache, CacheMissError
+from LibCharm.CodonUsageTable import CodonUsageTable
+
+
+def test_cache_hit(kazusa, tmpdir):
+    cache = TableCache(str(tmpdir))
+    fetched = CodonUsageTable.from_kazusa(83333, cache=cache)
+    cached = CodonUsageTable.from_kazusa(83333, cache=cache)
+    assert len(kazusa.requests) == 1
+    assert not fetched.from_cache and cached.from_cache
+    assert cached.usage_table == fetched.usage_table
+    assert cached.cache_statistics()['hits'] == 1 and cached.cache_statistics()['misses'] == 1
+
+
+def test_cache_key_includes_frequency(kazusa, tmpdir):
+    cache = TableCache(str(tmpdir))
+    fraction = CodonUsageTable.from_kazusa(83333, cache=cache)
+    frequency = CodonUsageTable.from_kazusa(83333, use_frequency=True, cache=cache)
+    assert len(kazusa.requests) == 2
+    assert fraction.usage_table != frequency.usage_table
+    assert cache.statistics()['entries'] == 2
+
+
+def test_cache_ttl(kazusa, tmpdir):
+    cache = TableCache(str(tmpdir), ttl=60)
+    CodonUsageTable.from_kazusa(83333, cache=cache)
+    path = cache.path(TableCache.key(83333, 1))
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    table = CodonUsageTable.from_kazusa(83333, cache=cache)
+    assert not table.from_cache
+    assert len(kazusa.requests) == 2
+
+
+def test_offline(kazusa, tmpdir):
+    cache = TableCache(str(tmpdir), ttl=60)
+    with pytest.raises(CacheMissError):
+        CodonUsageTable.from_kazusa(83333, cache=cache, offline=True)
+    CodonUsageTable.from_kazusa(83333, cache=cache)
+    path = cache.path(TableCache.key(83333, 1))
+    os.utime(path, (time.time() - 120, time.time() - 120))
+    # stale tables are still used in offline mode
+    table = CodonUsageTable.from_kazusa(83333, cache=cache, offline=True)
+    assert table.from_cache and table.cache_age >= 120
+    assert len(kazusa.requests) == 1
+
+
+def test_cache_concurrent_store(tmpdir):
+    cache = TableCache(str(tmpdir))
+    key = TableCache.key(83333, 1, False)
+    errors = []
+
+    def store(value):
+        try:
+            for _ in range(20):
+                cache.store(key, {'A': {'GCT': {'f': value}}})
+        except OSError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=store, args=(value,)) for value in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert os.listdir(str(tmpdir)) == [os.path.basename(cache.path(key))]
+    assert cache.load(key)[0]['A']['GCT']['f'] in range(8)
@@ -1,4 +1,13 @@
-from LibCharm.CodonUsageTable import CodonUsageTable
+import io
+import os
+import pickle
+import threading
+
+import pytest
+
+from LibCharm.CodonUsageTable import CodonUsageTable, TableRegistry, TableParseError, parse_kazusa_table, \
+    extract_table
+from tests.kazusa_stub import PAGES
 
 
 def test_codonusagetable_fraction():
@@ -7,4 +16,68 @@ def test_codonusagetable_fraction():
 
 def test_codonusagetable_frequency():
     assert CodonUsageTable('http://www.kazusa.or.jp/codon/cgi-bin/showcodon.cgi?species=83333&aa=1&style=N',
-                           use_frequency=True)
\ No newline at end of file
+                           use_frequency=True)
+
+def test_codonusagetable_frozen(kazusa):
+    table = CodonUsageTable.from_kazusa(83333).freeze()
+    with pytest.raises(TypeError):
+        table.usage_table['F']['TTT']['f'] = 1.0
+    with pytest.raises(TypeError):
+        table.add_to_table('TTT', 'F', 1.0)
+    assert pickle.loads(pickle.dumps(table)).usage_table == table.usage_table
+
+
+def test_registry_shares_tables(kazusa):
+    registry = TableRegistry(max_size=2)
+    tables = []
+
+    def get():
+        tables.append(registry.get(83333))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(kazusa.requests) == 1
+    assert all(table is tables[0] for table in tables)
+    assert registry.hits == 7 and registry.misses == 1
+
+
+def test_registry_lru(kazusa):
+    registry = TableRegistry(max_size=2)
+    registry.get(83333)
+    registry.get(4227)
+    registry.get(83333)
+    registry.get(83333, use_frequency=True)
+    assert TableRegistry.key(4227) not in registry
+    assert len(registry) == 2
+    registry.invalidate(use_frequency=True)
+    assert len(registry) == 1
+    registry.invalidate()
+    assert len(registry) == 0
+
+
+def test_parse_kazusa_table_tokens():
+    entries = parse_kazusa_table('UUU F 0.57 100.3 (1234567)  UCU S 0.11  5.7 (    29)')
+    assert entries == [('TTT', 'F', 0.57, 100.3, 1234567), ('TCT', 'S', 0.11, 5.7, 29)]
+    with pytest.raises(TableParseError):
+        parse_kazusa_table('Not found')
+
+
+def test_extract_table_chunks():
+    page = open(os.path.join(PAGES, '83333_1.html'), 'rb').read()
+    assert extract_table(io.BytesIO(page), chunk_size=7) == extract_table(io.BytesIO(page))
+    assert extract_table(io.BytesIO(b'UUU 19.7(   101)')) == 'UUU 19.7(   101)'
+
+
+def test_codonusagetable_from_file():
+    html = CodonUsageTable.from_file(os.path.join(PAGES, '83333_1.html'))
+    text = CodonUsageTable.from_file(os.path.join(PAGES, '83333_1.txt'))
+    spsum = CodonUsageTable.from_file(os.path.join(PAGES, 'example.spsum'), file_format='spsum', species=83333)
+    assert len(html.usage_table) == 21 and sum(len(codons) for codons in html.usage_table.values()) == 64
+    assert text.usage_table == html.usage_table
+    assert spsum.usage_table == html.usage_table
+    frequencies = CodonUsageTable.from_file(os.path.join(PAGES, '83333_1.txt'), use_frequency=True)
+    assert frequencies.usage_table == CodonUsageTable.from_file(os.path.join(PAGES, '83333_1.html'),
+                                                                use_frequency=True).usage_table
@@ -0,0 +1,94 @@
+import numpy
+import pytest
+
+from Bio.Alphabet import IUPAC
+from Bio.Data import CodonTable
+from Bio.Seq import Seq
+
+from LibCharm.Codons import CODONS, CODON_INDEX, EXPANSIONS, N_CODONS, N_UNAMBIGUOUS, NO_CODON, AmbiguityIndex, \
+    CodonRecord, encode_codons, decode_codons, genetic_code, synonymous_codons, translate_codons
+
+
+def test_codon_table():
+    assert N_CODONS == 15 ** 3
+    assert len(set(CODONS)) == N_CODONS
+    assert all(set(codon) <= set('TCAG') for codon in CODONS[:N_UNAMBIGUOUS])
+
+
+def test_encode_decode():
+    indices = encode_codons('ATGGCNtaa')
+    assert indices.dtype == numpy.uint16
+    assert [CODONS[i] for i in indices] == ['ATG', 'GCN', 'TAA']
+    assert decode_codons(indices) == 'ATGGCNTAA'
+    assert (encode_codons('AUGUAA') == encode_codons('ATGTAA')).all()
+
+
+def test_encode_invalid():
+    with pytest.raises(ValueError):
+        encode_codons('ATGC')
+    with pytest.raises(ValueError):
+        encode_codons('ATGXAA')
+
+
+def test_codon_record():
+    record = CodonRecord(encode_codons('ATGGCNTAA'), 'MA*')
+    assert len(record) == 3
+    assert record[1]['original'] == 'GCN' and record[1]['aa'] == 'A' and record[-1]['position'] == 3
+    assert record[0]['new'] is None and record[0]['final_df'] is None
+    record[0]['new'] = 'ATG'
+    record[0]['final_df'] = 0.5
+    assert record.new[0] == CODONS.index('ATG') and record.final_df[0] == 0.5
+    assert dict(record[0])['final_df'] == 0.5
+    assert record.amino_acids() == 'MA*'
+    assert list(record.new_codons()) == ['ATG', '', '']
+
+
+def test_codon_record_select():
+    record = CodonRecord(encode_codons('ATGGCNTAA'), 'MA*')
+    record.new[:] = record.original
+    record.ambiguous[1] = True
+    changed = record.select(record.changed())
+    assert len(changed) == 1 and changed[0]['position'] == 2
+    assert [codon['original'] for codon in record[1:]] == ['GCN', 'TAA']
+
+
+def test_translate_codons():
+    assert genetic_code(11) is genetic_code(CodonTable.ambiguous_dna_by_id[11])
+    for sequence in ('ATGGCNTTYCAGTAA', 'GTGAAAYTNTGA', 'ATGTAAGCCTAG', 'AAAGCCTAA', 'ATGAAATTT', 'ATGTAA'):
+        for translation_table in (1, 2, 11):
+            for cds, to_stop in ((True, False), (False, True), (False, False)):
+                try:
+                    expected = str(Seq(sequence, IUPAC.ambiguous_dna).translate(table=translation_table, cds=cds,
+                                                                                to_stop=to_stop))
+                except CodonTable.TranslationError:
+                    with pytest.raises(CodonTable.TranslationError):
+                        translate_codons(encode_codons(sequence), translation_table, cds, to_stop)
+                else:
+                    assert translate_codons(encode_codons(sequence), translation_table, cds, to_stop) == expected
+
+
+
+def test_synonymous_codons():
+    original = encode_codons('GTGGCNTGATAA')
+    new = encode_codons('TTGGCTTGAAAA')
+    assert list(synonymous_codons(original, new, 11)) == [False, True, True, False]
+    # GTG and TTG are start codons of the bacterial code, TGA codes for tryptophan in the mitochondrial code
+    assert list(synonymous_codons(original, new, 11, cds=True)) == [True, True, True, False]
+    assert list(synonymous_codons(original, new, 1, 2, cds=True)) == [False, True, False, False]
+    new[1] = NO_CODON
+    assert not synonymous_codons(original, new, 11)[1]
+
+def test_ambiguity_index():
+    usage_table = {'A': {'GCT': {'f': 0.3}, 'GCC': {'f': 0.1}, 'GCA': {'f': 0.3}, 'GCG': {'f': 0.3}},
+                   'N': {'AAT': {'f': 0.4}, 'AAC': {'f': 0.6}},
+                   'D': {'GAT': {'f': 0.2}, 'GAC': {'f': 0.8}}}
+    index = AmbiguityIndex(usage_table)
+    assert [CODONS[i] for i in EXPANSIONS[CODON_INDEX['RAY']]] == ['AAC', 'AAT', 'GAC', 'GAT']
+    # ties are resolved in the order of the expansion ('N' expands to 'GATC')
+    assert index.resolve('GCN') == (CODON_INDEX['GCG'], 0.3)
+    assert index.resolve('gcn', highest_f=False) == (CODON_INDEX['GCC'], 0.1)
+    assert index.resolve('SCN') is None
+    assert index.resolve('AAY') == (CODON_INDEX['AAC'], 0.6)
+    assert index.resolve('RAY') is None and index.amino_acids[CODON_INDEX['RAY']] == 0
+    assert chr(index.amino_acids[CODON_INDEX['AAY']]) == 'N'
+    assert index.resolve('GCT') == (CODON_INDEX['GCT'], 0.3)
@@ -0,0 +1,73 @@
+import os
+import pickle
+
+import numpy
+import pytest
+
+from LibCharm.Cache import CacheMissError
+from LibCharm.CodonUsageTable import CodonUsageTable, TableRegistry, parse_kazusa_table, extract_table
+from LibCharm.Codons import CODON_INDEX
+from LibCharm.Database import CodonUsageDatabase, write_database
+from LibCharm.Mirror import TableStore, mirror, export_database
+from tests.kazusa_stub import PAGES
+
+
+def load_entries(species):
+    with open(os.path.join(PAGES, '{}_1.html'.format(species)), 'rb') as page:
+        return parse_kazusa_table(extract_table(page))
+
+
+@pytest.fixture
+def database(tmpdir):
+    filename = os.path.join(str(tmpdir), 'tables.charm')
+    entries = {species: load_entries(species) for species in (83333, 4227)}
+    tables = [(species, 1, entries[83333 if species % 2 else 4227]) for species in range(1000)]
+    tables += [(83333, 1, entries[83333]), (4227, 1, entries[4227])]
+    assert write_database(filename, tables) == 1002
+    return CodonUsageDatabase(filename)
+
+
+def test_database_lookup(database):
+    assert len(database) == 1002
+    assert (83333, 1) in database and ('4227', 1) in database
+    assert (83333, 11) not in database and (1234567, 1) not in database
+    assert database.vector(83333)[CODON_INDEX['TTT']] == 0.21
+    assert database.vector(83333, use_frequency=True)[CODON_INDEX['TTT']] == 5.0
+    assert chr(database.amino_acid_codes(1)[CODON_INDEX['TAA']]) == '*'
+    assert isinstance(database.fraction, numpy.memmap) or isinstance(database.fraction.base, numpy.memmap)
+    with pytest.raises(KeyError):
+        database.vector(83333, 11)
+
+
+def test_table_from_database(kazusa, database):
+    for species in (83333, 4227):
+        for use_frequency in (False, True):
+            table = CodonUsageTable.from_database(database, species, use_frequency=use_frequency)
+            fetched = CodonUsageTable.from_kazusa(species, use_frequency=use_frequency)
+            # same content in the same order
+            assert [(aa, list(codons.items())) for aa, codons in table.usage_table.items()] == \
+                   [(aa, list(codons.items())) for aa, codons in fetched.usage_table.items()]
+    with pytest.raises(CacheMissError):
+        CodonUsageTable.from_database(database, 83333, 11)
+
+    kazusa.requests.clear()
+    registry = TableRegistry(database=database)
+    assert registry.get(4227).species == '4227'
+    assert not kazusa.requests
+
+
+def test_database_pickle(database):
+    copy = pickle.loads(pickle.dumps(database))
+    assert copy.filename == database.filename
+    assert numpy.array_equal(copy.frequency, database.frequency)
+    assert len(pickle.dumps(database)) < 1000
+
+
+def test_export_database(kazusa, tmpdir):
+    store = TableStore(os.path.join(str(tmpdir), 'tables.sqlite'))
+    mirror(store, [(83333, 1), (4227, 1)])
+    filename = os.path.join(str(tmpdir), 'tables.charm')
+    assert export_database(store, filename) == 2
+    database = CodonUsageDatabase(filename)
+    assert database.entries() == [('4227', 1), ('83333', 1)]
+    assert database.usage_table(83333) == CodonUsageTable.from_store(store, 83333).usage_table
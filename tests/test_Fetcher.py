@@ -0,0 +1,108 @@
+import socket
+import time
+
+import pytest
+
+from LibCharm.CodonUsageTable import CodonUsageTable, TableRegistry
+from LibCharm.Fetcher import MAX_REDIRECTS, TableFetcher, HTTPStatusError, ServerUnreachableError, RateLimiter
+from tests.kazusa_stub import KazusaStub
+
+
+def test_fetcher_reuses_connections():
+    fetcher = TableFetcher()
+    with KazusaStub() as stub:
+        pages = [fetcher.fetch(stub.url.format(83333, 1)) for _ in range(3)]
+    fetcher.close()
+    assert len(set(pages)) == 1 and b'<PRE>' in pages[0]
+    assert len(stub.requests) == 3
+    assert stub.connections == 1
+    assert fetcher.pool.created == 1
+
+
+def test_fetcher_retries_server_errors(kazusa):
+    kazusa.server.failures['83333'] = 2
+    table = CodonUsageTable.from_kazusa(83333, fetcher=TableFetcher(retries=2, backoff=0.01))
+    assert table.usage_table
+    assert len(kazusa.requests) == 3
+
+    fetcher = TableFetcher(retries=1, backoff=0.01)
+    with KazusaStub(failures={83333: 2}) as stub:
+        with pytest.raises(HTTPStatusError) as error:
+            fetcher.fetch(stub.url.format(83333, 1))
+    assert error.value.status == 503
+    assert len(stub.requests) == 2
+
+
+def test_fetcher_client_errors():
+    fetcher = TableFetcher(retries=3, backoff=0.01)
+    with KazusaStub() as stub:
+        with pytest.raises(HTTPStatusError) as error:
+            fetcher.fetch(stub.url.format(12345, 1))
+    # client errors are not retried
+    assert error.value.status == 404
+    assert len(stub.requests) == 1
+
+    # find a port nobody listens on
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    with pytest.raises(ServerUnreachableError):
+        TableFetcher(retries=1, backoff=0.01, timeout=1).fetch('http://127.0.0.1:{}/'.format(port))
+
+
+def test_fetcher_redirects():
+    fetcher = TableFetcher(retries=0)
+    with KazusaStub() as stub:
+        page = fetcher.fetch(stub.url.format(83333, 1).replace('/codon/', '/moved/codon/'))
+        assert page == fetcher.fetch(stub.url.format(83333, 1))
+        assert stub.requests[0].startswith('/moved/') and not stub.requests[1].startswith('/moved/')
+        with pytest.raises(HTTPStatusError) as error:
+            fetcher.fetch(stub.url.format(83333, 1).replace('/codon/', '/loop/codon/'))
+    assert error.value.status == 302
+    assert len(stub.requests) == 3 + MAX_REDIRECTS + 1
+
+
+def test_fetcher_proxy(monkeypatch):
+    fetcher = TableFetcher(retries=0)
+    url = 'http://kazusa.invalid/codon/cgi-bin/showcodon.cgi?species=83333&aa=1&style=N'
+    with KazusaStub() as stub:
+        monkeypatch.setenv('http_proxy', 'http://127.0.0.1:{}'.format(stub.server.server_port))
+        monkeypatch.delenv('no_proxy', raising=False)
+        assert fetcher.proxied(url)
+        assert b'<PRE>' in fetcher.fetch(url)
+        # the stub was asked for the page as proxy
+        assert stub.requests == [url]
+        monkeypatch.setenv('no_proxy', 'kazusa.invalid')
+        assert not fetcher.proxied(url)
+
+
+def test_fetcher_fetch_many():
+    fetcher = TableFetcher(max_workers=4)
+    with KazusaStub(delay=0.2) as stub:
+        start = time.monotonic()
+        pages = fetcher.fetch_many([stub.url.format(species, 1) for species in (83333, 4227, 83333, 4227)])
+        elapsed = time.monotonic() - start
+    assert elapsed < 0.6
+    assert pages[0] == pages[2] and pages[1] == pages[3] and pages[0] != pages[1]
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=20)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.wait('localhost')
+    assert time.monotonic() - start >= 0.19
+    # hosts are limited independently
+    start = time.monotonic()
+    limiter.wait('example.org')
+    assert time.monotonic() - start < 0.05
+
+
+def test_registry_get_many(kazusa):
+    kazusa.server.delay = 0.2
+    registry = TableRegistry()
+    start = time.monotonic()
+    origin, host = registry.get_many([(83333, 1, False), (4227, 1, False)])
+    assert time.monotonic() - start < 0.4
+    assert origin.species == '83333' and host.species == '4227'
+    assert registry.get(83333) is origin
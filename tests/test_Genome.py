@@ -0,0 +1,122 @@
+import os
+import random
+
+from Bio.Alphabet import IUPAC
+from Bio.Seq import Seq
+from Bio.SeqFeature import SeqFeature, FeatureLocation, CompoundLocation
+from Bio.SeqRecord import SeqRecord
+
+from LibCharm import IO
+from LibCharm.CodonUsageTable import CodonUsageTable
+from LibCharm.Genome import harmonize_coding_sequences, harmonize_genome, write_gene_summary, SUMMARY_COLUMNS
+from tests.kazusa_stub import PAGES
+
+SENSE = [a + b + c for a in 'TCAG' for b in 'TCAG' for c in 'TCAG' if a + b + c not in ('TAA', 'TAG', 'TGA')]
+
+
+def random_gene(rng, n_codons, start='ATG'):
+    return start + ''.join(rng.choice(SENSE) for _ in range(n_codons)) + 'TAA'
+
+
+def genome():
+    """
+    Record with genes on both strands, a joined gene, two overlapping genes, a pseudo gene and a partial gene
+    """
+    rng = random.Random(1)
+    forward = random_gene(rng, 100, 'GTG')
+    reverse = random_gene(rng, 80)
+    joined = random_gene(rng, 60)
+    overlapping = random_gene(rng, 50)
+    sequence = 'A' * 10 + forward + 'C' * 10 + str(Seq(reverse).reverse_complement()) + 'G' * 10 + \
+        joined[:90] + 'T' * 25 + joined[90:] + 'A' * 10 + overlapping + 'C' * 10 + random_gene(rng, 20) + 'A' * 10
+    position = 10
+    features = [SeqFeature(FeatureLocation(position, position + len(forward), strand=1), type='CDS',
+                           qualifiers={'locus_tag': ['forward']})]
+    position += len(forward) + 10
+    features.append(SeqFeature(FeatureLocation(position, position + len(reverse), strand=-1), type='CDS',
+                               qualifiers={'locus_tag': ['reverse']}))
+    position += len(reverse) + 10
+    features.append(SeqFeature(CompoundLocation([FeatureLocation(position, position + 90, strand=1),
+                                                 FeatureLocation(position + 115, position + 25 + len(joined),
+                                                                 strand=1)]),
+                               type='CDS', qualifiers={'locus_tag': ['joined']}))
+    position += len(joined) + 35
+    features.append(SeqFeature(FeatureLocation(position, position + len(overlapping), strand=1), type='CDS',
+                               qualifiers={'locus_tag': ['overlapping']}))
+    # a second reading frame overlapping the end of the previous gene
+    features.append(SeqFeature(FeatureLocation(position + len(overlapping) - 31, position + len(overlapping) - 1,
+                                               strand=1), type='CDS', qualifiers={'gene': ['inner'], 'pseudo': ['']}))
+    position += len(overlapping) + 10
+    features.append(SeqFeature(FeatureLocation(position, position + 64, strand=1), type='CDS',
+                               qualifiers={'locus_tag': ['partial']}))
+    return SeqRecord(Seq(sequence, IUPAC.unambiguous_dna), id='test', name='test', features=features,
+                     annotations={'molecule_type': 'DNA'})
+
+
+def translations(record):
+    return [str(feature.extract(record.seq).translate(table=11)) for feature in record.features[:4]]
+
+
+def test_harmonize_genome(tmpdir):
+    record = genome()
+    origin = CodonUsageTable.from_file(os.path.join(PAGES, '83333_1.html'))
+    host = CodonUsageTable.from_file(os.path.join(PAGES, '4227_1.html'))
+    records, genes = harmonize_genome([record], origin, host)
+    harmonized = records[0]
+
+    assert [gene['gene'] for gene in genes] == ['forward', 'reverse', 'joined', 'overlapping', 'inner', 'partial']
+    assert [gene['error'] is None for gene in genes] == [True, True, True, True, False, False]
+    assert all(gene['harmonized_codons'] > 0 for gene in genes[:4])
+    assert genes[3]['kept_overlapping_codons'] > 0
+    assert str(harmonized.seq) != str(record.seq) and len(harmonized.seq) == len(record.seq)
+    assert translations(harmonized) == translations(record)
+    # start codons and the regions of the pseudo and the partial gene are kept
+    assert str(harmonized.features[0].extract(harmonized.seq))[:3] == 'GTG'
+    for feature in record.features[4:]:
+        assert str(feature.extract(harmonized.seq)) == str(feature.extract(record.seq))
+    assert 'codon harmonized by CHarm' in harmonized.features[0].qualifiers['note'][0]
+    assert 'note' not in record.features[0].qualifiers
+
+    assert harmonize_genome([record], origin, host, processes=2)[1] == genes
+
+    IO.write_records(records, str(tmpdir.join('harmonized.gbk')))
+    assert str(next(IO.iterate_records(str(tmpdir.join('harmonized.gbk')), 'genbank')).seq) == str(harmonized.seq)
+    write_gene_summary(genes, str(tmpdir.join('genes.tsv')))
+    with open(str(tmpdir.join('genes.tsv'))) as summary_file:
+        assert summary_file.readline().rstrip('\n').split('\t') == list(SUMMARY_COLUMNS)
+        assert len(summary_file.readlines()) == len(genes)
+
+
+def test_harmonize_genome_frameshift():
+    # a gene reading one base twice (programmed ribosomal frameshift) in the codon TTG
+    gene = random_gene(random.Random(2), 30)
+    gene = gene[:30] + 'TTG' + gene[33:]
+    feature = SeqFeature(CompoundLocation([FeatureLocation(10, 41, strand=1),
+                                           FeatureLocation(40, 9 + len(gene), strand=1)]),
+                         type='CDS', qualifiers={'locus_tag': ['frameshift']})
+    record = SeqRecord(Seq('A' * 10 + gene[:31] + gene[32:] + 'A' * 10, IUPAC.unambiguous_dna), id='test',
+                       features=[feature], annotations={'molecule_type': 'DNA'})
+    assert str(feature.extract(record.seq)) == gene
+    origin = CodonUsageTable.from_file(os.path.join(PAGES, '83333_1.html'))
+    host = CodonUsageTable.from_file(os.path.join(PAGES, '4227_1.html'))
+    records, genes = harmonize_genome([record], origin, host)
+    harmonized = str(feature.extract(records[0].seq))
+    # the codon containing the base read twice is kept
+    assert harmonized[30:33] == 'TTG' and genes[0]['kept_overlapping_codons'] == 1
+    assert harmonized != gene and Seq(harmonized).translate() == Seq(gene).translate()
+
+
+def test_harmonize_coding_sequences_interleaved():
+    rng = random.Random(3)
+    genes = [random_gene(rng, 40) for _ in range(3)]
+    origin = CodonUsageTable.from_file(os.path.join(PAGES, '83333_1.html'))
+    host = CodonUsageTable.from_file(os.path.join(PAGES, '4227_1.html'))
+    expected = [[codons.new_codons().tolist() for codons in harmonize_coding_sequences(genes, *tables)]
+                for tables in ((origin, host), (host, origin))]
+    # generators consumed alternately do not overwrite each other's tables
+    forward, backward = harmonize_coding_sequences(genes, origin, host), harmonize_coding_sequences(genes, host, origin)
+    results = [[], []]
+    for first, second in zip(forward, backward):
+        results[0].append(first.new_codons().tolist())
+        results[1].append(second.new_codons().tolist())
+    assert results == expected and expected[0] != expected[1]
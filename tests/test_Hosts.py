@@ -0,0 +1,88 @@
+import os
+
+import numpy
+import pytest
+
+from LibCharm import IO
+from LibCharm.Codons import CODON_INDEX
+from LibCharm.CodonUsageTable import CodonUsageTable
+from LibCharm.Hosts import HOST_COLUMNS, HostIndex, harmonize_hosts, parse_host, usage_vector, write_host_sequences, \
+    write_host_summary
+from LibCharm.Sequence import Sequence
+from tests.kazusa_stub import PAGES
+
+seq = IO.load_file('tests/test_sequence.fasta', file_format="fasta")
+
+
+def test_harmonize_hosts(kazusa, tmpdir):
+    sequence = Sequence(seq, 83333, 4227)
+    local = CodonUsageTable.from_file(os.path.join(PAGES, '4227_1.html'))
+    results = harmonize_hosts(sequence, [4227, ('83333', 1), local])
+    # origin and host tables are fetched once and concurrently
+    assert len(kazusa.requests) == 2
+    assert [summary['rank'] for summary, harmonized in results] == [1, 2, 3]
+    assert [summary['host'] for summary, harmonized in results] == ['83333', '4227', 'host 3']
+    assert results[0][0]['mean_final_df'] < results[1][0]['mean_final_df']
+    for summary, harmonized in results:
+        assert summary['verified']
+        if summary['host'] != '83333':
+            assert str(harmonized.harmonized_sequence) == str(Sequence(seq, 83333, 4227).harmonized_sequence)
+    assert not sequence.metrics.timers
+    # hosts harmonized by worker processes get the tables of the calling process attached
+    parallel = harmonize_hosts(sequence, [4227, ('83333', 1), local], processes=2)
+    assert [summary for summary, harmonized in parallel] == [summary for summary, harmonized in results]
+    for (summary, harmonized), (_, expected) in zip(parallel, results):
+        assert str(harmonized.harmonized_sequence) == str(expected.harmonized_sequence)
+        assert harmonized.usage_host.usage_table == expected.usage_host.usage_table
+    assert len(kazusa.requests) == 2
+
+    write_host_summary(results, str(tmpdir.join('hosts.tsv')))
+    lines = tmpdir.join('hosts.tsv').readlines()
+    assert lines[0].rstrip('\n').split('\t') == list(HOST_COLUMNS)
+    assert len(lines) == 4
+    assert write_host_sequences(results, str(tmpdir.join('hosts.fasta'))) == 3
+
+    assert parse_host('4932:3') == ('4932', 3)
+    assert parse_host('4932', 11) == ('4932', 11)
+    with pytest.raises(ValueError):
+        parse_host('4932:x')
+
+
+def test_host_index(tmpdir):
+    tables = [CodonUsageTable.from_file(os.path.join(PAGES, '{}_1.html'.format(species))) for species in (83333, 4227)]
+    for species, table in zip(('83333', '4227'), tables):
+        table.species = species
+    vectors = [usage_vector(table) for table in tables]
+    assert numpy.allclose(usage_vector(CodonUsageTable.from_file(os.path.join(PAGES, '83333_1.html'),
+                                                                 use_frequency=True)), vectors[0], atol=0.01)
+    # a host with the codon usage of the origin and a host between origin and 4227
+    index = HostIndex.from_tables(tables)
+    index = HostIndex(list(index.species) + ['copy', 'between', 'other'], list(index.translation_tables) + [1, 1, 11],
+                      numpy.vstack([index.fractions, vectors[0], (vectors[0] + vectors[1]) / 2, vectors[0]]))
+    hosts = index.closest(tables[0], k=3)
+    assert [species for species, translation_table, distance in hosts] == ['copy', 'other', 'between']
+    assert hosts[0][2] == 0
+    assert index.closest(('83333', 1), k=2, translation_table=1) == index.closest(tables[0], k=2, translation_table=1)
+    assert [host[0] for host in index.closest(('83333', 1), k=10, translation_table=1)] == ['copy', 'between', '4227']
+
+    # codons weigh by their number in the gene, amino acids by their weight
+    difference = numpy.abs(vectors[0] - vectors[1])
+    weighted = dict((host[0], host[2]) for host in index.closest(tables[0], k=10, sequence='CTGCTGGCTNNN'))
+    assert numpy.isclose(weighted['4227'], (2 * difference[CODON_INDEX['CTG']] + difference[CODON_INDEX['GCT']]) / 3)
+    weighted = dict((host[0], host[2]) for host in index.closest(tables[0], k=10, amino_acid_weights={'L': 1}))
+    leucine = [CODON_INDEX[codon] for codon in ('TTA', 'TTG', 'CTT', 'CTC', 'CTA', 'CTG')]
+    assert numpy.isclose(weighted['4227'], difference[leucine].mean())
+    with pytest.raises(ValueError):
+        index.closest(tables[0], amino_acid_weights={})
+    with pytest.raises(KeyError):
+        index.closest(('1', 1))
+
+    # more equally distant hosts than k are cut by their rows in the index
+    ties = HostIndex(['far{}'.format(row) for row in range(20)] + ['near'], [1] * 21,
+                     numpy.vstack([vectors[1]] * 20 + [vectors[0]]))
+    assert [host[0] for host in ties.closest(tables[0], k=3)] == ['near', 'far0', 'far1']
+
+    index.save(str(tmpdir.join('hosts.npz')))
+    loaded = HostIndex.load(str(tmpdir.join('hosts.npz')))
+    assert len(loaded) == 5 and ('between', 1) in loaded
+    assert loaded.closest(tables[0], k=4) == index.closest(tables[0], k=4)
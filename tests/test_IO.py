@@ -1,5 +1,51 @@
+import json
+
+import numpy
+
 from LibCharm import IO
 
 
 def test_load_file():
     assert IO.load_file('tests/test_sequence.fasta', file_format="fasta")
+
+
+def test_iterate_records():
+    records = IO.iterate_records('tests/test_records.fasta', file_format="fasta")
+    assert [record.id for record in records] == ['gene{}'.format(i) for i in range(1, 7)]
+
+
+def test_write_results(kazusa, tmpdir):
+    from LibCharm.Sequence import Sequence
+
+    sequence = Sequence('ATGNNGGCNRAYGCCAAATAA', 83333, 4227)
+    tsv = IO.write_results(sequence, str(tmpdir.join('results.tsv')), 'tsv')
+    with open(tsv) as result_file:
+        lines = [line.rstrip('\n') for line in result_file if not line.startswith('#')]
+    assert lines[0].split('\t') == list(IO.result_columns(sequence))
+    assert len(lines) == len(sequence.codons) + 1
+    # ambiguous codons count as changed, as in the summary
+    assert lines[2].split('\t')[:6] == ['2', 'X', 'NNG', 'NNG', 'True', 'True']
+    assert lines[2].split('\t')[6:] == ['', '', '', '']
+
+    jsonl = IO.write_results(sequence, str(tmpdir.join('results.jsonl')), 'jsonl')
+    with open(jsonl) as result_file:
+        records = [json.loads(line) for line in result_file]
+    assert records[0]['record'] == 'summary' and records[0]['codons'] == len(sequence.codons)
+    assert records[0]['harmonized_sequence'] == str(sequence.harmonized_sequence)
+    assert [record['new'] for record in records[1:]] == sequence.codons.new_codons().tolist()
+    assert records[2]['final_df'] is None
+
+    npz = IO.write_results(sequence, str(tmpdir.join('results.npz')), 'npz')
+    with numpy.load(npz) as results:
+        assert dict(json.loads(str(results['summary'])), record='summary') == records[0]
+        assert numpy.array_equal(results['final_df'], sequence.codons.final_df, equal_nan=True)
+
+
+def test_result_summary(kazusa):
+    from LibCharm.Sequence import Sequence
+
+    for use_frequency, threshold in ((False, 0.2), (True, 5)):
+        sequence = Sequence(str(IO.load_file('tests/test_sequence.fasta')), 83333, 4227, use_frequency=use_frequency)
+        summary = IO.result_summary(sequence)
+        assert summary['codons_above_threshold'] == numpy.count_nonzero(sequence.codons.final_df > threshold)
+        assert summary['harmonized_codons'] == numpy.count_nonzero(IO.result_columns(sequence)['changed'])
@@ -0,0 +1,45 @@
+import pickle
+
+from LibCharm.CodonUsageTable import CodonUsageTable
+from LibCharm.Metrics import Metrics, add_sink, remove_sink
+from LibCharm.Sequence import Sequence
+
+
+def test_metrics():
+    events = []
+    metrics = Metrics('test', sinks=[lambda *event: events.append(event[1:])])
+    with metrics.timer('step'):
+        pass
+    with metrics.timer('step'):
+        pass
+    metrics.count('items', 2)
+    metrics.count('items')
+    metrics.set('size', 7)
+    assert metrics.timers['step']['calls'] == 2 and metrics.timers['step']['wall'] >= 0
+    assert metrics.counters == {'items': 3, 'size': 7}
+    assert [event[:2] for event in events] == [('timer', 'step'), ('timer', 'step'), ('counter', 'items'),
+                                               ('counter', 'items'), ('counter', 'size')]
+    assert 'step' in metrics.report() and 'items' in metrics.report()
+
+    copy = pickle.loads(pickle.dumps(metrics))
+    assert copy.as_dict() == metrics.as_dict() and copy.sinks == []
+
+
+def test_sequence_metrics(kazusa):
+    events = []
+
+    def sink(metrics, kind, name, value):
+        events.append((metrics.label, kind, name))
+
+    add_sink(sink)
+    try:
+        origin = CodonUsageTable.from_kazusa(83333)
+        sequence = Sequence('ATGGCNGCCAAATAA', origin, CodonUsageTable.from_kazusa(4227)).compute()
+    finally:
+        remove_sink(sink)
+    assert set(origin.metrics.timers) == {'fetch', 'parse'}
+    assert set(sequence.metrics.timers) >= {'encoding', 'codons', 'harmonization', 'verification'}
+    assert sequence.metrics.counters == {'codons_split': 5, 'codons_processed': 5, 'unique_codons': 5,
+                                         'ambiguous_codons': 1}
+    assert ('sequence', 'timer', 'harmonization') in events
+    assert ('codon usage table', 'timer', 'fetch') in events
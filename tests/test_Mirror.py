@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from LibCharm.Cache import CacheMissError
+from LibCharm.CodonUsageTable import CodonUsageTable, TableRegistry
+from LibCharm.Fetcher import TableFetcher
+from LibCharm.Mirror import TableStore, mirror
+
+
+def test_mirror_resumes(kazusa, tmpdir):
+    store = TableStore(os.path.join(str(tmpdir), 'tables.sqlite'))
+    fetcher = TableFetcher(retries=0)
+    summary = mirror(store, [(83333, 1), (12345, 1)], fetcher)
+    assert summary['fetched'] == [('83333', 1)]
+    assert summary['failed'] == [('12345', 1)]
+    assert len(store) == 1 and ('83333', 1) in store
+
+    kazusa.requests.clear()
+    summary = mirror(store, [(83333, 1), (4227, 1), ('4227', 1)], fetcher)
+    assert summary['skipped'] == [('83333', 1)]
+    assert summary['fetched'] == [('4227', 1)]
+    assert len(kazusa.requests) == 1
+
+    # stale tables are fetched again
+    store.put('83333', 1, store.get('83333', 1)[0], fetched=0)
+    summary = mirror(store, [(83333, 1), (4227, 1)], fetcher, max_age=3600)
+    assert summary['fetched'] == [('83333', 1)]
+    assert store.keys() == [('4227', 1), ('83333', 1)]
+
+
+def test_table_from_store(kazusa, tmpdir):
+    store = TableStore(os.path.join(str(tmpdir), 'tables.sqlite'))
+    mirror(store, [(83333, 1)])
+    for use_frequency in (False, True):
+        table = CodonUsageTable.from_store(store, 83333, use_frequency=use_frequency)
+        assert table.usage_table == CodonUsageTable.from_kazusa(83333, use_frequency=use_frequency).usage_table
+        assert table.cache_key == ('83333', 1, 'frequency' if use_frequency else 'fraction')
+    with pytest.raises(CacheMissError):
+        CodonUsageTable.from_store(store, 4227)
+
+    kazusa.requests.clear()
+    registry = TableRegistry(store=store)
+    assert registry.get(83333, offline=True).usage_table == CodonUsageTable.from_store(store, 83333).usage_table
+    assert registry.get(83333, use_frequency=True) is not registry.get(83333)
+    assert not kazusa.requests
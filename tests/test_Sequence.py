@@ -1,37 +1,210 @@
-from LibCharm.Sequence import Sequence
+import numpy
+import pytest
+
+from LibCharm.Sequence import Sequence, harmonize_records, MIN_CHUNK_SIZE
+from LibCharm.CodonUsageTable import CodonUsageTable, registry
 from LibCharm import IO
+from LibCharm.Cache import TableCache
+from LibCharm.Codons import CODON_INDEX, N_CODONS
 
 seq = IO.load_file('tests/test_sequence.fasta', file_format="fasta")
 
 
-def test_sequence_1():
-    assert Sequence(seq, 83333, 4227)
+def check_harmonization(sequence):
+    sequence.compute()
+    harmonized = str(sequence.harmonized_sequence)
+    assert len(harmonized) == len(seq) and harmonized != str(seq)
+    assert sequence.verify_harmonized_sequence()
+    assert str(sequence.harmonized_translated_sequence) == str(sequence.original_translated_sequence)
+
+
+def test_sequence_1(kazusa):
+    check_harmonization(Sequence(seq, 83333, 4227))
+
+
+def test_sequence_2(kazusa):
+    check_harmonization(Sequence(seq, 83333, 4227, strong_stop=False))
+
 
+def test_sequence_3(kazusa):
+    check_harmonization(Sequence(seq, 83333, 4227, use_frequency=True))
 
-def test_sequence_2():
-    assert Sequence(seq, 83333, 4227, strong_stop=False)
 
+def test_sequence_4(kazusa):
+    check_harmonization(Sequence(seq, 83333, 4227, use_replacement_table=False))
 
-def test_sequence_3():
-    assert Sequence(seq, 83333, 4227, use_frequency=True)
 
+def test_sequence_5(kazusa):
+    check_harmonization(Sequence(seq, 83333, 4227, lower_alternative=False))
 
-def test_sequence_4():
-    assert Sequence(seq, 83333, 4227, use_replacement_table=False)
 
+def test_sequence_6(kazusa):
+    check_harmonization(Sequence(seq, 83333, 4227, strong_stop=False, use_frequency=True))
 
-def test_sequence_5():
-    assert Sequence(seq, 83333, 4227, lower_alternative=False)
 
+def test_sequence_7(kazusa):
+    check_harmonization(Sequence(seq, 83333, 4227, strong_stop=False, use_frequency=True, use_replacement_table=False))
 
-def test_sequence_6():
-    assert Sequence(seq, 83333, 4227, strong_stop=False, use_frequency=True)
 
+def test_sequence_8(kazusa):
+    check_harmonization(Sequence(seq, 83333, 4227, strong_stop=False, use_frequency=True, use_replacement_table=False,
+                                 lower_alternative=False))
 
-def test_sequence_7():
-    assert Sequence(seq, 83333, 4227, strong_stop=False, use_frequency=True, use_replacement_table=False)
 
+def test_sequence_mismatches(kazusa):
+    sequence = Sequence(seq, 83333, 4227)
+    assert sequence.verify_harmonized_sequence() and sequence.get_mismatches() == []
+    # verification compares the codons and does not translate the sequences
+    assert 'original_translated_sequence' not in sequence._stages
+    assert 'harmonized_translated_sequence' not in sequence._stages
+    assert str(sequence.original_translated_sequence) == str(sequence.harmonized_translated_sequence)
+
+    sequence.codons.new[2] = CODON_INDEX['TGG']
+    sequence.invalidate('mismatches')
+    assert not sequence.verify_harmonized_sequence()
+    assert sequence.get_mismatches() == [{'position': 3, 'original': str(seq[6:9]), 'new': 'TGG',
+                                          'original_aa': str(seq[6:9].translate()), 'new_aa': 'W'}]
+
+    # a TTG start codon replaced by a codon that is no start codon changes the translation from 'M...' to 'L...'
+    sequence = Sequence('TTGCTGGCTAAAGAATAA', 83333, 4227)
+    assert str(sequence.harmonized_sequence)[:3] not in ('ATG', 'TTG', 'CTG', 'GTG')
+    assert not sequence.verify_harmonized_sequence()
+    assert [mismatch['position'] for mismatch in sequence.get_mismatches()] == [1]
 
-def test_sequence_8():
-    assert Sequence(seq, 83333, 4227, strong_stop=False, use_frequency=True, use_replacement_table=False,
-                    lower_alternative=False)
\ No newline at end of file
+def test_sequence_cached_tables(kazusa, tmpdir):
+    cache = TableCache(str(tmpdir))
+    Sequence(seq, 83333, 4227, cache=cache).compute()
+    registry.invalidate()
+    sequence = Sequence(seq, 83333, 4227, cache=cache, offline=True)
+    assert sequence.usage_origin.from_cache and sequence.usage_host.from_cache
+    assert len(kazusa.requests) == 2
+    assert sequence.verify_harmonized_sequence()
+
+
+def test_sequence_prebuilt_tables(kazusa):
+    origin = CodonUsageTable.from_kazusa(83333)
+    host = CodonUsageTable.from_kazusa(4227)
+    sequence = Sequence(seq, origin, host)
+    assert sequence.usage_origin is origin and sequence.usage_host is host
+    assert sequence.verify_harmonized_sequence()
+    with pytest.raises(ValueError):
+        Sequence(seq, origin, host, use_frequency=True).compute()
+
+
+def test_sequence_shared_tables(kazusa):
+    first = Sequence(seq, 83333, 4227).compute()
+    second = Sequence(seq, 83333, 4227, lower_alternative=False).compute()
+    assert first.usage_origin is second.usage_origin
+    assert len(kazusa.requests) == 2
+
+
+def test_sequence_replacement_table(kazusa):
+    compiled = Sequence(seq, 83333, 4227)
+    per_codon = Sequence(seq, 83333, 4227, use_replacement_table=False)
+    assert str(compiled.harmonized_sequence) == str(per_codon.harmonized_sequence)
+    assert [c['final_df'] for c in compiled.codons] == [c['final_df'] for c in per_codon.codons]
+    assert compiled.replacement_map['new'].shape == (N_CODONS,)
+
+
+def test_sequence_parallel_per_codon(kazusa):
+    # long enough to be split into several chunks, with ambiguous codons in between
+    long_seq = str(seq)[:-3] * 10 + 'GCNATHTAA'
+    serial = Sequence(long_seq, 83333, 4227, use_replacement_table=False)
+    parallel = Sequence(long_seq, 83333, 4227, use_replacement_table=False, processes=2)
+    assert len(serial.codons) >= 2 * MIN_CHUNK_SIZE
+    assert str(parallel.harmonized_sequence) == str(serial.harmonized_sequence)
+    assert list(parallel.codons.ambiguous) == list(serial.codons.ambiguous)
+    assert numpy.array_equal(parallel.codons.final_df, serial.codons.final_df, equal_nan=True)
+    assert parallel.metrics.counters['codon_chunks'] > 1
+
+
+def test_harmonize_records(kazusa):
+    records = IO.iterate_records('tests/test_records.fasta')
+    sequential = [(record.id, str(sequence.harmonized_sequence))
+                  for record, sequence in harmonize_records(records, 83333, 4227)]
+    records = IO.iterate_records('tests/test_records.fasta')
+    parallel = [(record.id, str(sequence.harmonized_sequence))
+                for record, sequence in harmonize_records(records, 83333, 4227, processes=2, max_in_flight=2)]
+    assert len(sequential) == 6
+    assert parallel == sequential
+    assert len(kazusa.requests) == 2
+
+    # the codon usage tables are not sent back by the workers, but attached again
+    usage_origin = registry.get(83333)
+    sequence = Sequence(seq, usage_origin, registry.get(4227)).compute()
+    state = sequence.__getstate__()
+    assert 'usage_origin' not in state['_stages'] and state['_origin_id'] == '83333'
+    records = IO.iterate_records('tests/test_records.fasta')
+    for record, sequence in harmonize_records(records, usage_origin, 4227, processes=2):
+        assert sequence.usage_origin is usage_origin and sequence.origin_id is usage_origin
+        # the translations are only computed on access
+        assert 'original_translated_sequence' not in sequence._stages
+        assert 'harmonized_translated_sequence' not in sequence._stages
+        assert sequence.verify_harmonized_sequence()
+        assert str(sequence.harmonized_translated_sequence) == str(sequence.original_translated_sequence)
+    assert len(kazusa.requests) == 2
+
+
+def test_sequence_lazy_stages(kazusa):
+    sequence = Sequence(seq, 83333, 4227)
+    assert sequence.original_translated_sequence
+    assert len(kazusa.requests) == 0
+    harmonized = str(sequence.harmonized_sequence)
+    assert len(kazusa.requests) == 2
+    codons = sequence.get_stage('codons')
+    sequence.lower_threshold = 0.3
+    assert 'harmonized_sequence' not in sequence._stages and 'original_translated_sequence' in sequence._stages
+    assert sequence.get_stage('codons') is codons
+    assert str(sequence.harmonized_sequence) == str(Sequence(seq, 83333, 4227, lower_threshold=0.3).harmonized_sequence)
+    sequence.lower_threshold = None
+    assert str(sequence.harmonized_sequence) == harmonized
+    assert sequence.verify_harmonized_sequence()
+
+
+def test_sequence_string():
+    sequence = Sequence('aug gcu uaa', 83333, 4227)
+    assert str(sequence.original_sequence) == 'ATGGCTTAA'
+    assert str(sequence.original_translated_sequence) == 'MA'
+
+
+def test_sequence_ambiguous_codons(kazusa):
+    origin = CodonUsageTable.from_kazusa(83333).freeze()
+    host = CodonUsageTable.from_kazusa(4227).freeze()
+    for use_replacement_table in (True, False):
+        sequence = Sequence('ATGNNGGCNATHRAYTAA', origin, host, use_replacement_table=use_replacement_table)
+        codons = sequence.codons
+        assert list(codons.ambiguous) == [False, True, True, True, True, False]
+        # codons coding for different amino acids are left in place
+        assert [codons[i]['new'] for i in (1, 4)] == ['NNG', 'RAY']
+        assert codons[1]['origin_f'] is None
+        # ambiguity at any position is resolved with the codon of highest usage in the origin organism
+        assert codons[2]['origin_f'] == origin.usage_table['A']['GCA']['f']
+        assert codons[3]['origin_f'] == origin.usage_table['I']['ATA']['f']
+        assert sequence.verify_harmonized_sequence()
+    assert origin.ambiguity_index() is origin.ambiguity_index()
+
+
+def test_sequence_edit_codons(kazusa):
+    for use_replacement_table in (True, False):
+        sequence = Sequence(seq, 83333, 4227, use_replacement_table=use_replacement_table).compute()
+        dna = str(seq)
+        for start, end, edit in ((10, 12, 'GCNTGGTGT'), (20, 20, 'ccc'), (30, 35, ''), (0, 1, 'GTG'),
+                                 (40, 41, 'TAA')):
+            sequence.edit_codons(start, end, edit)
+            dna = dna[:3 * start] + edit.upper() + dna[3 * end:]
+            edited = {stage: str(result) for stage, result in sequence._stages.items()
+                      if stage in ('original_translated_sequence', 'harmonized_sequence',
+                                   'harmonized_translated_sequence')}
+            fresh = Sequence(dna, 83333, 4227, use_replacement_table=use_replacement_table)
+            assert str(sequence.original_sequence) == dna
+            for stage, result in edited.items():
+                assert result == str(fresh.get_stage(stage))
+            assert str(sequence.harmonized_sequence) == str(fresh.harmonized_sequence)
+            assert list(sequence.codons.position) == list(range(1, len(dna) // 3 + 1))
+            assert numpy.array_equal(sequence.codons.final_df, fresh.codons.final_df, equal_nan=True)
+            assert sequence.verify_harmonized_sequence() == fresh.verify_harmonized_sequence()
+    assert sequence.metrics.timers['edit']['calls'] == 5
+    with pytest.raises(IndexError):
+        sequence.edit_codons(5, 4, 'ATG')
+    with pytest.raises(ValueError):
+        sequence.edit_codons(5, 6, 'AT')
@@ -0,0 +1,119 @@
+import json
+import threading
+from http.client import HTTPConnection
+
+import pytest
+
+from LibCharm import IO
+from LibCharm.CodonUsageTable import TableRegistry
+from LibCharm.Fetcher import FetchError
+from LibCharm.Sequence import Sequence
+from LibCharm.Service import HarmonizationService, RequestError, ServiceServer
+
+seq = str(IO.load_file('tests/test_sequence.fasta', file_format="fasta"))
+
+
+def post(server, path, content):
+    connection = HTTPConnection('127.0.0.1', server.server_address[1], timeout=30)
+    try:
+        if content is None:
+            connection.request('GET', path)
+        else:
+            connection.request('POST', path, json.dumps(content), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+
+
+def test_service(kazusa):
+    server = ServiceServer(('127.0.0.1', 0), HarmonizationService())
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    try:
+        expected = Sequence(seq, 83333, 4227).compute()
+        kazusa.server.delay = 0.05
+        requests = len(kazusa.requests)
+
+        # concurrent requests for the same pair load its tables only once
+        results = []
+        clients = [threading.Thread(target=lambda: results.append(post(server, '/harmonize', {
+            'sequence': seq, 'origin': 83333, 'host': '4227', 'id': 'single', 'codons': True}))) for _ in range(4)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        assert len(kazusa.requests) == requests
+        for status, result in results:
+            assert status == 200
+            assert result['id'] == 'single'
+            assert result['harmonized_sequence'] == str(expected.harmonized_sequence)
+            assert result['verified']
+            assert result['columns']['new'] == [str(codon) for codon in IO.result_columns(expected)['new']]
+            assert result['codons'] == len(expected.codons)
+
+        status, result = post(server, '/harmonize', {'requests': [
+            {'sequence': seq, 'origin': 83333, 'host': 4227},
+            {'sequence': seq, 'origin': 83333, 'host': 4227, 'lower_alternative': False},
+            {'sequence': seq[:-1], 'origin': 83333, 'host': 4227}]})
+        assert status == 200
+        first, second, failed = result['results']
+        assert first['harmonized_sequence'] == str(expected.harmonized_sequence)
+        assert second['harmonized_sequence'] == str(Sequence(seq, 83333, 4227, lower_alternative=False)
+                                                    .harmonized_sequence)
+        assert 'error' in failed
+
+        # a pair that cannot be loaded only fails the requests using it
+        status, result = post(server, '/harmonize', [{'sequence': seq, 'origin': 12345, 'host': 4227, 'id': 1},
+                                                     {'sequence': seq, 'origin': 83333, 'host': 4227, 'id': 2},
+                                                     {'sequence': seq, 'origin': 12345, 'host': 4227, 'id': 3}])
+        assert status == 200
+        assert [('error' in result, result['id']) for result in result['results']] == [(True, 1), (False, 2),
+                                                                                        (True, 3)]
+        assert result['results'][1]['harmonized_sequence'] == str(expected.harmonized_sequence)
+
+        assert post(server, '/harmonize', {'sequence': seq, 'origin': 83333})[0] == 400
+        assert post(server, '/harmonize', {'sequence': seq, 'origin': 83333, 'host': 4227, 'foo': 1})[0] == 400
+
+        status, statistics = post(server, '/metrics', None)
+        assert status == 200
+        assert statistics['requests'] == 6
+        assert statistics['sequences'] == 10
+        assert statistics['errors'] == 3
+        assert statistics['contexts'] == 2
+        assert statistics['metrics']['counters']['context_loads'] == 2
+        assert statistics['latency_ms']['max'] >= statistics['latency_ms']['p50'] > 0
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_service_context_failures(kazusa):
+    key = HarmonizationService.key({'origin': 83333, 'host': 4227, 'strong_stop': 'false', 'use_frequency': 'no'})
+    assert key == HarmonizationService.key({'origin': 83333, 'host': 4227, 'strong_stop': False})
+    for value in ('maybe', 2, None):
+        with pytest.raises(RequestError):
+            HarmonizationService.key({'origin': 83333, 'host': 4227, 'strong_stop': value})
+
+    # failed loads do not leave their locks behind
+    service = HarmonizationService(registry=TableRegistry())
+    with pytest.raises(FetchError):
+        service.context(service.key({'origin': 12345, 'host': 4227}))
+    assert service._loading == {} and service.registry._loading == {}
+
+
+def test_service_unexpected_errors():
+    class FailingService():
+        def harmonize(self, request):
+            raise KeyError(7)
+
+    server = ServiceServer(('127.0.0.1', 0), FailingService())
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    try:
+        # unexpected failures are answered instead of dropping the connection
+        status, result = post(server, '/harmonize', {'sequence': seq, 'origin': 83333, 'host': 4227})
+        assert status == 500 and result['error'] == 'KeyError: 7'
+    finally:
+        server.shutdown()
+        server.server_close()
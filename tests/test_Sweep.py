@@ -0,0 +1,43 @@
+import numpy
+import pytest
+
+from LibCharm import IO
+from LibCharm.Sequence import Sequence
+from LibCharm.Sweep import SWEEP_COLUMNS, parameter_grid, parse_grid, sweep, write_sweep
+
+seq = IO.load_file('tests/test_sequence.fasta', file_format="fasta")
+
+
+def test_sweep(kazusa, tmpdir):
+    sequence = Sequence(str(seq)[:-3] + 'GCNATHTAA', 83333, 4227)
+    grid = parse_grid(['lower_threshold=none,0.05,0.3', 'lower_alternative=yes,no', 'strong_stop=yes,no',
+                       'use_frequency=no,yes'])
+    assert len(grid) == 24
+    results = sweep(sequence, grid)
+    assert 'harmonization' not in sequence._stages
+    for setting, result in zip(grid, results):
+        expected = Sequence(sequence.original_sequence, 83333, 4227, **setting)
+        codons = expected.codons
+        assert result['lower_threshold'] == expected.lower_threshold
+        assert result['harmonized_codons'] == numpy.count_nonzero(codons.changed())
+        assert result['mean_final_df'] == pytest.approx(numpy.nanmean(codons.final_df))
+        assert result['max_final_df'] == pytest.approx(numpy.nanmax(codons.final_df))
+        assert result['verified'] == expected.verify_harmonized_sequence()
+    # the codon usage tables are fetched once for fractions and once for frequencies
+    assert len(kazusa.requests) == 4
+
+    write_sweep(results, str(tmpdir.join('sweep.tsv')))
+    lines = tmpdir.join('sweep.tsv').readlines()
+    assert lines[0].rstrip('\n').split('\t') == list(SWEEP_COLUMNS)
+    assert len(lines) == 25
+
+    # the start codon is verified as start codon, even if the same codon is used elsewhere
+    for dna in ('TTGGCTAAAGAATAA', 'TTGTTGGCTAAAGAATAA'):
+        assert not sweep(Sequence(dna, 83333, 4227), [{}])[0]['verified']
+        assert not Sequence(dna, 83333, 4227).verify_harmonized_sequence()
+
+    assert parameter_grid(strong_stop=[True, False]) == [{'strong_stop': True}, {'strong_stop': False}]
+    with pytest.raises(ValueError):
+        parse_grid(['origin_id=1,2'])
+    with pytest.raises(ValueError):
+        parse_grid(['strong_stop=maybe'])
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+from LibCharm import IO
+from LibCharm.Sequence import Sequence
+
+SEQUENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_sequence.fasta')
+# first 99 codons of the test sequence and a stop codon
+SHORT_SEQUENCE = str(IO.load_file(SEQUENCE, file_format='fasta'))[:297] + 'TAA'
+
+
+def run_cli(cli, monkeypatch, *arguments):
+    monkeypatch.setattr(sys, 'argv', ['charm-cli.py'] + list(arguments))
+    with pytest.raises(SystemExit) as exit_info:
+        cli.main()
+    return exit_info.value.code
+
+
+def test_cli_sweep(cli, kazusa, monkeypatch, tmpdir):
+    monkeypatch.chdir(tmpdir)
+    assert run_cli(cli, monkeypatch, '--no_cache', '--sweep', 'use_frequency=no,yes', '83333', '4227', SEQUENCE) == 0
+    lines = [line.rstrip('\n').split('\t') for line in tmpdir.join('charm-sweep.tsv').readlines()]
+    rows = [dict(zip(lines[0], line)) for line in lines[1:]]
+    # without --threshold every setting uses the default threshold of fractions or frequencies
+    assert [(row['use_frequency'], row['lower_threshold']) for row in rows] == [('False', '0.1'), ('True', '5')]
+
+    assert run_cli(cli, monkeypatch, '--no_cache', '-t', '0.2', '--sweep', 'use_frequency=no,yes', '83333', '4227',
+                   SEQUENCE) == 0
+    lines = tmpdir.join('charm-sweep.tsv').readlines()
+    assert [line.split('\t')[0] for line in lines[1:]] == ['0.2', '0.2']
+
+
+def test_cli_plot(cli, kazusa, tmpdir):
+    sequence = Sequence(SHORT_SEQUENCE, 83333, 4227)
+    prefix = str(tmpdir.join('short'))
+    assert cli.plot(sequence, prefix, detail='windows', window=10) == [prefix + '_charm_results.svg']
+    filenames = cli.plot(sequence, prefix, detail='codons', codons_per_page=40)
+    assert filenames == [prefix + '_charm_results_page{}.svg'.format(page) for page in (1, 2, 3)]
+    assert cli.plot(sequence, prefix, plot_format='pdf', detail='codons', codons_per_page=40) == \
+        [prefix + '_charm_results.pdf']
+    assert sorted(path.basename for path in tmpdir.listdir()) == \
+        ['short_charm_results.pdf', 'short_charm_results.svg'] + \
+        ['short_charm_results_page{}.svg'.format(page) for page in (1, 2, 3)]
+
+
+def test_cli_autolabel(cli, kazusa, monkeypatch):
+    sequence = Sequence(SHORT_SEQUENCE, 83333, 4227)
+    # no bar exceeds the threshold
+    monkeypatch.setattr(cli, 'difference_threshold', lambda sequence: 1000)
+    fig, ax = cli.matplotlib.pyplot.subplots()
+    cli.plot_codon_usage_differences(sequence, ax)
+    assert len(ax.texts) == len(sequence.codons)
+    cli.autolabel(ax.bar([], []), ax, [])
+    assert len(ax.texts) == len(sequence.codons)
+    cli.matplotlib.pyplot.close(fig)
+
+
+def test_cli_conflicting_modes(cli, monkeypatch, tmpdir, capsys):
+    monkeypatch.chdir(tmpdir)
+    for arguments in (('--sweep', 'strong_stop=yes,no', '--hosts', '4932'),
+                      ('--recommend_hosts', 'index.npz', '--hosts', '4932'),
+                      ('--input_format', 'genbank', '--sweep', 'strong_stop=yes,no')):
+        assert run_cli(cli, monkeypatch, '83333', '4227', SEQUENCE, *arguments) == 2
+        assert 'cannot be combined' in capsys.readouterr().err